@@ -1,13 +1,25 @@
 from flask import Flask
-from app.excel_integration import init_excel_connector
 
 def create_app():
     app = Flask(__name__)
     
+    # Upper bound for a whole request body (bulk archives included);
+    # single images have their own, smaller limit in app.validation
+    import os
+    app.config['MAX_CONTENT_LENGTH'] = int(float(os.environ.get('PEST_MAX_REQUEST_MB', '2048')) * 1024 * 1024)
+    
+    # Behind reverse proxies (Render's, nginx), take the client address
+    # from the X-Forwarded-For entries this many proxies added, so per-client
+    # rate limits don't lump every user under the proxy's address
+    proxies = int(os.environ.get('PEST_TRUSTED_PROXIES', '1' if os.environ.get('RENDER') == 'true' else '0'))
+    if proxies:
+        from werkzeug.middleware.proxy_fix import ProxyFix
+        app.wsgi_app = ProxyFix(app.wsgi_app, x_for=proxies)
+    
     # Initialize Excel connection for real-time updates
     # Only init Excel on local environment, not on render
-    import os
     if os.environ.get('RENDER') != 'true':
+        from app.excel_integration import init_excel_connector
         init_excel_connector()
     
     # Register blueprints
@@ -0,0 +1,243 @@
+import heapq
+import itertools
+import math
+import os
+import threading
+import time
+from collections import Counter, OrderedDict
+
+from app.metrics import ADMISSION_REJECTIONS, ADMISSION_WAIT
+
+# Requests decoding and scoring at once; the rest wait in their lane.
+# In-flight plus queued requests plus /live viewers should stay within
+# gunicorn's threads, since each holds one
+MAX_IN_FLIGHT = int(os.environ.get('PEST_ADMISSION_MAX_IN_FLIGHT', '8'))
+MAX_QUEUE = int(os.environ.get('PEST_ADMISSION_MAX_QUEUE', '8'))
+
+# Lanes in priority order, with the longest a request may wait in each
+# before it's shed
+LANES = OrderedDict([
+    ('interactive', float(os.environ.get('PEST_ADMISSION_INTERACTIVE_WAIT_MS', '1000')) / 1000.0),
+    ('bulk', float(os.environ.get('PEST_ADMISSION_BULK_WAIT_MS', '10000')) / 1000.0),
+])
+
+# Requests per second each client address may make, and how many it may
+# burst; 0 (the default) turns the limit off. Behind a reverse proxy, set
+# PEST_TRUSTED_PROXIES too, or every client shares the proxy's address
+RATE_LIMIT = float(os.environ.get('PEST_RATE_LIMIT', '0'))
+RATE_BURST = float(os.environ.get('PEST_RATE_BURST', '20'))
+
+# Clients with a bucket before idle ones are forgotten
+MAX_CLIENTS = 10000
+
+# Weight of the newest sample in the average time a slot is held
+SERVICE_SMOOTHING = 0.2
+
+
+class Rejected(Exception):
+    """A request turned away: 429 when its client is over the rate limit, 503 when shed."""
+
+    def __init__(self, status, reason, retry_after):
+        super().__init__(reason)
+        self.status = status
+        self.reason = reason
+        # Whole seconds, for the Retry-After header
+        self.retry_after = max(1, int(math.ceil(retry_after)))
+
+
+class TokenBucket:
+    """Refills at rate tokens per second up to burst; each request takes one."""
+
+    def __init__(self, rate, burst, now):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated = now
+
+    def take(self, now):
+        """Take a token; returns 0 if there was one, else the seconds until there is."""
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return 0.0
+        return (1 - self.tokens) / self.rate
+
+
+class RateLimiter:
+    """Per-client token buckets, held in this process's memory."""
+
+    def __init__(self, rate=RATE_LIMIT, burst=RATE_BURST, max_clients=MAX_CLIENTS):
+        self.rate = rate
+        self.burst = max(1.0, burst)
+        self.max_clients = max_clients
+        self.buckets = {}
+        self.lock = threading.Lock()
+
+    def check(self, client):
+        """Return 0 if client may go ahead, else the seconds until it may."""
+        if self.rate <= 0:
+            return 0.0
+        now = time.monotonic()
+        with self.lock:
+            bucket = self.buckets.get(client)
+            if bucket is None:
+                if len(self.buckets) >= self.max_clients:
+                    self._prune(now)
+                bucket = self.buckets[client] = TokenBucket(self.rate, self.burst, now)
+            return bucket.take(now)
+
+    def _prune(self, now):
+        """Forget buckets that have refilled (they'd start full anyway), else the least recent half."""
+        refill = self.burst / self.rate
+        idle = [client for client, bucket in self.buckets.items() if now - bucket.updated >= refill]
+        if not idle:
+            idle = sorted(self.buckets, key=lambda client: self.buckets[client].updated)[:len(self.buckets) // 2]
+        for client in idle:
+            del self.buckets[client]
+
+
+class Slot:
+    """A held in-flight slot; leaving the with block hands it on."""
+
+    def __init__(self, controller):
+        self.controller = controller
+        self.started = time.perf_counter()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.controller.release(time.perf_counter() - self.started)
+
+
+class AdmissionController:
+    """Bound the decode and inference work in flight and shed what can't start in time.
+
+    Up to max_in_flight requests hold a slot at once. The rest wait in
+    priority lanes, first come first served within a lane and higher
+    lanes first, so interactive uploads overtake bulk jobs. A request is
+    shed with a 503 at once when the queue is full or the expected wait
+    (requests ahead of it times the average slot time, over the slots)
+    is over its lane's limit, and otherwise after waiting that long. The
+    requests that are admitted then finish in bounded time, instead of
+    every request queueing until gunicorn gives up on it.
+    """
+
+    def __init__(self, max_in_flight=MAX_IN_FLIGHT, max_queue=MAX_QUEUE, lanes=LANES, rate_limiter=None):
+        self.max_in_flight = max(1, max_in_flight)
+        self.max_queue = max_queue
+        self.lanes = lanes
+        self.rate_limiter = rate_limiter or RateLimiter()
+        self.lock = threading.Lock()
+        self.in_flight = 0
+        # Heap of (lane priority, arrival, waiter)
+        self.waiters = []
+        self.arrivals = itertools.count()
+        # Average seconds a slot is held, once one has been
+        self.service_time = None
+
+        self.queued = Counter()
+        self.admitted = Counter()
+        self.rejected = Counter()
+
+    def limit(self, client, lane):
+        """Raise Rejected (429) if client is over its request rate."""
+        retry_after = self.rate_limiter.check(client)
+        if retry_after:
+            with self.lock:
+                self._reject(lane, 'rate_limited', retry_after, status=429)
+
+    def check(self, lane):
+        """Raise Rejected (503) if a request in lane would be shed right now, without queueing it."""
+        with self.lock:
+            if self.in_flight >= self.max_in_flight:
+                self._shed_if_overloaded(lane)
+
+    def acquire(self, lane, shed=True):
+        """Wait for an in-flight slot in lane and return it as a Slot.
+
+        Raises Rejected (503) when the request is shed; with shed=False it
+        waits as long as it takes, e.g. for the next chunk of a bulk job
+        that has already started streaming its response.
+        """
+        started = time.perf_counter()
+        with self.lock:
+            if self.in_flight < self.max_in_flight and not self.waiters:
+                self.in_flight += 1
+            else:
+                if shed:
+                    self._shed_if_overloaded(lane)
+                self._wait(lane, started + self.lanes[lane] if shed else None)
+            self.admitted[lane] += 1
+        ADMISSION_WAIT.observe(time.perf_counter() - started, lane)
+        return Slot(self)
+
+    def _ahead(self, lane):
+        """Waiters that would be served before a request joining lane now."""
+        priority = list(self.lanes).index(lane)
+        return sum(1 for waiter in self.waiters if waiter[0] <= priority)
+
+    def _shed_if_overloaded(self, lane):
+        # Only waiters ahead count, so queued bulk chunks never shed an
+        # interactive upload
+        ahead = self._ahead(lane)
+        expected = self._expected_wait(lane, ahead)
+        if ahead >= self.max_queue:
+            self._reject(lane, 'queue_full', expected)
+        if expected > self.lanes[lane]:
+            self._reject(lane, 'overloaded', expected)
+
+    def _expected_wait(self, lane, ahead=None):
+        """Seconds a request joining lane now would likely wait for a slot."""
+        if self.service_time is None:
+            return 0.0
+        if ahead is None:
+            ahead = self._ahead(lane)
+        return (ahead + 1) * self.service_time / self.max_in_flight
+
+    def _wait(self, lane, deadline):
+        """Queue in lane until release() hands over a slot or the deadline passes (lock held)."""
+        entry = (list(self.lanes).index(lane), next(self.arrivals), threading.Condition(self.lock))
+        heapq.heappush(self.waiters, entry)
+        self.queued[lane] += 1
+        try:
+            while entry in self.waiters:
+                remaining = None if deadline is None else deadline - time.perf_counter()
+                if remaining is not None and remaining <= 0:
+                    self.waiters.remove(entry)
+                    heapq.heapify(self.waiters)
+                    self._reject(lane, 'timeout', self._expected_wait(lane))
+                entry[2].wait(remaining)
+        finally:
+            self.queued[lane] -= 1
+
+    def release(self, seconds):
+        """Free a slot held for seconds, handing it straight to the next waiter if there is one."""
+        with self.lock:
+            if self.service_time is None:
+                self.service_time = seconds
+            else:
+                self.service_time += SERVICE_SMOOTHING * (seconds - self.service_time)
+            if self.waiters:
+                # The slot moves over without in_flight dropping
+                heapq.heappop(self.waiters)[2].notify()
+            else:
+                self.in_flight -= 1
+
+    def _reject(self, lane, reason, retry_after, status=503):
+        self.rejected[(lane, reason)] += 1
+        ADMISSION_REJECTIONS.inc(lane, reason)
+        raise Rejected(status, reason, retry_after)
+
+    def stats(self):
+        return {
+            'in_flight': self.in_flight,
+            'max_in_flight': self.max_in_flight,
+            'max_queue': self.max_queue,
+            'queued': {lane: self.queued[lane] for lane in self.lanes},
+            'admitted': {lane: self.admitted[lane] for lane in self.lanes},
+            'rejected': {f'{lane}/{reason}': count for (lane, reason), count in sorted(self.rejected.items())},
+            'service_ms': round(self.service_time * 1000.0, 3) if self.service_time is not None else None,
+            'rate_limited_clients': len(self.rate_limiter.buckets)
+        }
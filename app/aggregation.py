@@ -0,0 +1,87 @@
+import threading
+import time
+from datetime import datetime
+
+
+def format_rows(merged):
+    """Turn {pest: (count, timestamp, location)} into workbook-style rows."""
+    rows = {}
+    for pest, (count, updated, location) in merged.items():
+        rows[pest] = {
+            'Count': count,
+            'Last Updated': datetime.fromtimestamp(updated).strftime("%Y-%m-%d %H:%M:%S"),
+            'Location': location
+        }
+    return rows
+
+
+class DetectionStore:
+    """Thread-safe per-pest detection counters.
+
+    One dict of [count, timestamp, location] entries behind one lock. Each
+    add() holds it for a few dict updates, and readers copy the entries
+    under it and format them after letting go, so snapshots are consistent
+    and cheap. Sharding the counters was measured slower than this under
+    the GIL (benchmarks/bench_aggregation.py), so there is one lock.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._version = 0
+        self._entries = {}
+
+    def add(self, detections, location="Default", timestamp=None):
+        """Add {pest: count} detections seen at location."""
+        if timestamp is None:
+            timestamp = time.time()
+        with self._lock:
+            for pest, count in detections.items():
+                entry = self._entries.get(pest)
+                if entry is None:
+                    self._entries[pest] = [count, timestamp, location]
+                else:
+                    entry[0] += count
+                    entry[1] = timestamp
+                    entry[2] = location
+            self._version += 1
+
+    def restore(self, deltas):
+        """Add back {pest: (count, timestamp, location)} from drain() that couldn't be handed on."""
+        with self._lock:
+            for pest, (count, updated, location) in deltas.items():
+                entry = self._entries.get(pest)
+                if entry is None:
+                    self._entries[pest] = [count, updated, location]
+                else:
+                    entry[0] += count
+                    # Counts added since the drain may be newer
+                    if updated >= entry[1]:
+                        entry[1] = updated
+                        entry[2] = location
+            self._version += 1
+
+    def version(self):
+        """Return a number that changes whenever any counter changes."""
+        # Reading an int attribute is atomic; no need for the lock
+        return self._version
+
+    def snapshot(self):
+        """Return (version, {pest: {'Count', 'Last Updated', 'Location'}})."""
+        with self._lock:
+            version = self._version
+            entries = {pest: tuple(entry) for pest, entry in self._entries.items()}
+        return version, format_rows(entries)
+
+    def drain(self):
+        """Return {pest: (count, timestamp, location)} and reset the counters.
+
+        Used to hand the counts accumulated since the last drain to a shared
+        backend.
+        """
+        with self._lock:
+            entries, self._entries = self._entries, {}
+        return {pest: tuple(entry) for pest, entry in entries.items()}
+
+    def totals(self):
+        """Return {pest: count}."""
+        return {pest: row['Count'] for pest, row in self.snapshot()[1].items()}
@@ -0,0 +1,82 @@
+import io
+import os
+import tarfile
+import zipfile
+
+from app.validation import MAX_IMAGE_BYTES, UploadTooLarge, allowed_filename, read_limited, sniff_image_type
+
+ARCHIVE_EXTENSIONS = ('.zip', '.tar', '.tar.gz', '.tgz', '.tar.bz2', '.tar.xz')
+
+def is_archive(filename):
+    """Check whether an uploaded filename looks like a ZIP or tar archive."""
+    return (filename or '').lower().endswith(ARCHIVE_EXTENSIONS)
+
+def read_member(stream, size=None):
+    """Read one image, or return None if it is over the size limit."""
+    if size is not None and size > MAX_IMAGE_BYTES:
+        return None
+    try:
+        return read_limited(stream)
+    except UploadTooLarge:
+        return None
+
+def iter_zip_members(fileobj):
+    """Yield (name, bytes) for each image inside a ZIP without extracting to disk."""
+    with zipfile.ZipFile(fileobj) as archive:
+        for info in archive.infolist():
+            if info.is_dir() or not allowed_filename(info.filename):
+                continue
+            with archive.open(info) as member:
+                yield info.filename, read_member(member, info.file_size)
+
+def iter_tar_members(fileobj):
+    """Yield (name, bytes) for each image inside a tar, reading it as a stream."""
+    # 'r|*' reads sequentially and handles any compression
+    with tarfile.open(fileobj=fileobj, mode='r|*') as archive:
+        for info in archive:
+            if not info.isfile() or not allowed_filename(info.name):
+                continue
+            member = archive.extractfile(info)
+            if member is not None:
+                yield info.name, read_member(member, info.size)
+
+def detach_uploads(files):
+    """Take ownership of uploaded file streams as (filename, stream) pairs.
+
+    Flask closes request.files when the view returns, which is before a
+    streamed response has been generated, so the streams are swapped out
+    and the caller becomes responsible for closing them.
+    """
+    uploads = []
+    for file in files:
+        uploads.append((file.filename or '', file.stream))
+        file.stream = io.BytesIO()
+    return uploads
+
+def iter_uploaded_images(uploads):
+    """Yield (name, bytes) for every image in (filename, stream) uploads, expanding archives.
+
+    bytes is None for images over the size limit, and empty for uploads
+    that aren't images (or archives) at all, so every file gets a result.
+    """
+    for filename, stream in uploads:
+        if filename.lower().endswith('.zip'):
+            yield from iter_zip_members(stream)
+        elif is_archive(filename):
+            yield from iter_tar_members(stream)
+        elif sniff_image_type(stream.read(16)):
+            stream.seek(0)
+            yield os.path.basename(filename), read_member(stream)
+        else:
+            yield os.path.basename(filename), b''
+
+def chunked(items, size):
+    """Group an iterable into lists of at most size items."""
+    chunk = []
+    for item in items:
+        chunk.append(item)
+        if len(chunk) >= size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
@@ -0,0 +1,273 @@
+import os
+import threading
+
+import numpy as np
+
+from app.preprocessing import LetterboxPreprocessor
+
+# YOLO weights used when the classifier artifact can't be loaded; give a
+# local file to avoid any download
+YOLO_WEIGHTS = os.environ.get('PEST_YOLO_WEIGHTS', 'yolov8n.pt')
+
+# Pre-exported ONNX graph; when unset, local weights are exported once into
+# the model cache
+YOLO_ONNX = os.environ.get('PEST_YOLO_ONNX')
+
+# 'onnx', 'torch', or 'auto' (ONNX Runtime when available, else PyTorch)
+YOLO_BACKEND = os.environ.get('PEST_YOLO_BACKEND', 'auto')
+
+# Threads one inference call may use (0 = the runtime's default)
+INTRA_OP_THREADS = int(os.environ.get('PEST_INTRA_OP_THREADS', '0'))
+
+# Detections below this confidence aren't counted
+CONF_THRESHOLD = float(os.environ.get('PEST_CONF_THRESHOLD', '0.5'))
+
+
+def parse_thresholds(value):
+    """Parse 'Aphid=0.6,Stem Borer=0.3' into {pest: threshold}."""
+    thresholds = {}
+    for item in value.split(','):
+        if not item.strip():
+            continue
+        pest, _, threshold = item.rpartition('=')
+        try:
+            thresholds[pest.strip()] = float(threshold)
+        except ValueError:
+            print(f"Ignoring bad class threshold {item.strip()!r}; expected pest=number")
+    return thresholds
+
+
+# Per-class overrides of the YOLO box confidence threshold
+CLASS_THRESHOLDS = parse_thresholds(os.environ.get('PEST_CLASS_THRESHOLDS', ''))
+
+# Per-class overrides for the classifier, set apart because its scores are
+# class probabilities that share 1.0 between all pests, not box confidences
+CLASSIFIER_CLASS_THRESHOLDS = parse_thresholds(os.environ.get('PEST_CLASSIFIER_CLASS_THRESHOLDS', ''))
+
+# Boxes are kept down to the lowest threshold of any class
+PREFILTER_THRESHOLD = min([CONF_THRESHOLD] + list(CLASS_THRESHOLDS.values()))
+
+# Pests listed with their confidence in each prediction
+TOP_K = int(os.environ.get('PEST_TOP_K', '3'))
+
+IOU_THRESHOLD = float(os.environ.get('PEST_IOU_THRESHOLD', '0.45'))
+INPUT_SIZE = int(os.environ.get('PEST_YOLO_INPUT_SIZE', '640'))
+MAX_DETECTIONS = 300
+
+
+def class_thresholds(class_names, default=CONF_THRESHOLD, overrides=CLASS_THRESHOLDS):
+    """Confidence thresholds aligned with class_names, with the per-class overrides applied."""
+    return np.array([overrides.get(name, default) for name in class_names], dtype=np.float32)
+
+
+def count_classes(classes, confidences, class_names, threshold=CONF_THRESHOLD):
+    """Turn per-box class ids and confidences into {pest: count} with one mask and bincount.
+
+    threshold is one value or an array with one per class.
+    """
+    known = classes < len(class_names)
+    classes = classes[known].astype(np.intp)
+    threshold = np.asarray(threshold)
+    keep = confidences[known] > (threshold[classes] if threshold.ndim else threshold)
+    counts = np.bincount(classes[keep], minlength=len(class_names))
+    return {class_names[i]: int(counts[i]) for i in np.flatnonzero(counts)}
+
+
+def make_prediction(class_names, counts, confidence_sums, scores, top_k=TOP_K):
+    """Build one image's prediction from per-class arrays.
+
+    counts and confidence_sums cover what was counted; scores (the best
+    confidence seen per class, counted or not) rank the top_k pests.
+    """
+    counted = np.flatnonzero(counts)
+    ranked = [c for c in np.argsort(-scores, kind='stable')[:top_k] if scores[c] > 0]
+    return {
+        'detections': {class_names[c]: int(counts[c]) for c in counted},
+        'confidence': {class_names[c]: round(float(confidence_sums[c] / counts[c]), 4) for c in counted},
+        'top_k': [{'pest': class_names[c], 'confidence': round(float(scores[c]), 4)} for c in ranked],
+    }
+
+
+def summarize_boxes(detections, class_names, thresholds):
+    """Turn one image's Detections into a prediction.
+
+    A box counts when it beats its class's threshold; a pest's confidence
+    is the mean over its counted boxes.
+    """
+    known = detections.classes < len(class_names)
+    classes = detections.classes[known].astype(np.intp)
+    confidences = detections.confidences[known].astype(np.float64)
+    keep = confidences > thresholds[classes]
+    counts = np.bincount(classes[keep], minlength=len(class_names))
+    sums = np.bincount(classes[keep], weights=confidences[keep], minlength=len(class_names))
+    scores = np.zeros(len(class_names))
+    np.maximum.at(scores, classes, confidences)
+    return make_prediction(class_names, counts, sums, scores)
+
+
+def nms(boxes, scores, iou_threshold=IOU_THRESHOLD, groups=None, ios_threshold=None):
+    """Greedy non-maximum suppression over (n, 4) x1, y1, x2, y2 boxes; returns kept indices.
+
+    With groups (e.g. the tile each box came from), a box is also suppressed
+    by a higher-scoring box from another group covering more than
+    ios_threshold of the smaller box, which catches boxes cut at tile seams.
+    """
+    x1, y1, x2, y2 = boxes[:, 0], boxes[:, 1], boxes[:, 2], boxes[:, 3]
+    areas = (x2 - x1) * (y2 - y1)
+    order = np.argsort(scores)[::-1]
+    keep = []
+    while order.size:
+        best = order[0]
+        keep.append(best)
+        rest = order[1:]
+        width = np.clip(np.minimum(x2[best], x2[rest]) - np.maximum(x1[best], x1[rest]), 0, None)
+        height = np.clip(np.minimum(y2[best], y2[rest]) - np.maximum(y1[best], y1[rest]), 0, None)
+        intersection = width * height
+        suppress = intersection / (areas[best] + areas[rest] - intersection + 1e-9) > iou_threshold
+        if groups is not None:
+            ios = intersection / (np.minimum(areas[best], areas[rest]) + 1e-9)
+            suppress |= (ios > ios_threshold) & (groups[rest] != groups[best])
+        order = rest[~suppress]
+    return np.array(keep, dtype=np.intp)
+
+
+def batched_nms(boxes, scores, classes, iou_threshold=IOU_THRESHOLD):
+    """NMS within each class, done as one pass by shifting each class's boxes apart."""
+    if not len(boxes):
+        return np.empty(0, dtype=np.intp)
+    # Shift each class past the largest coordinate so classes never overlap
+    offsets = (classes * (float(boxes.max()) + 1.0))[:, None].astype(boxes.dtype)
+    return nms(boxes + offsets, scores, iou_threshold)
+
+
+class Detections:
+    """Boxes of one image as parallel arrays: xyxy (n, 4), confidences (n,), classes (n,)."""
+
+    __slots__ = ('boxes', 'confidences', 'classes')
+
+    def __init__(self, boxes, confidences, classes):
+        self.boxes = boxes
+        self.confidences = confidences
+        self.classes = classes
+
+    def __len__(self):
+        return len(self.confidences)
+
+
+class TorchYoloBackend:
+    """Ultralytics YOLO on PyTorch; NMS runs inside ultralytics."""
+
+    name = 'torch'
+
+    def __init__(self, weights=YOLO_WEIGHTS, threads=INTRA_OP_THREADS):
+        # Imported here so the sklearn path never pays for torch
+        import torch
+        from ultralytics import YOLO
+        if threads:
+            torch.set_num_threads(threads)
+        self.model = YOLO(weights)
+        self.source = weights
+
+    def __call__(self, images):
+        results = self.model(list(images), verbose=False, conf=PREFILTER_THRESHOLD, iou=IOU_THRESHOLD)
+        return [
+            Detections(
+                r.boxes.xyxy.cpu().numpy(),
+                r.boxes.conf.cpu().numpy(),
+                r.boxes.cls.cpu().numpy().astype(np.intp),
+            )
+            for r in results
+        ]
+
+
+class OnnxYoloBackend:
+    """A YOLOv8 graph exported to ONNX, run with ONNX Runtime on the CPU.
+
+    Letterboxing, confidence filtering and NMS are done in numpy; boxes are
+    returned in the original image's coordinates.
+    """
+
+    name = 'onnx'
+
+    def __init__(self, onnx_path, threads=INTRA_OP_THREADS, input_size=INPUT_SIZE):
+        import onnxruntime as ort
+        options = ort.SessionOptions()
+        options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        if threads:
+            options.intra_op_num_threads = threads
+        # One graph runs at a time per call; parallelism comes from intra-op threads
+        options.inter_op_num_threads = 1
+        self.session = ort.InferenceSession(onnx_path, options, providers=['CPUExecutionProvider'])
+        self.input_name = self.session.get_inputs()[0].name
+        # A graph exported without dynamic axes only takes batches of one at
+        # its fixed size; a dynamic one can run smaller, non-square inputs
+        shape = self.session.get_inputs()[0].shape
+        self.dynamic_batch = not isinstance(shape[0], int)
+        rect = not isinstance(shape[2], int) and not isinstance(shape[3], int)
+        self.preprocessor = LetterboxPreprocessor(input_size, rect=rect)
+        self.source = onnx_path
+
+    def _run(self, batch):
+        if self.dynamic_batch:
+            return self.session.run(None, {self.input_name: batch})[0]
+        return np.concatenate([self.session.run(None, {self.input_name: batch[i:i + 1]})[0]
+                               for i in range(len(batch))])
+
+    def __call__(self, images):
+        if not len(images):
+            return []
+        batch, scales = self.preprocessor.transform(images)
+        # (n, 4 + classes, anchors): center-x, center-y, width, height, class scores
+        outputs = self._run(batch)
+        return [self._postprocess(output, scale, image.shape) for output, scale, image in zip(outputs, scales, images)]
+
+    def _postprocess(self, output, scale, shape):
+        scores = output[4:]
+        classes = scores.argmax(axis=0)
+        confidences = scores[classes, np.arange(scores.shape[1])]
+        keep = np.flatnonzero(confidences > PREFILTER_THRESHOLD)
+        if not keep.size:
+            return Detections(np.empty((0, 4), np.float32), np.empty(0, np.float32), np.empty(0, np.intp))
+
+        cx, cy, w, h = output[:4, keep]
+        boxes = np.stack([cx - w / 2, cy - h / 2, cx + w / 2, cy + h / 2], axis=1) / scale
+        np.clip(boxes[:, 0::2], 0, shape[1], out=boxes[:, 0::2])
+        np.clip(boxes[:, 1::2], 0, shape[0], out=boxes[:, 1::2])
+        confidences = confidences[keep]
+        classes = classes[keep]
+        kept = batched_nms(boxes, confidences, classes)[:MAX_DETECTIONS]
+        return Detections(boxes[kept], confidences[kept], classes[kept])
+
+
+def export_onnx(weights, input_size=INPUT_SIZE):
+    """Export YOLO weights to ONNX once, cached by the weights' size and mtime."""
+    from app.model_loader import CACHE_DIR, _cache_path
+    onnx_path = os.path.splitext(_cache_path(weights))[0] + f"-{input_size}.onnx"
+    if os.path.exists(onnx_path):
+        return onnx_path
+
+    from ultralytics import YOLO
+    os.makedirs(CACHE_DIR, exist_ok=True)
+    exported = YOLO(weights).export(format='onnx', dynamic=True, imgsz=input_size, simplify=False)
+    os.replace(exported, onnx_path)
+    return onnx_path
+
+
+_export_lock = threading.Lock()
+
+
+def load_yolo_backend(kind=YOLO_BACKEND, weights=YOLO_WEIGHTS, onnx_path=YOLO_ONNX):
+    """Build the configured YOLO backend, falling back to PyTorch when ONNX isn't usable."""
+    if kind in ('onnx', 'auto'):
+        try:
+            if not onnx_path:
+                if not os.path.exists(weights):
+                    raise FileNotFoundError(f"no local weights at {weights} to export")
+                with _export_lock:
+                    onnx_path = export_onnx(weights)
+            return OnnxYoloBackend(onnx_path)
+        except Exception as e:
+            if kind == 'onnx':
+                raise
+            print(f"ONNX backend unavailable ({e}); using PyTorch")
+    return TorchYoloBackend(weights)
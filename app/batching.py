@@ -0,0 +1,148 @@
+import os
+import queue
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future
+
+import numpy as np
+
+from app.metrics import BATCH_SIZES, BATCH_STAGES
+
+# Batching window, tunable from the environment
+MAX_BATCH_SIZE = int(os.environ.get('PEST_BATCH_MAX_SIZE', '16'))
+MAX_WAIT_MS = float(os.environ.get('PEST_BATCH_MAX_WAIT_MS', '10'))
+
+# Number of recent batches kept for latency percentiles
+STATS_WINDOW = 1000
+
+
+class BatchScheduler:
+    """Gather concurrent detect calls into batches for a single model call.
+
+    Request threads call submit() and block on the returned result while a
+    background thread collects up to max_batch_size images (or whatever
+    arrived within max_wait_ms of the first one) and runs detect_batch (or
+    the model method named by method) once.
+    """
+
+    def __init__(self, model, max_batch_size=MAX_BATCH_SIZE, max_wait_ms=MAX_WAIT_MS, method='detect_batch'):
+        self.model = model
+        self.method = method
+        self.max_batch_size = max(1, max_batch_size)
+        self.max_wait = max_wait_ms / 1000.0
+        self.queue = queue.Queue()
+        self.thread = None
+        self.running = False
+        self.lock = threading.Lock()
+
+        # Metrics used to tune the window
+        self.batch_sizes = deque(maxlen=STATS_WINDOW)
+        self.queue_waits = deque(maxlen=STATS_WINDOW)
+        self.inference_times = deque(maxlen=STATS_WINDOW)
+        self.total_batches = 0
+        self.total_images = 0
+        self.total_errors = 0
+
+    def start(self):
+        """Start the background batching thread if it isn't running."""
+        with self.lock:
+            if self.running:
+                return
+            self.running = True
+            self.thread = threading.Thread(target=self._run, name='pest-batcher')
+            self.thread.daemon = True
+            self.thread.start()
+
+    def stop(self, timeout=1):
+        """Stop the batching thread after the current batch."""
+        self.running = False
+        if self.thread:
+            self.thread.join(timeout=timeout)
+
+    def submit_async(self, image):
+        """Queue an image and return a Future for its detection result."""
+        self.start()
+        future = Future()
+        self.queue.put((image, future, time.perf_counter()))
+        return future
+
+    def submit(self, image, timeout=None):
+        """Queue an image and wait for its detection result."""
+        return self.submit_async(image).result(timeout=timeout)
+
+    def _collect(self):
+        """Block for the first request, then fill the batch until the window closes."""
+        try:
+            first = self.queue.get(timeout=0.5)
+        except queue.Empty:
+            return []
+
+        batch = [first]
+        deadline = time.perf_counter() + self.max_wait
+        while len(batch) < self.max_batch_size:
+            remaining = deadline - time.perf_counter()
+            try:
+                if remaining > 0:
+                    batch.append(self.queue.get(timeout=remaining))
+                else:
+                    # Window closed; still take whatever is already waiting
+                    batch.append(self.queue.get_nowait())
+            except queue.Empty:
+                break
+        return batch
+
+    def _run(self):
+        while self.running:
+            batch = self._collect()
+            if not batch:
+                continue
+
+            images = [item[0] for item in batch]
+            futures = [item[1] for item in batch]
+            started = time.perf_counter()
+
+            try:
+                results = getattr(self.model, self.method)(images)
+            except Exception as e:
+                print(f"Error running batched detection: {e}")
+                self.total_errors += len(batch)
+                for future in futures:
+                    future.set_exception(e)
+                continue
+
+            finished = time.perf_counter()
+            for future, result in zip(futures, results):
+                future.set_result(result)
+
+            self.total_batches += 1
+            self.total_images += len(batch)
+            self.batch_sizes.append(len(batch))
+            self.inference_times.append(finished - started)
+            self.queue_waits.extend(started - item[2] for item in batch)
+            BATCH_SIZES.observe(len(batch))
+            BATCH_STAGES.observe(finished - started, 'inference')
+            for item in batch:
+                BATCH_STAGES.observe(started - item[2], 'queue_wait')
+
+    def stats(self):
+        """Return batch-size and latency metrics for tuning the window."""
+        def percentiles(values):
+            if not values:
+                return {'p50_ms': 0.0, 'p95_ms': 0.0, 'p99_ms': 0.0}
+            p50, p95, p99 = np.percentile(np.fromiter(values, dtype=float), [50, 95, 99]) * 1000.0
+            return {'p50_ms': round(p50, 3), 'p95_ms': round(p95, 3), 'p99_ms': round(p99, 3)}
+
+        sizes = list(self.batch_sizes)
+        return {
+            'max_batch_size': self.max_batch_size,
+            'max_wait_ms': self.max_wait * 1000.0,
+            'queue_depth': self.queue.qsize(),
+            'total_batches': self.total_batches,
+            'total_images': self.total_images,
+            'total_errors': self.total_errors,
+            'mean_batch_size': round(sum(sizes) / len(sizes), 3) if sizes else 0.0,
+            'max_seen_batch_size': max(sizes) if sizes else 0,
+            'queue_wait': percentiles(list(self.queue_waits)),
+            'inference': percentiles(list(self.inference_times)),
+        }
@@ -0,0 +1,106 @@
+import hashlib
+import os
+import threading
+import time
+from collections import OrderedDict
+
+import cv2
+import numpy as np
+
+# Cache settings, tunable from the environment
+CACHE_SIZE = int(os.environ.get('PEST_CACHE_SIZE', '4096'))
+CACHE_TTL = float(os.environ.get('PEST_CACHE_TTL', '3600'))
+CACHE_PERCEPTUAL = os.environ.get('PEST_CACHE_PERCEPTUAL', 'false') == 'true'
+
+# Whether a cached result still adds to the Excel totals
+COUNT_CACHE_HITS = os.environ.get('PEST_CACHE_COUNT_HITS', 'true') == 'true'
+
+
+def content_key(image_bytes):
+    """Hash the raw upload bytes."""
+    return 'b:' + hashlib.blake2b(image_bytes, digest_size=16).hexdigest()
+
+
+def perceptual_key(image):
+    """Difference hash of a 9x8 grayscale thumbnail.
+
+    Re-encoded or slightly noisy copies of the same frame produce the same
+    64-bit hash.
+    """
+    if image.ndim == 3:
+        image = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
+    thumbnail = cv2.resize(image, (9, 8), interpolation=cv2.INTER_AREA)
+    bits = thumbnail[:, 1:] > thumbnail[:, :-1]
+    return 'p:' + np.packbits(bits).tobytes().hex()
+
+
+class ResultCache:
+    """Size-bounded LRU cache of detection results with a TTL."""
+
+    def __init__(self, max_entries=CACHE_SIZE, ttl=CACHE_TTL, perceptual=CACHE_PERCEPTUAL):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.perceptual = perceptual
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+
+        self.hits = 0
+        self.perceptual_hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    def get(self, key, count_miss=True):
+        """Return the cached result for key, or None.
+
+        Pass count_miss=False when another lookup for the same image follows.
+        """
+        if self.max_entries <= 0:
+            return None
+        now = time.monotonic()
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None and entry[1] < now:
+                del self.entries[key]
+                self.expirations += 1
+                entry = None
+            if entry is None:
+                if count_miss:
+                    self.misses += 1
+                return None
+            self.entries.move_to_end(key)
+            self.hits += 1
+            if key.startswith('p:'):
+                self.perceptual_hits += 1
+            return entry[0]
+
+    def put(self, key, result):
+        """Store a result, evicting the least recently used entries when full."""
+        if self.max_entries <= 0:
+            return
+        with self.lock:
+            self.entries[key] = (result, time.monotonic() + self.ttl)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+                self.evictions += 1
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            'size': len(self.entries),
+            'max_entries': self.max_entries,
+            'ttl_seconds': self.ttl,
+            'perceptual': self.perceptual,
+            'count_hits': COUNT_CACHE_HITS,
+            'hits': self.hits,
+            'perceptual_hits': self.perceptual_hits,
+            'misses': self.misses,
+            'hit_ratio': round(self.hits / lookups, 4) if lookups else 0.0,
+            'evictions': self.evictions,
+            'expirations': self.expirations,
+        }
@@ -0,0 +1,211 @@
+import copy
+import multiprocessing
+import os
+import tempfile
+import time
+from collections import OrderedDict
+
+import joblib
+import numpy as np
+from sklearn.base import BaseEstimator, TransformerMixin, clone
+from sklearn.decomposition import PCA
+from sklearn.model_selection import train_test_split
+from sklearn.pipeline import Pipeline
+
+from app.preprocessing import BatchPreprocessor, decode_grayscale
+from app.schema import PEST_TYPES
+from app.validation import allowed_filename
+
+# Images scored per call when timing batched prediction
+BATCH_SIZE = 32
+
+
+class QuantizedProjection(TransformerMixin, BaseEstimator):
+    """PCA projection whose components are stored as int8.
+
+    Each component is scaled by its largest absolute weight into
+    [-127, 127]. transform() widens the int8 matrix to float32 on every
+    call instead of once at load, so the resident copy (memory-mapped and
+    shared between workers like any other artifact array) stays a quarter
+    of the float32 size, for about half a millisecond more per call at 64
+    components.
+    """
+
+    def __init__(self, n_components=64, random_state=0):
+        self.n_components = n_components
+        self.random_state = random_state
+
+    def fit(self, X, y=None):
+        pca = PCA(self.n_components, svd_solver='randomized', random_state=self.random_state)
+        components = pca.fit(np.asarray(X, dtype=np.float32)).components_.astype(np.float32)
+        scales = np.abs(components).max(axis=1) / 127.0
+        scales[scales == 0] = 1.0
+        self.components_ = np.round(components / scales[:, None]).astype(np.int8)
+        self.scales_ = scales.astype(np.float32)
+        # Centering folded into one offset subtracted after projecting
+        self.offset_ = self._project(pca.mean_.astype(np.float32)[None])[0]
+        self.n_features_in_ = components.shape[1]
+        return self
+
+    def _project(self, X):
+        return (X @ self.components_.T.astype(np.float32)) * self.scales_
+
+    def transform(self, X):
+        return self._project(np.asarray(X, dtype=np.float32)) - self.offset_
+
+
+def _parts(estimator):
+    """The estimator and the fitted estimators inside it (pipeline steps, ensemble members)."""
+    yield estimator
+    for _, step in getattr(estimator, 'steps', []):
+        yield from _parts(step)
+    for member in np.ravel(getattr(estimator, 'estimators_', [])):
+        yield from _parts(member)
+
+
+def to_float32(estimator):
+    """Copy of a fitted estimator with its float64 array attributes stored as float32.
+
+    Linear models and projections then score float32 rows without
+    widening them. Tree ensembles keep their nodes in a compiled structure
+    that stays float64, and already compare features as float32, so they
+    come out unchanged.
+    """
+    estimator = copy.deepcopy(estimator)
+    for part in _parts(estimator):
+        for name, value in list(vars(part).items()):
+            if name.endswith('_') and isinstance(value, np.ndarray) and value.dtype == np.float64:
+                setattr(part, name, value.astype(np.float32))
+    return estimator
+
+
+def load_dataset(directory, preprocessor=None):
+    """Features and labels from a directory with one subdirectory of images per pest.
+
+    Images go through the same decode and preprocessing as uploads, and
+    labels are indexes into PEST_TYPES like the served model's classes.
+    """
+    preprocessor = preprocessor or BatchPreprocessor()
+    features, labels = [], []
+    for name in sorted(os.listdir(directory)):
+        path = os.path.join(directory, name)
+        if not os.path.isdir(path):
+            continue
+        if name not in PEST_TYPES:
+            print(f"Skipping {path}: not a pest type")
+            continue
+        for filename in sorted(os.listdir(path)):
+            if not allowed_filename(filename):
+                continue
+            with open(os.path.join(path, filename), 'rb') as f:
+                image = decode_grayscale(f.read())
+            if image is None:
+                print(f"Skipping {filename}: not a readable image")
+                continue
+            features.append(preprocessor.transform([image])[0].copy())
+            labels.append(PEST_TYPES.index(name))
+    if not features:
+        raise ValueError(f"No labelled images found under {directory}")
+    return np.array(features), np.array(labels)
+
+
+def split(X, y, holdout=0.2, random_state=0):
+    """(X_train, X_test, y_train, y_test), stratified when every class has two images."""
+    stratify = y if np.bincount(y)[np.unique(y)].min() > 1 else None
+    return train_test_split(X, y, test_size=holdout, random_state=random_state, stratify=stratify)
+
+
+def build_variants(model, X_train, y_train, components=(64, 256)):
+    """The original classifier and its compressed variants, by name.
+
+    PCA variants project the 16384 pixels down to a few components and
+    refit a copy of the classifier (same type and settings) on the
+    training split; the int8 ones also store the projection as int8.
+    'refit' is that copy fitted on all the pixels, to tell what the
+    projection costs apart from what retraining changes.
+    """
+    variants = OrderedDict()
+    variants['original'] = model
+    variants['float32'] = to_float32(model)
+    variants['refit'] = to_float32(clone(model).fit(X_train, y_train))
+    for n in components:
+        if n >= min(X_train.shape):
+            print(f"Skipping {n} components: only {min(X_train.shape)} training images/features")
+            continue
+        projection = PCA(n, svd_solver='randomized', random_state=0)
+        variants[f'pca{n}'] = to_float32(Pipeline([('project', projection), ('classify', clone(model))])
+                                         .fit(X_train, y_train))
+        variants[f'pca{n}-int8'] = to_float32(Pipeline([('project', QuantizedProjection(n)), ('classify', clone(model))])
+                                              .fit(X_train, y_train))
+    return variants
+
+
+def _rss():
+    """Resident set size of this process in bytes."""
+    with open('/proc/self/statm') as f:
+        return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+
+
+def _load_and_score(path, features, cache_dir):
+    """Run in a fresh process: resident bytes added by loading path and scoring a batch."""
+    # Imported up front so the libraries' own memory isn't counted
+    import app.compression
+    import app.model_loader
+    app.model_loader.CACHE_DIR = cache_dir
+    before = _rss()
+    model = app.model_loader.load_model(path, 'sklearn').model
+    model.predict_proba(np.zeros((BATCH_SIZE, features), dtype=np.float32))
+    return _rss() - before
+
+
+def resident_mb(path, features):
+    """Memory (MB) a fresh worker holds after loading path the way the app does and scoring once."""
+    with tempfile.TemporaryDirectory() as cache_dir:
+        with multiprocessing.get_context('spawn').Pool(1) as pool:
+            return pool.apply(_load_and_score, (path, features, cache_dir)) / 1e6
+
+
+def _best_ms(func, repeats):
+    best = None
+    for _ in range(repeats):
+        start = time.perf_counter()
+        func()
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best * 1000.0
+
+
+def evaluate(estimator, X_test, y_test, directory, name, repeats=5):
+    """Accuracy, latency, artifact size and resident memory of one variant."""
+    result = {'variant': name}
+    try:
+        result['accuracy'] = float((estimator.predict(X_test) == y_test).mean())
+        batch = X_test[:BATCH_SIZE]
+        result['ms_single'] = _best_ms(lambda: estimator.predict_proba(X_test[:1]), repeats)
+        result['ms_batch'] = _best_ms(lambda: estimator.predict_proba(batch), repeats) / len(batch)
+        # Uncompressed, as the loader's memory-mappable cache stores it
+        path = os.path.join(directory, f'{name}.joblib')
+        joblib.dump(estimator, path)
+        result['size_mb'] = os.path.getsize(path) / 1e6
+        result['rss_mb'] = resident_mb(path, X_test.shape[1])
+        result['path'] = path
+    except Exception as e:
+        print(f"Variant {name} failed: {e}")
+        result['error'] = str(e)
+    return result
+
+
+def choose(results, max_drop=0.01):
+    """The smallest variant within max_drop accuracy of the original, or None."""
+    baseline = results[0].get('accuracy')
+    if baseline is None:
+        return None
+    candidates = [r for r in results if 'error' not in r and r['accuracy'] >= baseline - max_drop]
+    return min(candidates, key=lambda r: (r['size_mb'], r['ms_single']))
+
+
+def save_artifact(estimator, path):
+    """Write the artifact atomically, so a watching ModelManager never sees half a file."""
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    joblib.dump(estimator, tmp_path)
+    os.replace(tmp_path, path)
@@ -1,25 +1,78 @@
 import os
+import tempfile
 import threading
 import time
+from contextlib import contextmanager
 import pandas as pd
 from datetime import datetime
+from openpyxl import load_workbook
+from app.aggregation import DetectionStore
+from app.shared_store import SharedDetectionStore, WriterLease
+from app.history import DetectionHistory, RollupStore, bucket_start
+from app.metrics import EXCEL_STAGES
+from app.schema import DATA_SHEET, PEST_TYPES, VISUALIZATION_SHEET, initial_data
+
+# The Visualization sheet shows hourly counts for this many hours
+VISUALIZATION_HOURS = int(os.environ.get('PEST_VISUALIZATION_HOURS', '24'))
+
+# 'false' keeps the counts, history and live feed without writing a
+# workbook; /dashboard shows the counts as they change either way
+EXCEL_EXPORT = os.environ.get('PEST_EXCEL_EXPORT', 'true') == 'true'
+
+# Seconds between flushes of dirty rows to the workbook
+FLUSH_INTERVAL = float(os.environ.get('PEST_EXCEL_INTERVAL', '30'))
+
+# Seconds between pushes of this worker's counts to the shared store
+SYNC_INTERVAL = float(os.environ.get('PEST_SYNC_INTERVAL', '0.5'))
 
 # Global variables for Excel integration
 excel_file_path = None
-detection_data = {}
 update_thread = None
 running = True
 
+# Detection counters shared by request threads and the flush loop
+store = DetectionStore()
+
+# Cross-worker totals and the lease deciding which worker writes the
+# workbook; only set up when the Excel connector is initialized
+shared_store = None
+writer_lease = None
+
+# Detection event log and rollups; kept in memory until the Excel
+# connector points them at the shared database and a log directory
+history = DetectionHistory(RollupStore('file:pest_detection_history?mode=memory&cache=shared'))
+
+# Workbook kept open between flushes, plus the mtime of our last write so
+# external edits force a reload
+workbook = None
+workbook_mtime = None
+
+# Store versions and rows as of the last successful flush
+flushed_version = None
+flushed_rows = {}
+flushed_history_version = None
+
 def init_excel_connector():
     """Initialize the Excel connection for real-time updates."""
-    global excel_file_path, update_thread
+    global excel_file_path, update_thread, shared_store, writer_lease, history
     
     # Set path to the Excel file (create in user's documents folder by default)
     documents_path = os.path.expanduser("~/Documents")
     excel_file_path = os.path.join(documents_path, "pest_detection_data.xlsx")
     
+    # Every gunicorn worker pushes its counts into one SQLite store next to
+    # the workbook, and a single elected worker exports it
+    db_path = os.environ.get('PEST_SHARED_DB', os.path.join(documents_path, "pest_detection_data.db"))
+    shared_store = SharedDetectionStore(db_path)
+    writer_lease = WriterLease(db_path + '.writer.lock')
+    
+    # Rollups go in the same database; every worker appends its own event
+    # log segments to one directory
+    history_dir = os.environ.get('PEST_HISTORY_DIR', os.path.join(documents_path, "pest_detection_history"))
+    history = DetectionHistory(RollupStore(db_path), history_dir)
+    
     # Create Excel file if it doesn't exist
-    if not os.path.exists(excel_file_path):
+    if EXCEL_EXPORT and writer_lease.acquire() and not os.path.exists(excel_file_path):
         create_excel_file()
     
     # Start the update thread
@@ -27,83 +80,218 @@ def init_excel_connector():
     update_thread.daemon = True
     update_thread.start()
 
-def create_excel_file():
+@contextmanager
+def atomic_path(path):
+    """Yield a temp path next to path and rename it over path on success.
+
+    Readers of the workbook only ever see the old or the new file, never a
+    half-written one.
+    """
+    fd, tmp_path = tempfile.mkstemp(suffix='.xlsx', dir=os.path.dirname(path))
+    os.close(fd)
+    try:
+        yield tmp_path
+        os.replace(tmp_path, path)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
+def create_excel_file(path=None):
     """Create a new Excel file with the required structure."""
-    # Create a DataFrame with pest types
-    pest_types = [
-        "Aphid", "Armyworm", "Beetle", "Bollworm", "Grasshopper", 
-        "Leafhopper", "Mite", "Mosquito", "Stem Borer", "Thrips"
-    ]
-    
-    # Create initial data
-    data = {
-        'Pest Type': pest_types,
-        'Count': [0] * len(pest_types),
-        'Last Updated': [''] * len(pest_types),
-        'Location': [''] * len(pest_types)
-    }
-    
-    df = pd.DataFrame(data)
+    df = pd.DataFrame(initial_data())
+    header, rows = visualization_table()
     
     # Save to Excel (two sheets - one for data, one for visualization)
-    with pd.ExcelWriter(excel_file_path, engine='openpyxl') as writer:
-        df.to_excel(writer, sheet_name='Pest Detection Data', index=False)
-        df[['Pest Type', 'Count']].to_excel(writer, sheet_name='Visualization', index=False)
+    with atomic_path(path or excel_file_path) as tmp_path:
+        with pd.ExcelWriter(tmp_path, engine='openpyxl') as writer:
+            df.to_excel(writer, sheet_name=DATA_SHEET, index=False)
+            pd.DataFrame(rows, columns=header).to_excel(writer, sheet_name=VISUALIZATION_SHEET, index=False)
+
+def visualization_table():
+    """Return (header, rows) of hourly counts per pest from the history rollups."""
+    labels, counts = history.series('hour', VISUALIZATION_HOURS, PEST_TYPES)
+    pests = list(counts)
+    rows = [[label] + [counts[pest][i] for pest in pests] for i, label in enumerate(labels)]
+    return ['Hour'] + pests, rows
+
+def _write_visualization(sheet):
+    """Replace the Visualization sheet contents with the current hourly table."""
+    header, rows = visualization_table()
+    sheet.delete_rows(1, sheet.max_row)
+    sheet.append(header)
+    for row in rows:
+        sheet.append(row)
 
-def update_excel_data(new_detections, location="Default"):
+def update_excel_data(new_detections, location="Default", confidence=None):
     """Update the detection data with new detections."""
-    global detection_data
+    timestamp = time.time()
+    store.add(new_detections, location, timestamp)
+    history.record(new_detections, location, timestamp, confidence)
+    
+    # Without the Excel connector no sync loop flushes the history, so
+    # it's flushed here once enough has built up
+    if update_thread is None and history.flush_due():
+        try:
+            history.flush()
+        except Exception as e:
+            print(f"Error flushing detection history: {e}")
+
+def sync_shared_store():
+    """Push the counts and history gathered by this worker since the last sync."""
+    if shared_store is not None:
+        deltas = store.drain()
+        try:
+            shared_store.push(deltas)
+        except Exception:
+            # Keep the counts for the next sync
+            store.restore(deltas)
+            raise
+    history.flush()
+
+def detection_source():
+    """Return the store holding the totals to report and export."""
+    return shared_store if shared_store is not None else store
+
+def query_history(resolution, start, end, pest=None, location=None):
+    """Return windowed detection counts from the history rollups."""
+    sync_shared_store()
+    return history.query(resolution, start, end, pest, location)
+
+def get_detection_snapshot():
+    """Return a consistent copy of the current per-pest detection data."""
+    sync_shared_store()
+    return detection_source().snapshot()[1]
+
+def _header_columns(sheet):
+    """Map header names in the first row to column numbers."""
+    return {cell.value: cell.column for cell in sheet[1] if cell.value is not None}
+
+def _pest_rows(sheet):
+    """Map pest names in the 'Pest Type' column to row numbers."""
+    column = _header_columns(sheet).get('Pest Type', 1)
+    rows = {}
+    for row in range(2, sheet.max_row + 1):
+        value = sheet.cell(row=row, column=column).value
+        if value is not None:
+            rows[value] = row
+    return rows
+
+def _write_rows(sheet, rows):
+    """Write {pest: {column: value}} into the matching cells, appending unknown pests."""
+    columns = _header_columns(sheet)
+    pest_rows = _pest_rows(sheet)
+    for pest, values in rows.items():
+        row = pest_rows.get(pest)
+        if row is None:
+            row = sheet.max_row + 1
+            sheet.cell(row=row, column=columns.get('Pest Type', 1), value=pest)
+        for column, value in values.items():
+            if column in columns:
+                sheet.cell(row=row, column=columns[column], value=value)
+
+def flush_excel():
+    """Write the rows changed since the last flush to the workbook.
+
+    Returns True if the workbook was written, False if nothing was dirty.
+    """
+    global workbook, workbook_mtime, flushed_version, flushed_rows, flushed_history_version
     
-    # Add timestamps to new detections
-    timestamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+    # A worker that took over the export may find no workbook yet
+    if not os.path.exists(excel_file_path):
+        create_excel_file()
+        flushed_version = None
+        flushed_rows = {}
     
-    # Update counts
-    for pest, count in new_detections.items():
-        if pest in detection_data:
-            detection_data[pest]['Count'] += count
-        else:
-            detection_data[pest] = {
-                'Count': count, 
-                'Last Updated': timestamp,
-                'Location': location
-            }
+    source = detection_source()
+    # The hourly table also changes when a new hour starts
+    history.flush()
+    history_version = (history.rollups.version(), bucket_start(time.time(), 'hour'))
+    if source.version() == flushed_version and history_version == flushed_history_version:
+        return False
+    
+    version, snapshot = source.snapshot()
+    rows = {pest: data for pest, data in snapshot.items() if flushed_rows.get(pest) != data}
+    if not rows and history_version == flushed_history_version:
+        flushed_version = version
+        return False
+    
+    try:
+        # Reuse the open workbook unless someone else changed the file
+        mtime = os.path.getmtime(excel_file_path)
+        if workbook is None or mtime != workbook_mtime:
+            workbook = load_workbook(excel_file_path)
+        
+        _write_rows(workbook[DATA_SHEET], rows)
+        if history_version != flushed_history_version:
+            _write_visualization(workbook[VISUALIZATION_SHEET])
         
-        # Update timestamp
-        detection_data[pest]['Last Updated'] = timestamp
+        with atomic_path(excel_file_path) as tmp_path:
+            workbook.save(tmp_path)
+        workbook_mtime = os.path.getmtime(excel_file_path)
+    
+    except Exception:
+        # Reload from disk next time; the rows stay dirty until written
+        workbook = None
+        raise
+    
+    flushed_version = version
+    flushed_rows = snapshot
+    flushed_history_version = history_version
+    return True
+
+def add_to_workbook(path, new_detections, location="Default"):
+    """Add detections straight into the workbook at path, keeping its counts.
+
+    For single-process callers like the video loop, which write their own
+    workbook instead of going through the flush loop. Unknown pests are
+    appended; the Visualization sheet shows this process's hourly history.
+    """
+    if not os.path.exists(path):
+        create_excel_file(path)
+    
+    timestamp = time.time()
+    history.record(new_detections, location, timestamp)
+    history.flush()
+    
+    book = load_workbook(path)
+    sheet = book[DATA_SHEET]
+    count_column = _header_columns(sheet).get('Count', 2)
+    pest_rows = _pest_rows(sheet)
+    updated = datetime.fromtimestamp(timestamp).strftime("%Y-%m-%d %H:%M:%S")
+    rows = {}
+    for pest, count in new_detections.items():
+        current = sheet.cell(row=pest_rows[pest], column=count_column).value if pest in pest_rows else 0
+        rows[pest] = {'Count': (current or 0) + count, 'Last Updated': updated, 'Location': location}
+    _write_rows(sheet, rows)
+    _write_visualization(book[VISUALIZATION_SHEET])
+    
+    with atomic_path(path) as tmp_path:
+        book.save(tmp_path)
 
 def excel_update_loop():
-    """Background thread to periodically update the Excel file."""
-    global running, detection_data, excel_file_path
+    """Background thread to sync counts and periodically flush changed rows to Excel."""
+    global running
     
+    last_flush = 0.0
     while running:
-        # Only update if there's data and the excel file exists
-        if detection_data and os.path.exists(excel_file_path):
+        try:
+            with EXCEL_STAGES.time('sync'):
+                sync_shared_store()
+        except Exception as e:
+            print(f"Error syncing detection counts: {e}")
+        
+        # Only the elected writer touches the workbook
+        now = time.monotonic()
+        if EXCEL_EXPORT and now - last_flush >= FLUSH_INTERVAL and (writer_lease is None or writer_lease.acquire()):
+            last_flush = now
             try:
-                # Read the current Excel file
-                df = pd.read_excel(excel_file_path, sheet_name='Pest Detection Data')
-                
-                # Update the DataFrame with new detection data
-                for pest, data in detection_data.items():
-                    # Find the row index for this pest
-                    idx = df[df['Pest Type'] == pest].index
-                    if len(idx) > 0:
-                        df.at[idx[0], 'Count'] = data['Count']
-                        df.at[idx[0], 'Last Updated'] = data['Last Updated']
-                        if 'Location' in data:
-                            df.at[idx[0], 'Location'] = data['Location']
-                
-                # Save the updated DataFrame back to Excel
-                with pd.ExcelWriter(excel_file_path, engine='openpyxl') as writer:
-                    df.to_excel(writer, sheet_name='Pest Detection Data', index=False)
-                    
-                    # Update the visualization sheet
-                    df[['Pest Type', 'Count']].to_excel(writer, sheet_name='Visualization', index=False)
-            
+                with EXCEL_STAGES.time('flush'):
+                    flush_excel()
             except Exception as e:
                 print(f"Error updating Excel: {e}")
         
         # Sleep for a while before the next update
-        time.sleep(2)
+        time.sleep(SYNC_INTERVAL)
 
 def cleanup():
     """Clean up resources when the application is shutting down."""
@@ -112,3 +300,14 @@ def cleanup():
     running = False
     if update_thread:
         update_thread.join(timeout=1)
+    
+    # Hand over anything not yet pushed and let another worker take the export
+    try:
+        sync_shared_store()
+        history.flush(force_segment=True)
+        if EXCEL_EXPORT and writer_lease is not None and writer_lease.held:
+            flush_excel()
+    except Exception as e:
+        print(f"Error syncing detection counts: {e}")
+    if writer_lease is not None:
+        writer_lease.release()
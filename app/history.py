@@ -0,0 +1,260 @@
+import json
+import os
+import threading
+import time
+from datetime import datetime
+
+import numpy as np
+
+from app.shared_store import SQLiteStore
+
+# Rollup resolutions and their bucket width in seconds
+RESOLUTIONS = {'minute': 60, 'hour': 3600, 'day': 86400}
+
+# Events buffered in memory before a segment is written
+SEGMENT_EVENTS = int(os.environ.get('PEST_HISTORY_SEGMENT_EVENTS', '65536'))
+SEGMENT_MAX_AGE = float(os.environ.get('PEST_HISTORY_SEGMENT_AGE', '60'))
+
+# Pending rollups due a flush by this many keys or seconds since the last
+# one, for callers that record without a sync loop flushing behind them
+PENDING_MAX_KEYS = int(os.environ.get('PEST_HISTORY_PENDING_KEYS', '1024'))
+PENDING_MAX_AGE = float(os.environ.get('PEST_HISTORY_PENDING_AGE', '5'))
+
+# Columns of the event log and their on-disk dtypes
+EVENT_COLUMNS = {
+    'timestamp': np.float64,
+    'pest': np.int32,
+    'count': np.int32,
+    'location': np.int32,
+    'confidence': np.float32,
+}
+
+
+def bucket_start(timestamp, resolution):
+    """Return the start of the local-time bucket containing timestamp."""
+    width = RESOLUTIONS[resolution]
+    offset = time.localtime(timestamp).tm_gmtoff
+    return int((timestamp + offset) // width * width - offset)
+
+
+def format_time(timestamp):
+    return datetime.fromtimestamp(timestamp).strftime("%Y-%m-%d %H:%M:%S")
+
+
+class RollupStore(SQLiteStore):
+    """Pre-aggregated minute/hour/day detection counts per pest and location."""
+
+    def create_tables(self, conn):
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS rollups ("
+            "resolution TEXT NOT NULL, bucket INTEGER NOT NULL, "
+            "pest TEXT NOT NULL, location TEXT NOT NULL, "
+            "count INTEGER NOT NULL, events INTEGER NOT NULL, "
+            "confidence_sum REAL NOT NULL, confidence_events INTEGER NOT NULL, "
+            "PRIMARY KEY (resolution, bucket, pest, location)) WITHOUT ROWID"
+        )
+        conn.execute("CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value INTEGER NOT NULL)")
+
+    def push(self, deltas):
+        """Add {(resolution, bucket, pest, location): [count, events, conf_sum, conf_events]}."""
+        if not deltas:
+            return
+        conn = self._connect()
+        with conn:
+            conn.execute("BEGIN IMMEDIATE")
+            conn.executemany(
+                "INSERT INTO rollups VALUES (?, ?, ?, ?, ?, ?, ?, ?) "
+                "ON CONFLICT(resolution, bucket, pest, location) DO UPDATE SET "
+                "count = count + excluded.count, events = events + excluded.events, "
+                "confidence_sum = confidence_sum + excluded.confidence_sum, "
+                "confidence_events = confidence_events + excluded.confidence_events",
+                [key + tuple(values) for key, values in deltas.items()]
+            )
+            self._bump_version(conn, 'rollups')
+
+    def version(self):
+        return self._read_version(self._connect(), 'rollups')
+
+    def query(self, resolution, start, end, pest=None, location=None):
+        """Return rollup rows with start <= bucket < end, oldest first."""
+        sql = ("SELECT bucket, pest, location, count, events, confidence_sum, confidence_events "
+               "FROM rollups WHERE resolution = ? AND bucket >= ? AND bucket < ?")
+        params = [resolution, int(start), int(end)]
+        if pest is not None:
+            sql += " AND pest = ?"
+            params.append(pest)
+        if location is not None:
+            sql += " AND location = ?"
+            params.append(location)
+        sql += " ORDER BY bucket"
+        return self._connect().execute(sql, params).fetchall()
+
+
+class DetectionHistory:
+    """Append-only detection event log with windowed rollups.
+
+    Each record() appends (timestamp, pest, count, location, confidence)
+    events to in-memory column buffers and adds them to pending minute, hour
+    and day rollups. flush() pushes the pending rollups to the RollupStore,
+    and full buffers are written out as columnar segments: one directory of
+    .npy files per segment that can be memory-mapped when scanned.
+    """
+
+    def __init__(self, rollups, log_dir=None):
+        self.rollups = rollups
+        self.log_dir = log_dir
+        self.lock = threading.Lock()
+        self.pending = {}
+        self.flushed_at = time.monotonic()
+        self._reset_buffer()
+        if log_dir:
+            os.makedirs(log_dir, exist_ok=True)
+
+    def _reset_buffer(self):
+        self.columns = {name: [] for name in EVENT_COLUMNS}
+        self.pests = {}
+        self.locations = {}
+        self.buffer_started = time.monotonic()
+
+    def record(self, detections, location="Default", timestamp=None, confidence=None):
+        """Append one event per pest in {pest: count}.
+
+        confidence may be a single value or a {pest: confidence} dict.
+        """
+        if timestamp is None:
+            timestamp = time.time()
+        buckets = [(resolution, bucket_start(timestamp, resolution)) for resolution in RESOLUTIONS]
+
+        with self.lock:
+            for pest, count in detections.items():
+                score = confidence.get(pest) if isinstance(confidence, dict) else confidence
+
+                if self.log_dir:
+                    self.columns['timestamp'].append(timestamp)
+                    self.columns['pest'].append(self.pests.setdefault(pest, len(self.pests)))
+                    self.columns['count'].append(count)
+                    self.columns['location'].append(self.locations.setdefault(location, len(self.locations)))
+                    self.columns['confidence'].append(np.nan if score is None else score)
+
+                for key in buckets:
+                    entry = self.pending.get(key + (pest, location))
+                    if entry is None:
+                        entry = self.pending[key + (pest, location)] = [0, 0, 0.0, 0]
+                    entry[0] += count
+                    entry[1] += 1
+                    if score is not None:
+                        entry[2] += score
+                        entry[3] += 1
+
+    def flush_due(self):
+        """Whether enough is pending, or for long enough, that it should be flushed."""
+        return bool(self.pending) and (
+            len(self.pending) >= PENDING_MAX_KEYS
+            or time.monotonic() - self.flushed_at >= PENDING_MAX_AGE
+        )
+
+    def flush(self, force_segment=False):
+        """Push pending rollups and write the event buffer if it is due."""
+        with self.lock:
+            pending, self.pending = self.pending, {}
+            self.flushed_at = time.monotonic()
+            write_segment = self.columns['timestamp'] and (
+                force_segment
+                or len(self.columns['timestamp']) >= SEGMENT_EVENTS
+                or time.monotonic() - self.buffer_started >= SEGMENT_MAX_AGE
+            )
+            if write_segment:
+                columns, pests, locations = self.columns, self.pests, self.locations
+                self._reset_buffer()
+
+        try:
+            self.rollups.push(pending)
+        except Exception:
+            # Keep the deltas for the next flush
+            with self.lock:
+                for key, values in pending.items():
+                    entry = self.pending.setdefault(key, [0, 0, 0.0, 0])
+                    for i, value in enumerate(values):
+                        entry[i] += value
+            raise
+        finally:
+            # The buffer was taken out above, so it's written out whether
+            # or not the rollups made it
+            if write_segment:
+                self._write_segment(columns, pests, locations)
+
+    def _write_segment(self, columns, pests, locations):
+        timestamps = columns['timestamp']
+        name = f"seg-{int(min(timestamps) * 1000)}-{int(max(timestamps) * 1000)}-{os.getpid()}"
+        tmp_dir = os.path.join(self.log_dir, '.' + name)
+        os.makedirs(tmp_dir)
+        for column, dtype in EVENT_COLUMNS.items():
+            np.save(os.path.join(tmp_dir, column + '.npy'), np.asarray(columns[column], dtype=dtype))
+        with open(os.path.join(tmp_dir, 'names.json'), 'w') as file:
+            json.dump({'pest': list(pests), 'location': list(locations)}, file)
+        # Readers only ever see complete segments
+        os.rename(tmp_dir, os.path.join(self.log_dir, name))
+
+    def events(self, start, end):
+        """Return the raw events with start <= timestamp < end as numpy columns.
+
+        Segments whose time range doesn't overlap are skipped by name; the
+        others are memory-mapped and filtered with one mask per segment.
+        """
+        parts = []
+        for name in sorted(os.listdir(self.log_dir)) if self.log_dir else []:
+            if not name.startswith('seg-'):
+                continue
+            first, last = (int(value) / 1000.0 for value in name.split('-')[1:3])
+            if last < start or first >= end:
+                continue
+            path = os.path.join(self.log_dir, name)
+            with open(os.path.join(path, 'names.json')) as file:
+                names = json.load(file)
+            data = {column: np.load(os.path.join(path, column + '.npy'), mmap_mode='r')
+                    for column in EVENT_COLUMNS}
+            mask = (data['timestamp'] >= start) & (data['timestamp'] < end)
+            part = {column: np.asarray(values[mask]) for column, values in data.items()}
+            part['pest'] = np.asarray(names['pest'], dtype=object)[part['pest']]
+            part['location'] = np.asarray(names['location'], dtype=object)[part['location']]
+            parts.append(part)
+
+        if not parts:
+            return {column: np.empty(0, dtype=object if column in ('pest', 'location') else dtype)
+                    for column, dtype in EVENT_COLUMNS.items()}
+        return {column: np.concatenate([part[column] for part in parts]) for column in EVENT_COLUMNS}
+
+    def query(self, resolution, start, end, pest=None, location=None):
+        """Return rollup rows for [start, end) as dicts, newest data included."""
+        if resolution not in RESOLUTIONS:
+            raise ValueError(f"Unknown resolution: {resolution}")
+        self.flush()
+        rows = []
+        for bucket, row_pest, row_location, count, events, conf_sum, conf_events in self.rollups.query(
+                resolution, start, end, pest, location):
+            rows.append({
+                'bucket': format_time(bucket),
+                'timestamp': bucket,
+                'pest': row_pest,
+                'location': row_location,
+                'count': count,
+                'events': events,
+                'mean_confidence': conf_sum / conf_events if conf_events else None
+            })
+        return rows
+
+    def series(self, resolution, periods, pests, end=None):
+        """Return (bucket labels, {pest: [count per bucket]}) for the last periods buckets."""
+        if end is None:
+            end = time.time()
+        width = RESOLUTIONS[resolution]
+        last = bucket_start(end, resolution)
+        starts = [last - width * i for i in range(periods - 1, -1, -1)]
+        index = {bucket: i for i, bucket in enumerate(starts)}
+        counts = {pest: [0] * periods for pest in pests}
+
+        for row in self.query(resolution, starts[0], last + width):
+            i = index.get(row['timestamp'])
+            if i is not None:
+                counts.setdefault(row['pest'], [0] * periods)[i] += row['count']
+        return [format_time(bucket) for bucket in starts], counts
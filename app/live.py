@@ -0,0 +1,171 @@
+import json
+import os
+import threading
+import time
+from collections import deque
+
+# Seconds between checks of the aggregates; changes within a tick go out
+# as one event
+TICK = float(os.environ.get('PEST_LIVE_TICK', '1'))
+
+# Seconds of silence after which a comment line keeps proxies from closing
+# the stream (and finds out whether the client is still there)
+HEARTBEAT = float(os.environ.get('PEST_LIVE_HEARTBEAT', '15'))
+
+# Streams one worker serves at once; each holds a worker thread, so keep
+# this below gunicorn's threads to leave room for /detect
+MAX_SUBSCRIBERS = int(os.environ.get('PEST_LIVE_MAX_SUBSCRIBERS', '16'))
+
+# Events kept for subscribers that fall behind; one further back gets a
+# fresh snapshot instead
+BACKLOG = 64
+
+
+def encode_event(event, data, event_id=None):
+    """One Server-Sent Events message as bytes."""
+    lines = []
+    if event_id is not None:
+        lines.append(f'id: {event_id}')
+    lines.append(f'event: {event}')
+    lines.append(f'data: {json.dumps(data, separators=(",", ":"))}')
+    return ('\n'.join(lines) + '\n\n').encode()
+
+
+class LiveFeed:
+    """Push per-pest count changes to Server-Sent Events subscribers.
+
+    One thread checks the aggregates' version once per tick and, only when
+    it moved, diffs a snapshot against the last one and encodes the changed
+    rows once. Subscribers wait on a condition and write out the encoded
+    events they haven't sent yet, so each viewer costs a parked thread and
+    a write per tick, with no store or workbook reads of its own. The
+    thread only polls while someone is subscribed.
+    """
+
+    def __init__(self, source, tick=TICK, heartbeat=HEARTBEAT, max_subscribers=MAX_SUBSCRIBERS):
+        # Callable returning the store to watch (version() and snapshot())
+        self.source = source
+        self.tick = tick
+        self.heartbeat = heartbeat
+        self.max_subscribers = max_subscribers
+        self.condition = threading.Condition()
+        self.poll_lock = threading.Lock()
+        self.thread = None
+        self.running = False
+
+        # Last rows sent, and the encoded events since, numbered by sequence
+        self.version = None
+        self.rows = {}
+        self.sequence = 0
+        self.events = deque(maxlen=BACKLOG)
+        self.snapshot_message = None
+
+        self.subscribers = 0
+        self.total_events = 0
+        self.total_polls = 0
+
+    def start(self):
+        """Start the polling thread if it isn't running."""
+        if self.running:
+            return
+        with self.condition:
+            if self.running:
+                return
+            self.running = True
+            self.thread = threading.Thread(target=self._run, name='pest-live-feed')
+            self.thread.daemon = True
+            self.thread.start()
+
+    def stop(self, timeout=1):
+        with self.condition:
+            self.running = False
+            self.condition.notify_all()
+        if self.thread:
+            self.thread.join(timeout=timeout)
+
+    def full(self):
+        return self.subscribers >= self.max_subscribers
+
+    def _run(self):
+        while self.running:
+            time.sleep(self.tick)
+            if not self.subscribers:
+                continue
+            try:
+                self.poll()
+            except Exception as e:
+                print(f"Error polling live detection counts: {e}")
+
+    def poll(self):
+        """Publish the rows changed since the last poll; returns True if an event went out."""
+        with self.poll_lock:
+            self.total_polls += 1
+            store = self.source()
+            if store.version() == self.version:
+                return False
+            version, rows = store.snapshot()
+            changed = {pest: row for pest, row in rows.items() if self.rows.get(pest) != row}
+            self.version = version
+            if not changed:
+                return False
+            self.rows = rows
+            with self.condition:
+                self.sequence += 1
+                self.events.append((self.sequence, encode_event('delta', {
+                    'pests': changed,
+                    'total': sum(row['Count'] for row in rows.values()),
+                    'time': time.time()
+                }, self.sequence)))
+                self.snapshot_message = None
+                self.total_events += 1
+                self.condition.notify_all()
+            return True
+
+    def _snapshot(self):
+        """Return (sequence, encoded full snapshot); shared by everyone joining at that sequence."""
+        with self.condition:
+            if self.snapshot_message is None:
+                self.snapshot_message = (self.sequence, encode_event('snapshot', {
+                    'pests': self.rows,
+                    'total': sum(row['Count'] for row in self.rows.values()),
+                    'time': time.time()
+                }, self.sequence))
+            return self.snapshot_message
+
+    def subscribe(self):
+        """Yield the SSE stream for one client: a snapshot, then deltas as they happen."""
+        self.start()
+        with self.condition:
+            self.subscribers += 1
+        try:
+            # Catch up first so a new viewer doesn't wait a tick for the counts
+            self.poll()
+            seen, message = self._snapshot()
+            yield message
+            while self.running:
+                with self.condition:
+                    self.condition.wait_for(lambda: self.sequence != seen or not self.running, self.heartbeat)
+                    if self.sequence == seen:
+                        messages = [b': keep-alive\n\n']
+                    elif not self.events or self.events[0][0] > seen + 1:
+                        # Fell behind the backlog; start over from a snapshot
+                        messages = None
+                    else:
+                        messages = [message for sequence, message in self.events if sequence > seen]
+                        seen = self.sequence
+                if messages is None:
+                    seen, message = self._snapshot()
+                    messages = [message]
+                yield b''.join(messages)
+        finally:
+            with self.condition:
+                self.subscribers -= 1
+
+    def stats(self):
+        return {
+            'subscribers': self.subscribers,
+            'max_subscribers': self.max_subscribers,
+            'events': self.total_events,
+            'polls': self.total_polls,
+            'tick_seconds': self.tick
+        }
@@ -0,0 +1,284 @@
+import bisect
+import os
+import sys
+import threading
+import time
+from collections import Counter
+
+# Stage histograms and request counters; PEST_METRICS=false turns every
+# timer into a no-op
+METRICS_ENABLED = os.environ.get('PEST_METRICS', 'true') == 'true'
+
+# Requests carrying this header get a Server-Timing header with their stage
+# times; PEST_TRACE_ALL=true traces every request
+TRACE_HEADER = 'X-Pest-Trace'
+TRACE_ALL = os.environ.get('PEST_TRACE_ALL', 'false') == 'true'
+
+# The /debug/profile sampling profiler is only exposed when enabled
+PROFILER_ENABLED = os.environ.get('PEST_PROFILER', 'false') == 'true'
+PROFILE_INTERVAL = float(os.environ.get('PEST_PROFILE_INTERVAL_MS', '5')) / 1000.0
+
+# Upper bounds (seconds) of the latency histogram buckets
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+# Stage times of the request being traced on this thread
+_local = threading.local()
+
+
+def format_labels(names, values):
+    if not names:
+        return ''
+    return '{' + ','.join(f'{name}="{value}"' for name, value in zip(names, values)) + '}'
+
+
+def format_value(value):
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Histogram:
+    """Cumulative-bucket histogram in the Prometheus style."""
+
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.lock = threading.Lock()
+
+    def observe(self, value):
+        index = bisect.bisect_left(self.buckets, value)
+        with self.lock:
+            self.counts[index] += 1
+            self.sum += value
+
+    def samples(self, name, label_names, label_values):
+        with self.lock:
+            counts = list(self.counts)
+            total = self.sum
+        names = label_names + ('le',)
+        cumulative = 0
+        for bound, count in zip(self.buckets + ('+Inf',), counts):
+            cumulative += count
+            yield f'{name}_bucket{format_labels(names, label_values + (bound,))} {cumulative}'
+        labels = format_labels(label_names, label_values)
+        yield f'{name}_sum{labels} {format_value(total)}'
+        yield f'{name}_count{labels} {cumulative}'
+
+
+class Timer:
+    """Context manager that records its duration in a histogram and the current trace."""
+
+    __slots__ = ('histogram', 'stage', 'start')
+
+    def __init__(self, histogram, stage):
+        self.histogram = histogram
+        self.stage = stage
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        elapsed = time.perf_counter() - self.start
+        if self.histogram is not None:
+            self.histogram.observe(elapsed)
+        trace = getattr(_local, 'trace', None)
+        if trace is not None:
+            trace.append((self.stage, elapsed))
+        return False
+
+
+class NullTimer:
+    """Stand-in for Timer when neither metrics nor tracing are on."""
+
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+NULL_TIMER = NullTimer()
+
+
+class HistogramFamily:
+    """Histograms of one metric, one per combination of label values."""
+
+    def __init__(self, name, help, label_names=(), buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.help = help
+        self.label_names = tuple(label_names)
+        self.buckets = tuple(buckets)
+        self.children = {}
+        self.lock = threading.Lock()
+
+    def labels(self, *values):
+        child = self.children.get(values)
+        if child is None:
+            with self.lock:
+                child = self.children.setdefault(values, Histogram(self.buckets))
+        return child
+
+    def observe(self, value, *values):
+        if METRICS_ENABLED:
+            self.labels(*values).observe(value)
+
+    def time(self, stage):
+        """Time a block as the given stage (the family's single label)."""
+        if METRICS_ENABLED:
+            return Timer(self.labels(stage), stage)
+        if getattr(_local, 'trace', None) is not None:
+            return Timer(None, stage)
+        return NULL_TIMER
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.help}', f'# TYPE {self.name} histogram']
+        for values, child in sorted(self.children.items()):
+            lines.extend(child.samples(self.name, self.label_names, values))
+        return lines
+
+
+class CounterFamily:
+    """Monotonic counters of one metric, keyed by label values."""
+
+    def __init__(self, name, help, label_names=()):
+        self.name = name
+        self.help = help
+        self.label_names = tuple(label_names)
+        self.values = Counter()
+        self.lock = threading.Lock()
+
+    def inc(self, *values, amount=1):
+        if METRICS_ENABLED:
+            with self.lock:
+                self.values[values] += amount
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.help}', f'# TYPE {self.name} counter']
+        with self.lock:
+            items = sorted(self.values.items())
+        for values, value in items:
+            lines.append(f'{self.name}{format_labels(self.label_names, values)} {format_value(value)}')
+        return lines
+
+
+class Registry:
+    """All metric families of this process, rendered in the text exposition format.
+
+    Metrics are per process; under gunicorn each worker reports its own.
+    Collectors are called at render time and return
+    [(name, type, help, [(labels dict, value)])] for values that already
+    live elsewhere, like the scheduler and cache counters.
+    """
+
+    def __init__(self):
+        self.families = []
+        self.collectors = []
+
+    def histogram(self, name, help, label_names=(), buckets=LATENCY_BUCKETS):
+        family = HistogramFamily(name, help, label_names, buckets)
+        self.families.append(family)
+        return family
+
+    def counter(self, name, help, label_names=()):
+        family = CounterFamily(name, help, label_names)
+        self.families.append(family)
+        return family
+
+    def add_collector(self, collector):
+        self.collectors.append(collector)
+
+    def render(self):
+        lines = []
+        for family in self.families:
+            lines.extend(family.render())
+        for collector in self.collectors:
+            for name, kind, help, samples in collector():
+                lines.append(f'# HELP {name} {help}')
+                lines.append(f'# TYPE {name} {kind}')
+                for labels, value in samples:
+                    lines.append(f'{name}{format_labels(tuple(labels), tuple(labels.values()))} {format_value(value)}')
+        return '\n'.join(lines) + '\n'
+
+
+registry = Registry()
+
+REQUEST_STAGES = registry.histogram(
+    'pest_request_stage_seconds', 'Time spent in each stage of POST /detect.', ('stage',))
+MODEL_STAGES = registry.histogram(
+    'pest_model_stage_seconds', 'Time spent in each stage of a model call.', ('stage',))
+BATCH_STAGES = registry.histogram(
+    'pest_batch_stage_seconds', 'Queue wait per image and inference per batch in the scheduler.', ('stage',))
+BATCH_SIZES = registry.histogram(
+    'pest_batch_size', 'Images per batched model call.', (), buckets=(1, 2, 4, 8, 16, 32, 64, 128))
+EXCEL_STAGES = registry.histogram(
+    'pest_excel_stage_seconds', 'Time spent syncing counts and flushing the workbook.', ('stage',))
+HTTP_LATENCY = registry.histogram(
+    'pest_http_request_seconds', 'HTTP request latency by endpoint.', ('endpoint', 'method'))
+CASCADE_IMAGES = registry.counter(
+    'pest_cascade_images_total', 'Images answered by each stage of the classifier-first cascade.', ('stage',))
+HTTP_REQUESTS = registry.counter(
+    'pest_http_requests_total', 'HTTP requests by endpoint and status.', ('endpoint', 'method', 'status'))
+ADMISSION_WAIT = registry.histogram(
+    'pest_admission_wait_seconds', 'Time admitted requests waited for an inference slot, by lane.', ('lane',))
+ADMISSION_REJECTIONS = registry.counter(
+    'pest_admission_rejections_total', 'Requests rate limited (429) or shed (503), by lane and reason.',
+    ('lane', 'reason'))
+
+
+def start_trace():
+    """Start collecting stage times for the request on this thread."""
+    _local.trace = []
+
+
+def finish_trace():
+    """Stop tracing and return the collected [(stage, seconds)], or None."""
+    trace = getattr(_local, 'trace', None)
+    _local.trace = None
+    return trace
+
+
+def server_timing(trace, total=None):
+    """Format stage times as a Server-Timing header value."""
+    parts = [f'{stage};dur={seconds * 1000.0:.3f}' for stage, seconds in trace]
+    if total is not None:
+        parts.append(f'total;dur={total * 1000.0:.3f}')
+    return ', '.join(parts)
+
+
+class SamplingProfiler:
+    """Samples the stacks of all other threads at a fixed interval.
+
+    The result is in the collapsed-stack format read by flamegraph tools:
+    one line per distinct stack, frames joined by ';', then the sample count.
+    """
+
+    def __init__(self, interval=PROFILE_INTERVAL):
+        self.interval = interval
+        self.stacks = Counter()
+        self.samples = 0
+
+    def sample(self):
+        own = threading.get_ident()
+        for thread_id, frame in sys._current_frames().items():
+            if thread_id == own:
+                continue
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                stack.append(f'{code.co_name} ({os.path.basename(code.co_filename)}:{frame.f_lineno})')
+                frame = frame.f_back
+            self.stacks[';'.join(reversed(stack))] += 1
+        self.samples += 1
+
+    def run(self, seconds):
+        """Sample for the given number of seconds (on the calling thread)."""
+        deadline = time.perf_counter() + seconds
+        while time.perf_counter() < deadline:
+            self.sample()
+            time.sleep(self.interval)
+        return self
+
+    def collapsed(self):
+        return '\n'.join(f'{stack} {count}' for stack, count in self.stacks.most_common()) + '\n'
@@ -1,69 +1,254 @@
-import pickle
-import cv2
-import numpy as np
-from ultralytics import YOLO
+import threading
 import os
+import numpy as np
+from app.model_loader import MODEL_TYPE, load_model
+from app.preprocessing import BatchPreprocessor, decode_color, decode_full, decode_grayscale
+from app.metrics import CASCADE_IMAGES, MODEL_STAGES
+from app.backends import CLASSIFIER_CLASS_THRESHOLDS, class_thresholds, make_prediction, summarize_boxes
+from app.tiling import TILED, TILE_BATCH, TILE_OVERLAP, TILE_SIZE, merge_tiles, split_tiles
+from app.schema import PEST_TYPES
+
+# Path to the model file (PEST_MODEL_PATH serves another artifact, such as
+# one written by compress_model.py)
+MODEL_PATH = os.environ.get('PEST_MODEL_PATH') or os.path.join(os.path.dirname(os.path.dirname(__file__)), 'pest_detection_model_2.pkl')
+
+# The classifier's top class is counted when its probability is above this
+# (0 counts every image, as a bare predict() did); per-pest overrides come
+# from PEST_CLASSIFIER_CLASS_THRESHOLDS, not YOLO's PEST_CLASS_THRESHOLDS
+CLASSIFIER_THRESHOLD = float(os.environ.get('PEST_CLASSIFIER_THRESHOLD', '0'))
 
-# Path to the model file
-MODEL_PATH = os.path.join(os.path.dirname(os.path.dirname(__file__)), 'pest_detection_model_2.pkl')
+# The same in tiled mode, per tile. This one can't be 0: the classifier has
+# no background class, so every tile of a large photo would name some pest
+TILE_CLASSIFIER_THRESHOLD = float(os.environ.get('PEST_TILE_CLASSIFIER_THRESHOLD', '0.5'))
+
+# Cheap-first cascade: images the classifier is less sure of than this are
+# scored again by the YOLO detector (not in tiled mode)
+CASCADE = os.environ.get('PEST_CASCADE', 'false') == 'true'
+CASCADE_THRESHOLD = float(os.environ.get('PEST_CASCADE_THRESHOLD', '0.8'))
 
 class PestDetectionModel:
-    def __init__(self):
-        # Load the model
-        try:
-            with open(MODEL_PATH, 'rb') as file:
-                self.model = pickle.load(file)
-            self.model_type = "sklearn"
-        except:
-            # Fallback to YOLO if the pickled model fails
-            self.model = YOLO('yolov8n.pt')
-            self.model_type = "yolo"
+    """The detection engine used by the web app, the video loop and batch jobs.
+
+    The model behind it comes from the model_loader backend registry:
+    either a classifier giving one pest per image or a YOLO-style detector
+    whose boxes are counted per pest. With cascade on, a classifier handles
+    the images it's sure of and passes the rest on to YOLO.
+    """
+    
+    def __init__(self, model_path=None, tiled=None, backend=None, cascade=None):
+        # The model itself is loaded lazily on first use (or up front by
+        # model_loader.preload in the gunicorn master)
+        self.model_path = model_path or MODEL_PATH
+        # Tiled mode keeps full resolution for small pests in large photos
+        self.tiled = TILED if tiled is None else tiled
+        # Registered model type to load; None tries each in turn
+        self.backend = backend or MODEL_TYPE
+        self.cascade = CASCADE if cascade is None else cascade
+        self.detector = None
+        self.loaded = None
+        self._lock = threading.Lock()
+        self.preprocessor = BatchPreprocessor()
         
         # Class names for detected pests
-        self.class_names = [
-            "Aphid", "Armyworm", "Beetle", "Bollworm", "Grasshopper", 
-            "Leafhopper", "Mite", "Mosquito", "Stem Borer", "Thrips"
-        ]
+        self.class_names = list(PEST_TYPES)
+    
+    def load(self):
+        """Load the model if it hasn't been loaded yet."""
+        if self.loaded is None:
+            with self._lock:
+                if self.loaded is None:
+                    self.loaded = load_model(self.model_path, self.backend)
+        return self.loaded
+    
+    @property
+    def model(self):
+        return self.load().model
+    
+    @property
+    def model_type(self):
+        return self.load().model_type
+    
+    @property
+    def version(self):
+        return self.load().version
+    
+    def info(self):
+        """Describe the loaded model for health checks."""
+        if self.loaded is None:
+            return {'loaded': False}
+        return {
+            'loaded': True,
+            'type': self.loaded.model_type,
+            'source': self.loaded.source,
+            'version': self.loaded.version,
+            'load_seconds': round(self.loaded.load_seconds, 4)
+        }
     
     def preprocess_image(self, image):
         """Preprocess the image for the model."""
         if self.model_type == "sklearn":
-            # Convert to grayscale and resize
-            gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
-            resized = cv2.resize(gray, (128, 128))
-            # Flatten the image
-            flattened = resized.flatten() / 255.0
-            return flattened
+            # Grayscale, 128x128, flattened and scaled to [0, 1]
+            return self.preprocessor.transform([image])[0].copy()
         else:
             # YOLO model doesn't need preprocessing
             return image
     
+    def decode(self, image_bytes):
+        """Decode upload bytes into the image format this model needs (None if invalid)."""
+        if self.tiled:
+            # Tiles are cut from the full-resolution image
+            return decode_full(image_bytes, grayscale=self.model_type == "sklearn")
+        if self.model_type == "sklearn" and not self.cascade:
+            # The classifier only looks at a small grayscale image (decoded
+            # at reduced resolution with PEST_REDUCED_DECODE)
+            return decode_grayscale(image_bytes)
+        return decode_color(image_bytes)
+    
     def detect(self, image):
         """Detect pests in the given image."""
-        processed_image = self.preprocess_image(image)
+        return self.detect_batch([image])[0]
+    
+    def detect_batch(self, images):
+        """Detect pests in a list of images with a single model call; returns {pest: count} per image."""
+        return [prediction['detections'] for prediction in self.predict_batch(images)]
+    
+    def predict_batch(self, images):
+        """Score a list of images with a single model call.
         
+        Returns one dict per image: 'detections' ({pest: count}),
+        'confidence' ({pest: confidence} for the counted pests) and 'top_k'
+        (the most likely pests, counted or not). Cascade results also say
+        which 'stage' answered.
+        """
+        if not images:
+            return []
+        if self.tiled:
+            return self.predict_tiled_batch(images)
+        
+        if self.model_type == "sklearn":
+            predictions = self._classify(images)
+            if self.cascade:
+                self._escalate(images, predictions)
+            return predictions
+        
+        # Make prediction with the YOLO backend (one call for the whole list)
+        with MODEL_STAGES.time('predict'):
+            results = self.model(list(images))
+        with MODEL_STAGES.time('postprocess'):
+            thresholds = class_thresholds(self.class_names)
+            return [summarize_boxes(r, self.class_names, thresholds) for r in results]
+    
+    def _probabilities(self, batch):
+        """Class probabilities for a preprocessed batch, as (n, len(class_names))."""
+        if not hasattr(self.model, 'predict_proba'):
+            # No probabilities: the predicted class gets all of it
+            predictions = np.asarray(self.model.predict(batch), dtype=np.intp)
+            return np.eye(len(self.class_names), dtype=np.float32)[predictions]
+        probabilities = self.model.predict_proba(batch)
+        # Columns follow the model's classes_, which may skip some pests
+        full = np.zeros((len(batch), len(self.class_names)), dtype=probabilities.dtype)
+        full[:, np.asarray(self.model.classes_, dtype=np.intp)] = probabilities
+        return full
+    
+    def _classify(self, images):
+        """One prediction per image from a single predict_proba call."""
+        # Preprocess into one float32 2D array and predict once
+        with MODEL_STAGES.time('preprocess'):
+            batch = self.preprocessor.transform(images)
+        with MODEL_STAGES.time('predict'):
+            probabilities = self._probabilities(batch)
+        with MODEL_STAGES.time('postprocess'):
+            rows = np.arange(len(images))
+            best = probabilities.argmax(axis=1)
+            confidence = probabilities[rows, best]
+            counted = confidence > class_thresholds(self.class_names, CLASSIFIER_THRESHOLD,
+                                                    CLASSIFIER_CLASS_THRESHOLDS)[best]
+            counts = np.zeros(probabilities.shape, dtype=np.intp)
+            counts[rows[counted], best[counted]] = 1
+            return [make_prediction(self.class_names, counts[i], counts[i] * probabilities[i], probabilities[i])
+                    for i in rows]
+    
+    def second_stage(self):
+        """The YOLO detector behind the classifier in cascade mode."""
+        if self.detector is None:
+            with self._lock:
+                if self.detector is None:
+                    self.detector = PestDetectionModel(self.model_path, self.tiled, backend='yolo', cascade=False)
+        return self.detector
+    
+    def _escalate(self, images, predictions):
+        """Re-score the images the classifier isn't sure of with YOLO, in place."""
+        unsure = [i for i, prediction in enumerate(predictions)
+                  if not prediction['top_k'] or prediction['top_k'][0]['confidence'] < CASCADE_THRESHOLD]
+        CASCADE_IMAGES.inc('classifier', amount=len(images) - len(unsure))
+        for prediction in predictions:
+            prediction['stage'] = 'classifier'
+        if not unsure:
+            return
+        CASCADE_IMAGES.inc('detector', amount=len(unsure))
+        for i, prediction in zip(unsure, self.second_stage().predict_batch([images[i] for i in unsure])):
+            prediction['stage'] = 'detector'
+            predictions[i] = prediction
+    
+    def detect_tiled_batch(self, images, tile=TILE_SIZE, overlap=TILE_OVERLAP):
+        """Tiled detection, returning {pest: count} per image."""
+        return [prediction['detections'] for prediction in self.predict_tiled_batch(images, tile, overlap)]
+    
+    def predict_tiled_batch(self, images, tile=TILE_SIZE, overlap=TILE_OVERLAP):
+        """Detect pests in overlapping tiles of each image, run together in batches.
+
+        YOLO boxes are mapped back to image coordinates and merged across
+        tile seams before counting. The classifier gives one class per tile
+        and can't tell how many pests a tile holds, so it reports each pest
+        found confidently in any tile once per image, as it does untiled.
+        """
+        if not images:
+            return []
         if self.model_type == "sklearn":
-            # Make prediction with sklearn model
-            prediction = self.model.predict([processed_image])
-            result = {
-                self.class_names[prediction[0]]: 1
-            }
+            overlap = 0
+            thresholds = class_thresholds(self.class_names, TILE_CLASSIFIER_THRESHOLD, CLASSIFIER_CLASS_THRESHOLDS)
+            if (thresholds <= 0).any():
+                raise ValueError("tiled classification needs tile thresholds above 0")
         else:
-            # Make prediction with YOLO model
-            results = self.model(image)
-            
-            # Process the results
-            result = {}
-            for r in results:
-                boxes = r.boxes
-                for box in boxes:
-                    cls = int(box.cls[0])
-                    conf = float(box.conf[0])
-                    if cls < len(self.class_names) and conf > 0.5:
-                        pest_name = self.class_names[cls]
-                        if pest_name in result:
-                            result[pest_name] += 1
-                        else:
-                            result[pest_name] = 1
+            thresholds = class_thresholds(self.class_names)
+        
+        tiles, owners, offsets = [], [], []
+        for i, image in enumerate(images):
+            image_tiles, image_offsets = split_tiles(image, tile, overlap)
+            tiles.extend(image_tiles)
+            owners.extend([i] * len(image_tiles))
+            offsets.append(image_offsets)
+        owners = np.array(owners)
+        chunks = range(0, len(tiles), TILE_BATCH)
         
-        return result
+        if self.model_type == "sklearn":
+            probabilities = np.concatenate([self._classify_tiles(tiles[start:start + TILE_BATCH]) for start in chunks])
+            best = probabilities.argmax(axis=1)
+            confidence = probabilities[np.arange(len(tiles)), best]
+            # Best tile per (image, class); a class is found when that tile
+            # is confident, and its confidence is that tile's
+            classes = len(self.class_names)
+            cells = owners * classes + best
+            shape = (len(images), classes)
+            scores = np.zeros(shape[0] * classes)
+            np.maximum.at(scores, cells, confidence)
+            scores = scores.reshape(shape)
+            counts = (scores > thresholds).astype(np.int64)
+            sums = scores * counts
+            return [make_prediction(self.class_names, counts[i], sums[i], scores[i]) for i in range(len(images))]
+        
+        with MODEL_STAGES.time('predict'):
+            detections = [d for start in chunks for d in self.model(tiles[start:start + TILE_BATCH])]
+        with MODEL_STAGES.time('postprocess'):
+            results = []
+            for i, image_offsets in enumerate(offsets):
+                merged = merge_tiles([detections[t] for t in np.flatnonzero(owners == i)], image_offsets)
+                results.append(summarize_boxes(merged, self.class_names, thresholds))
+            return results
+    
+    def _classify_tiles(self, tiles):
+        """Class probabilities per tile."""
+        with MODEL_STAGES.time('preprocess'):
+            batch = self.preprocessor.transform(tiles)
+        with MODEL_STAGES.time('predict'):
+            return self._probabilities(batch)
@@ -0,0 +1,149 @@
+import hashlib
+import os
+import threading
+import time
+from collections import OrderedDict, namedtuple
+
+import joblib
+
+# Where memory-mappable copies of model artifacts are kept
+CACHE_DIR = os.environ.get('PEST_MODEL_CACHE', os.path.expanduser("~/.cache/pest_detection"))
+
+# Load only this registered model type instead of trying each in turn
+MODEL_TYPE = os.environ.get('PEST_MODEL_TYPE') or None
+
+# version is a hash of the artifact's contents and signature its (size,
+# mtime), both taken just before loading; a watcher compares them against
+# the file on disk to spot a new artifact
+LoadedModel = namedtuple('LoadedModel', ['model', 'model_type', 'load_seconds', 'source', 'version', 'signature'],
+                         defaults=(None, None))
+
+# Models already loaded in this process, by artifact path and model type.
+# Filled in the gunicorn master by preload() so forked workers inherit the
+# loaded pages.
+_loaded = {}
+_lock = threading.Lock()
+
+
+def _cache_path(path):
+    """Name the cached copy after the artifact's size and mtime so edits invalidate it."""
+    stat = os.stat(path)
+    name = os.path.splitext(os.path.basename(path))[0]
+    return os.path.join(CACHE_DIR, f"{name}-{stat.st_size}-{stat.st_mtime_ns}.joblib")
+
+
+def artifact_signature(path):
+    """(size, mtime) of the artifact, or None if it doesn't exist."""
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return None
+    return stat.st_size, stat.st_mtime_ns
+
+
+def artifact_version(path):
+    """Short hash of the artifact's contents, or None if it can't be read."""
+    digest = hashlib.blake2b(digest_size=8)
+    try:
+        with open(path, 'rb') as f:
+            for block in iter(lambda: f.read(1024 * 1024), b''):
+                digest.update(block)
+    except OSError:
+        return None
+    return digest.hexdigest()
+
+
+def _load_mmap(path):
+    """Load an artifact with its numpy arrays memory-mapped read-only.
+
+    The artifact is re-dumped once as an uncompressed joblib file, whose
+    arrays joblib can map straight from the OS page cache; every process
+    loading the same cache file then shares those pages.
+    """
+    try:
+        cache_path = _cache_path(path)
+        if not os.path.exists(cache_path):
+            os.makedirs(CACHE_DIR, exist_ok=True)
+            tmp_path = f"{cache_path}.{os.getpid()}.tmp"
+            joblib.dump(joblib.load(path), tmp_path)
+            os.replace(tmp_path, cache_path)
+        return joblib.load(cache_path, mmap_mode='r'), cache_path
+    except OSError as e:
+        # Read-only cache location: map the artifact itself where possible
+        print(f"Model cache unavailable ({e}); loading {path} directly")
+        return joblib.load(path, mmap_mode='r'), path
+
+
+def _load_sklearn(path):
+    """A scikit-learn classifier artifact, memory-mapped."""
+    model, source = _load_mmap(path)
+    if not hasattr(model, 'predict'):
+        raise TypeError(f"{type(model).__name__} has no predict()")
+    return model, source
+
+
+def _load_yolo(path):
+    """The YOLO detector; path is ignored, the weights come from PEST_YOLO_* settings."""
+    # Imported here so the sklearn path never pays for torch/onnxruntime
+    from app.backends import load_yolo_backend
+    model = load_yolo_backend()
+    return model, f"{model.source} ({model.name})"
+
+
+# Model types and their loaders, tried in order. A loader takes the artifact
+# path and returns (model, source); the model is either a classifier with
+# predict() ('sklearn') or a callable turning a list of images into
+# Detections, like the YOLO backends.
+BACKENDS = OrderedDict()
+
+
+def register_backend(model_type, loader):
+    """Add or replace the loader for model_type."""
+    BACKENDS[model_type] = loader
+
+
+register_backend('sklearn', _load_sklearn)
+register_backend('yolo', _load_yolo)
+
+
+def load_model(path, model_type=MODEL_TYPE, reload=False):
+    """Load the model artifact at path once per process.
+
+    Each registered backend is tried in turn, so an artifact that can't be
+    loaded as a classifier falls back to YOLO. A model_type loads only that
+    backend. reload=True loads the artifact again even if it was loaded
+    before, e.g. after it was replaced on disk.
+    """
+    key = (path, model_type)
+    with _lock:
+        if key in _loaded and not reload:
+            return _loaded[key]
+
+        if model_type and model_type not in BACKENDS:
+            raise ValueError(f"Unknown model type {model_type!r}; expected one of {', '.join(BACKENDS)}")
+        candidates = [model_type] if model_type else list(BACKENDS)
+
+        start = time.perf_counter()
+        signature = artifact_signature(path)
+        version = artifact_version(path)
+        for i, candidate in enumerate(candidates):
+            try:
+                model, source = BACKENDS[candidate](path)
+                break
+            except Exception as e:
+                if i == len(candidates) - 1:
+                    raise
+                print(f"Could not load {path} as {candidate} ({e}); falling back to {candidates[i + 1]}")
+
+        loaded = LoadedModel(model, candidate, time.perf_counter() - start, source, version or source, signature)
+        print(f"Loaded {candidate} model {loaded.version} from {source} in {loaded.load_seconds:.3f}s")
+        _loaded[key] = loaded
+        return loaded
+
+
+def preload(path=None):
+    """Load the default model artifact now, e.g. in the gunicorn master before fork."""
+    if path is None:
+        from app.model import MODEL_PATH
+        path = MODEL_PATH
+    return load_model(path)
@@ -0,0 +1,186 @@
+import os
+import threading
+import time
+
+import cv2
+import numpy as np
+
+from app.batching import MAX_BATCH_SIZE
+from app.model import PestDetectionModel
+from app.model_loader import artifact_signature, artifact_version, load_model
+
+# Seconds between checks of the model artifact for changes (0 disables reloading)
+WATCH_INTERVAL = float(os.environ.get('PEST_MODEL_WATCH_INTERVAL', '5'))
+
+# Batches run through a newly loaded model before it takes traffic
+WARMUP_ROUNDS = int(os.environ.get('PEST_MODEL_WARMUP_ROUNDS', '3'))
+
+
+def warmup_images(count, seed=0):
+    """Synthetic camera-sized JPEGs, encoded so warm-up also exercises decoding."""
+    rng = np.random.default_rng(seed)
+    images = []
+    for _ in range(count):
+        # Smooth noise compresses like a photo rather than like static
+        small = rng.integers(0, 256, (60, 80, 3), dtype=np.uint8)
+        image = cv2.resize(small, (640, 480), interpolation=cv2.INTER_CUBIC)
+        images.append(cv2.imencode('.jpg', image)[1].tobytes())
+    return images
+
+
+class ModelManager:
+    """Serve a PestDetectionModel and hot-swap it when its artifact changes.
+
+    A background thread polls the artifact's size and mtime. Once a change
+    has held still for one poll (so a file still being copied isn't read),
+    the contents are hashed; a new version is loaded next to the active
+    one, warmed up on sample batches, and only then swapped in with a single
+    attribute assignment. Calls already running keep their reference to the
+    old model and finish on it. If loading or warm-up fails, the old model
+    stays active until the artifact changes again.
+
+    A reload keeps the active model type: uploads are decoded differently
+    for a classifier and for YOLO, so switching between them still takes a
+    restart.
+    """
+
+    def __init__(self, model_path=None, interval=WATCH_INTERVAL, warmup_rounds=WARMUP_ROUNDS):
+        self.current = PestDetectionModel(model_path)
+        self.model_path = self.current.model_path
+        self.interval = interval
+        self.warmup_rounds = warmup_rounds
+        self.thread = None
+        self.running = False
+        self.lock = threading.Lock()
+        # Called with (old, new) after each swap, e.g. to drop cached results
+        self.listeners = []
+        self.pending_signature = None
+        self.failed_signature = None
+
+        self.reloads = 0
+        self.reload_errors = 0
+        self.last_error = None
+        self.last_reload = None
+
+    def start(self):
+        """Start the watcher thread if it isn't running (and reloading is enabled)."""
+        if self.running or self.interval <= 0:
+            return
+        with self.lock:
+            if self.running:
+                return
+            self.running = True
+            self.thread = threading.Thread(target=self._run, name='pest-model-watcher')
+            self.thread.daemon = True
+            self.thread.start()
+
+    def stop(self, timeout=1):
+        self.running = False
+        if self.thread:
+            self.thread.join(timeout=timeout)
+
+    def on_swap(self, listener):
+        self.listeners.append(listener)
+
+    # The active model's interface; each call uses whichever model is
+    # active when it starts
+
+    @property
+    def model_type(self):
+        return self.current.model_type
+
+    @property
+    def version(self):
+        return self.current.version
+
+    def decode(self, image_bytes):
+        return self.current.decode(image_bytes)
+
+    def detect(self, image):
+        return self.current.detect(image)
+
+    def detect_batch(self, images):
+        return self.current.detect_batch(images)
+
+    def predict_batch(self, images):
+        return self.current.predict_batch(images)
+
+    def info(self):
+        """Describe the active model and the reload history for health checks."""
+        info = self.current.info()
+        info.update({
+            'watching': self.running,
+            'reloads': self.reloads,
+            'reload_errors': self.reload_errors,
+            'last_reload': self.last_reload,
+            'last_reload_error': self.last_error,
+        })
+        return info
+
+    def _run(self):
+        while self.running:
+            time.sleep(self.interval)
+            try:
+                self.check()
+            except Exception as e:
+                print(f"Error checking model artifact: {e}")
+
+    def check(self):
+        """Reload if the artifact changed since the active model was loaded.
+
+        Returns True if a new model was swapped in.
+        """
+        loaded = self.current.load()
+        signature = artifact_signature(self.model_path)
+        if signature is None or signature in (loaded.signature, self.failed_signature):
+            self.pending_signature = None
+            return False
+        # Wait until the file has stopped changing
+        if signature != self.pending_signature:
+            self.pending_signature = signature
+            return False
+        self.pending_signature = None
+
+        if artifact_version(self.model_path) == loaded.version:
+            # Touched but not changed; remember the new mtime
+            self.current.loaded = loaded._replace(signature=signature)
+            return False
+        if not self.reload():
+            self.failed_signature = signature
+            return False
+        return True
+
+    def reload(self):
+        """Load, warm up and swap in the artifact as it is now on disk."""
+        old = self.current
+        start = time.perf_counter()
+        try:
+            candidate = PestDetectionModel(self.model_path, old.tiled, old.model_type)
+            candidate.loaded = load_model(self.model_path, candidate.backend, reload=True)
+            self.warm_up(candidate)
+        except Exception as e:
+            self.reload_errors += 1
+            self.last_error = str(e)
+            print(f"Keeping model {old.version}; reload of {self.model_path} failed: {e}")
+            return False
+
+        self.current = candidate
+        self.reloads += 1
+        self.last_error = None
+        self.last_reload = time.time()
+        print(f"Swapped model {old.version} for {candidate.version} "
+              f"({time.perf_counter() - start:.2f}s including warm-up)")
+        for listener in self.listeners:
+            listener(old, candidate)
+        return True
+
+    def warm_up(self, model):
+        """Run full-size batches through model so its first requests aren't slow."""
+        if self.warmup_rounds <= 0:
+            return
+        images = [model.decode(data) for data in warmup_images(MAX_BATCH_SIZE)]
+        if any(image is None for image in images):
+            raise ValueError("warm-up images could not be decoded")
+        for _ in range(self.warmup_rounds):
+            model.detect_batch(images)
+            model.detect_batch(images[:1])
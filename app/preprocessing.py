@@ -0,0 +1,180 @@
+import io
+import os
+import threading
+
+import cv2
+import numpy as np
+from PIL import Image
+
+# Input size of the sklearn classifier
+TARGET_SIZE = (128, 128)
+
+# Decode classifier input at reduced resolution. Off by default: the
+# reduced decode gives different features from the full decode the model
+# was trained on, and benchmarks/bench_preprocess.py --agreement shows how
+# often that changes its answer. Turn it on with a model trained on them
+REDUCED_DECODE = os.environ.get('PEST_REDUCED_DECODE', 'false') == 'true'
+
+# Smallest image the YOLO path is given; it letterboxes to 640 anyway
+COLOR_MIN_SIZE = (640, 640)
+
+# Reduced-resolution decode flags, largest reduction first
+REDUCED_GRAYSCALE = ((8, cv2.IMREAD_REDUCED_GRAYSCALE_8),
+                     (4, cv2.IMREAD_REDUCED_GRAYSCALE_4),
+                     (2, cv2.IMREAD_REDUCED_GRAYSCALE_2))
+REDUCED_COLOR = ((8, cv2.IMREAD_REDUCED_COLOR_8),
+                 (4, cv2.IMREAD_REDUCED_COLOR_4),
+                 (2, cv2.IMREAD_REDUCED_COLOR_2))
+
+
+def image_size(image_bytes):
+    """Return (width, height) from the image header without decoding pixels."""
+    try:
+        with Image.open(io.BytesIO(image_bytes)) as image:
+            return image.size
+    except Exception:
+        return None
+
+
+def reduction_for(size, target=TARGET_SIZE, flags=REDUCED_GRAYSCALE):
+    """Pick the largest decode reduction that still leaves at least target pixels."""
+    if size is not None:
+        width, height = size
+        for factor, flag in flags:
+            if width // factor >= target[0] and height // factor >= target[1]:
+                return flag
+    return None
+
+
+def decode_grayscale(image_bytes, target=TARGET_SIZE, reduced=None):
+    """Decode image bytes to grayscale for the classifier (None if invalid).
+
+    By default this is the training pipeline's color decode and cvtColor,
+    so the features match it exactly. With reduced (or PEST_REDUCED_DECODE)
+    JPEGs are decoded straight to grayscale at reduced resolution inside
+    the decoder (DCT scaling), so a 12MP photo never exists in memory at
+    full size.
+    """
+    if REDUCED_DECODE if reduced is None else reduced:
+        return _decode(image_bytes, reduction_for(image_size(image_bytes), target), cv2.IMREAD_GRAYSCALE)
+    return _to_gray(_decode(image_bytes, None, cv2.IMREAD_COLOR))
+
+
+def decode_color(image_bytes, min_size=COLOR_MIN_SIZE):
+    """Decode image bytes to BGR, reduced as long as both sides stay >= min_size."""
+    flag = reduction_for(image_size(image_bytes), min_size, REDUCED_COLOR)
+    return _decode(image_bytes, flag, cv2.IMREAD_COLOR)
+
+
+def decode_full(image_bytes, grayscale=False):
+    """Decode image bytes at full resolution, e.g. to cut tiles from (None if invalid)."""
+    image = _decode(image_bytes, None, cv2.IMREAD_COLOR)
+    # Grayscale the way the classifier's training data was
+    return _to_gray(image) if grayscale else image
+
+
+def _to_gray(image):
+    return cv2.cvtColor(image, cv2.COLOR_BGR2GRAY) if image is not None else None
+
+
+def _decode(image_bytes, flag, full_flag):
+    nparr = np.frombuffer(image_bytes, np.uint8)
+    image = cv2.imdecode(nparr, flag if flag is not None else full_flag)
+    if image is None and flag is not None:
+        image = cv2.imdecode(nparr, full_flag)
+    return image
+
+
+class BatchPreprocessor:
+    """Turn images into normalized float32 feature rows in reused buffers.
+
+    Each thread gets its own feature buffer, grown to the largest batch it
+    has seen, plus a uint8 scratch image for the resize. transform()
+    returns a view into that buffer which stays valid until the same
+    thread calls transform() again.
+    """
+
+    def __init__(self, target=TARGET_SIZE):
+        self.target = target
+        self.features = target[0] * target[1]
+        self._local = threading.local()
+
+    def _buffers(self, count):
+        local = self._local
+        buffer = getattr(local, 'buffer', None)
+        if buffer is None or buffer.shape[0] < count:
+            local.buffer = buffer = np.empty((count, self.features), dtype=np.float32)
+            local.scratch = np.empty((self.target[1], self.target[0]), dtype=np.uint8)
+        return buffer, local.scratch
+
+    def transform(self, images):
+        """Preprocess BGR or grayscale images into an (n, 128*128) float32 batch."""
+        buffer, scratch = self._buffers(len(images))
+        batch = buffer[:len(images)]
+        for row, image in zip(batch, images):
+            if image.ndim == 3:
+                image = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
+            cv2.resize(image, self.target, dst=scratch)
+            # Casts uint8 -> float32 into the preallocated row
+            row[:] = scratch.reshape(-1)
+        # Normalize the whole batch with one in-place op. Dividing gives the
+        # same float32 values as the original / 255.0 did once sklearn cast
+        # it; multiplying by 1/255 is off by one ulp for half of them, and
+        # that's enough to move a feature across a tree's split
+        batch /= np.float32(255.0)
+        return batch
+
+
+class LetterboxPreprocessor:
+    """Letterbox BGR images into a reused (n, 3, height, width) float32 RGB batch.
+
+    Each image is scaled to fit size, keeping its aspect ratio, and padded
+    with gray, the way YOLO was trained. With rect=True the batch is only as
+    large as its images need, rounded up to the stride, so 16:9 frames run
+    at 640x384 instead of 640x640. Like BatchPreprocessor, the returned
+    batch is a per-thread buffer reused by the next call on that thread.
+    """
+
+    def __init__(self, size=640, pad_value=114, stride=32, rect=False):
+        self.size = size
+        self.pad_value = pad_value
+        self.stride = stride
+        self.rect = rect
+        self._local = threading.local()
+
+    def _buffers(self, count):
+        local = self._local
+        buffer = getattr(local, 'buffer', None)
+        if buffer is None or buffer.size < count * 3 * self.size * self.size:
+            local.buffer = buffer = np.empty(count * 3 * self.size * self.size, dtype=np.float32)
+            local.canvas = np.empty(self.size * self.size * 3, dtype=np.uint8)
+        return buffer, local.canvas
+
+    def transform(self, images):
+        """Return (batch, scales); scale maps letterboxed coordinates back to the image."""
+        sizes = []
+        for image in images:
+            height, width = image.shape[:2]
+            scale = min(self.size / width, self.size / height)
+            sizes.append((scale, max(1, round(width * scale)), max(1, round(height * scale))))
+
+        if self.rect:
+            def padded(value):
+                return min(self.size, -(-value // self.stride) * self.stride)
+            batch_width = padded(max(width for _, width, _ in sizes))
+            batch_height = padded(max(height for _, _, height in sizes))
+        else:
+            batch_width = batch_height = self.size
+
+        buffer, canvas = self._buffers(len(images))
+        batch = buffer[:len(images) * 3 * batch_height * batch_width].reshape(len(images), 3, batch_height, batch_width)
+        canvas = canvas[:batch_height * batch_width * 3].reshape(batch_height, batch_width, 3)
+        for planes, image, (_, new_width, new_height) in zip(batch, images, sizes):
+            canvas.fill(self.pad_value)
+            cv2.resize(image, (new_width, new_height), dst=canvas[:new_height, :new_width],
+                       interpolation=cv2.INTER_LINEAR)
+            # BGR HWC -> RGB CHW, cast into the preallocated planes
+            for channel in range(3):
+                planes[channel] = canvas[:, :, 2 - channel]
+        batch *= np.float32(1.0 / 255.0)
+        return batch, [scale for scale, _, _ in sizes]
@@ -1,18 +1,160 @@
-from flask import Blueprint, request, jsonify
-import cv2
-import numpy as np
-from app.model import PestDetectionModel
-from app.validation import validate_image
-from app.excel_integration import update_excel_data
+from flask import Blueprint, Response, g, render_template, request, jsonify, stream_with_context
+from concurrent.futures import ThreadPoolExecutor
+import json
+import os
+import time
+from datetime import datetime
+from app.model_manager import ModelManager
+from app.batching import BatchScheduler
+from app.cache import ResultCache, COUNT_CACHE_HITS, content_key, perceptual_key
+from app.archive import detach_uploads, iter_uploaded_images, chunked
+from app.validation import MAX_IMAGE_BYTES, UploadTooLarge, read_limited, validate_image
+from app.excel_integration import update_excel_data, get_detection_snapshot, query_history, detection_source
+from app.live import LiveFeed
+from app.admission import AdmissionController, Rejected
+from app import metrics
+from app.metrics import REQUEST_STAGES, HTTP_LATENCY, HTTP_REQUESTS
 
 main_bp = Blueprint('main', __name__)
 
-# Initialize the model
-model = PestDetectionModel()
+# The model, hot-swapped when its artifact changes on disk
+model = ModelManager()
+
+# Batch concurrent requests into single model calls
+scheduler = BatchScheduler(model, method='predict_batch')
+
+# Results of recently seen images, keyed by content (and perceptual) hash;
+# emptied when a new model version takes over
+result_cache = ResultCache()
+model.on_swap(lambda old, new: result_cache.clear())
+
+# Count changes pushed to dashboard viewers
+live_feed = LiveFeed(detection_source)
+
+# Bounds decode and inference work in flight; single uploads go ahead of
+# bulk jobs, and requests that can't start in time are shed
+admission = AdmissionController()
+
+# Bulk uploads are decoded in parallel and scored in chunks of this size
+BULK_CHUNK_SIZE = int(os.environ.get('PEST_BULK_CHUNK_SIZE', '32'))
+decode_pool = ThreadPoolExecutor(max_workers=os.cpu_count() or 4)
+
+# Allowance for multipart headers on top of the image itself
+FORM_OVERHEAD = 64 * 1024
+
+def too_large():
+    return jsonify({'error': f'Image larger than {MAX_IMAGE_BYTES // (1024 * 1024)} MB'}), 413
+
+def rejected(e):
+    """A 429/503 response telling the client when to come back."""
+    message = 'Too many requests' if e.status == 429 else 'Server busy'
+    response = jsonify({'error': message, 'reason': e.reason})
+    response.status_code = e.status
+    response.headers['Retry-After'] = str(e.retry_after)
+    return response
+
+def client_id():
+    """Who a request is rate limited as: its address, as forwarded by trusted proxies.
+
+    Not a client-chosen header, which anyone could change to dodge the limit.
+    """
+    return request.remote_addr
+
+@main_bp.app_errorhandler(413)
+def request_too_large(e):
+    """Flask's MAX_CONTENT_LENGTH rejection, as JSON."""
+    return jsonify({'error': 'Request too large'}), 413
+
+def decode_image(image_bytes):
+    """Decode raw upload bytes for the model (None if undecodable)."""
+    return model.decode(image_bytes)
+
+def lookup_perceptual(image, key):
+    """Check the cache for a near-duplicate of a decoded image.
+
+    Returns (perceptual key or None, cached result or None); a hit is also
+    stored under the content key so the next exact copy skips decoding.
+    """
+    if not result_cache.perceptual or image is None:
+        return None, None
+    perceptual = perceptual_key(image)
+    result = result_cache.get(perceptual)
+    if result is not None:
+        result_cache.put(key, result)
+    return perceptual, result
+
+def remember(keys, result):
+    """Cache a fresh detection result under each of its keys."""
+    for key in keys:
+        if key is not None:
+            result_cache.put(key, result)
+
+def merge_detections(results):
+    """Sum per-image detection counts into one dict."""
+    totals = {}
+    for result in results:
+        for pest, count in result.items():
+            totals[pest] = totals.get(pest, 0) + count
+    return totals
+
+def prediction_fields(prediction):
+    """The response fields of one prediction."""
+    fields = {
+        'detections': prediction['detections'],
+        'confidence': prediction['confidence'],
+        'top_k': prediction['top_k']
+    }
+    if 'stage' in prediction:
+        fields['stage'] = prediction['stage']
+    return fields
+
+@main_bp.before_app_request
+def watch_model():
+    """Start the model watcher in this worker (threads don't survive a fork)."""
+    model.start()
+
+@main_bp.before_app_request
+def start_request_timing():
+    """Note the start time, and start a stage trace if the client asked for one."""
+    if not metrics.METRICS_ENABLED and not (metrics.TRACE_ALL or metrics.TRACE_HEADER in request.headers):
+        return
+    g.request_started = time.perf_counter()
+    if metrics.TRACE_ALL or metrics.TRACE_HEADER in request.headers:
+        metrics.start_trace()
+
+@main_bp.after_app_request
+def finish_request_timing(response):
+    """Record the request latency and attach the stage trace as Server-Timing."""
+    started = g.pop('request_started', None)
+    if started is None:
+        return response
+    elapsed = time.perf_counter() - started
+    endpoint = request.endpoint or 'unknown'
+    HTTP_LATENCY.observe(elapsed, endpoint, request.method)
+    HTTP_REQUESTS.inc(endpoint, request.method, str(response.status_code))
+    trace = metrics.finish_trace()
+    if trace is not None:
+        response.headers['Server-Timing'] = metrics.server_timing(trace, elapsed)
+    return response
 
 @main_bp.route('/detect', methods=['POST'])
 def detect_pests():
     """API endpoint for pest detection."""
+    # Reject oversized uploads from the headers, before the body is parsed
+    if request.content_length is not None and request.content_length > MAX_IMAGE_BYTES + FORM_OVERHEAD:
+        return too_large()
+    
+    # Turn away clients over their rate before reading the upload
+    try:
+        admission.limit(client_id(), 'interactive')
+    except Rejected as e:
+        return rejected(e)
+    
+    # request.files parses (and spools) the whole body, so cap it first;
+    # a chunked upload with no Content-Length is cut off at the same size
+    # with a 413 instead of filling a temp file up to MAX_CONTENT_LENGTH
+    request.max_content_length = MAX_IMAGE_BYTES + FORM_OVERHEAD
+    
     # Check if image was uploaded
     if 'image' not in request.files:
         return jsonify({'error': 'No image provided'}), 400
@@ -23,23 +165,291 @@ def detect_pests():
     if not validate_image(image_file):
         return jsonify({'error': 'Invalid image format'}), 400
     
-    # Read and process the image
-    image_bytes = image_file.read()
-    nparr = np.frombuffer(image_bytes, np.uint8)
-    image = cv2.imdecode(nparr, cv2.IMREAD_COLOR)
+    # The form overhead allowance leaves room for a file slightly over the
+    # image limit, so the file itself is checked too
+    try:
+        with REQUEST_STAGES.time('read'):
+            image_bytes = read_limited(image_file.stream)
+    except UploadTooLarge:
+        return too_large()
     
-    # Detect pests
-    detection_results = model.detect(image)
+    # Identical uploads are answered from the cache without decoding
+    with REQUEST_STAGES.time('cache'):
+        key = content_key(image_bytes)
+        prediction = result_cache.get(key, count_miss=not result_cache.perceptual)
+    cached = prediction is not None
+    
+    if not cached:
+        # Decoding and inference need an in-flight slot; cache hits don't
+        try:
+            with REQUEST_STAGES.time('admission'):
+                slot = admission.acquire('interactive')
+        except Rejected as e:
+            return rejected(e)
+        
+        with slot:
+            # Decode at the resolution the model needs and drop the raw bytes
+            with REQUEST_STAGES.time('decode'):
+                image = decode_image(image_bytes)
+            del image_bytes
+            if image is None:
+                return jsonify({'error': 'Invalid image format'}), 400
+            perceptual, prediction = lookup_perceptual(image, key)
+            cached = prediction is not None
+            
+            if not cached:
+                # Detect pests (includes waiting for the batch to fill)
+                version = model.version
+                with REQUEST_STAGES.time('inference'):
+                    prediction = scheduler.submit(image)
+                # A result from a model swapped out meanwhile isn't cached
+                if model.version == version:
+                    remember([key, perceptual], prediction)
     
     # Update Excel with real-time detection data
-    update_excel_data(detection_results)
+    if COUNT_CACHE_HITS or not cached:
+        with REQUEST_STAGES.time('excel'):
+            update_excel_data(prediction['detections'], confidence=prediction['confidence'])
     
     return jsonify({
         'success': True,
-        'detections': detection_results
+        'cached': cached,
+        'model_version': model.version,
+        **prediction_fields(prediction)
     })
 
+@main_bp.route('/detect/batch', methods=['POST'])
+def detect_pests_batch():
+    """API endpoint for scoring many images or a ZIP/tar archive.
+
+    Results are streamed back as NDJSON, one line per image, followed by a
+    summary line with the aggregate counts. Jobs run in the bulk lane:
+    each chunk waits for a slot behind single uploads.
+    """
+    # Shed before reading the uploads, while a 429/503 can still be sent
+    try:
+        admission.limit(client_id(), 'bulk')
+        admission.check('bulk')
+    except Rejected as e:
+        return rejected(e)
+    
+    files = [f for key in request.files for f in request.files.getlist(key)]
+    if not files:
+        return jsonify({'error': 'No images provided'}), 400
+    uploads = detach_uploads(files)
+
+    def generate():
+        totals = {}
+        # Sum of confidence x count per pest, for the mean confidence of the totals
+        weighted = {}
+        processed = 0
+        failed = 0
+
+        try:
+            for chunk in chunked(iter_uploaded_images(uploads), BULK_CHUNK_SIZE):
+                names = [name for name, _ in chunk]
+                keys = [content_key(data) if data else None for _, data in chunk]
+                oversized = {i for i, (_, data) in enumerate(chunk) if data is None}
+                # Not an image at all; reported as an invalid format
+                invalid = {i for i, (_, data) in enumerate(chunk) if data == b''}
+                detections = {}
+                for i, key in enumerate(keys):
+                    result = result_cache.get(key, count_miss=not result_cache.perceptual) if key else None
+                    if result is not None:
+                        detections[i] = result
+                cached = set(detections)
+
+                # Decode and score only what the cache couldn't answer; once
+                # streaming, a chunk waits for its slot rather than failing
+                pending = [i for i in range(len(chunk)) if i not in cached and i not in oversized and i not in invalid]
+                with admission.acquire('bulk', shed=False):
+                    images = dict(zip(pending, decode_pool.map(decode_image, [chunk[i][1] for i in pending])))
+                    del chunk
+
+                    perceptual_keys = {}
+                    for i, image in images.items():
+                        perceptual_keys[i], result = lookup_perceptual(image, keys[i])
+                        if result is not None:
+                            detections[i] = result
+                            cached.add(i)
+
+                    valid = [i for i, image in images.items() if image is not None and i not in cached]
+                    for i, result in zip(valid, model.predict_batch([images[i] for i in valid])):
+                        detections[i] = result
+                        remember([keys[i], perceptual_keys[i]], result)
+                    del images
+
+                # Counted before the lines go out, so a client that
+                # disconnects mid-stream doesn't lose what was scored
+                counted = [result for i, result in detections.items() if COUNT_CACHE_HITS or i not in cached]
+                totals = merge_detections([totals] + [result['detections'] for result in counted])
+                weighted = merge_detections([weighted] + [
+                    {pest: count * result['confidence'].get(pest, 0.0) for pest, count in result['detections'].items()}
+                    for result in counted
+                ])
+
+                for i, name in enumerate(names):
+                    if i in detections:
+                        processed += 1
+                        line = {'file': name, 'success': True, 'cached': i in cached,
+                                **prediction_fields(detections[i])}
+                    else:
+                        failed += 1
+                        error = 'Image too large' if i in oversized else 'Invalid image format'
+                        line = {'file': name, 'success': False, 'error': error}
+                    yield json.dumps(line) + '\n'
+        finally:
+            for _, stream in uploads:
+                stream.close()
+            # One bulk update for the whole upload, run even when the
+            # client goes away and the generator is closed at a yield
+            if totals:
+                update_excel_data(totals, confidence={pest: weighted[pest] / count for pest, count in totals.items()})
+
+        yield json.dumps({
+            'summary': True,
+            'processed': processed,
+            'failed': failed,
+            'model_version': model.version,
+            'detections': totals
+        }) + '\n'
+
+    return Response(stream_with_context(generate()), mimetype='application/x-ndjson')
+
 @main_bp.route('/health', methods=['GET'])
 def health_check():
     """Health check endpoint."""
-    return jsonify({'status': 'healthy'})
+    return jsonify({'status': 'healthy', 'model': model.info()})
+
+@main_bp.route('/stats', methods=['GET'])
+def detection_stats():
+    """Current per-pest detection totals."""
+    snapshot = get_detection_snapshot()
+    return jsonify({
+        'pests': snapshot,
+        'total': sum(data['Count'] for data in snapshot.values())
+    })
+
+def parse_time(value, default):
+    """Parse an ISO-8601 time or epoch seconds query argument."""
+    if not value:
+        return default
+    try:
+        return float(value)
+    except ValueError:
+        return datetime.fromisoformat(value).timestamp()
+
+@main_bp.route('/live', methods=['GET'])
+def live_counts():
+    """Server-Sent Events stream of per-pest counts: a snapshot, then coalesced deltas."""
+    if live_feed.full():
+        response = jsonify({'error': 'Too many live viewers'})
+        response.status_code = 503
+        response.headers['Retry-After'] = str(int(live_feed.heartbeat))
+        return response
+    return Response(live_feed.subscribe(), mimetype='text/event-stream', headers={
+        'Cache-Control': 'no-cache',
+        # Stop nginx-style proxies from buffering the stream
+        'X-Accel-Buffering': 'no'
+    })
+
+@main_bp.route('/dashboard', methods=['GET'])
+def dashboard():
+    """Live dashboard page fed by /live."""
+    return render_template('dashboard.html')
+
+@main_bp.route('/history', methods=['GET'])
+def detection_history():
+    """Detection counts per minute/hour/day bucket for a time range."""
+    resolution = request.args.get('resolution', 'hour')
+    try:
+        end = parse_time(request.args.get('end'), time.time())
+        start = parse_time(request.args.get('start'), end - 86400)
+        rows = query_history(
+            resolution, start, end,
+            pest=request.args.get('pest'),
+            location=request.args.get('location')
+        )
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    
+    return jsonify({'resolution': resolution, 'buckets': rows})
+
+@main_bp.route('/detect/stats', methods=['GET'])
+def batching_stats():
+    """Metrics of the inference scheduler and the result cache."""
+    stats = scheduler.stats()
+    stats['cache'] = result_cache.stats()
+    stats['admission'] = admission.stats()
+    return jsonify(stats)
+
+
+def scheduler_metrics():
+    stats = scheduler.stats()
+    return [
+        ('pest_batch_queue_depth', 'gauge', 'Images waiting for the batching thread.', [({}, stats['queue_depth'])]),
+        ('pest_batches_total', 'counter', 'Batched model calls.', [({}, stats['total_batches'])]),
+        ('pest_batch_images_total', 'counter', 'Images scored by the batching thread.', [({}, stats['total_images'])]),
+        ('pest_batch_errors_total', 'counter', 'Images whose batch failed.', [({}, stats['total_errors'])]),
+    ]
+
+def admission_metrics():
+    stats = admission.stats()
+    return [
+        ('pest_admission_in_flight', 'gauge', 'Requests holding an inference slot.', [({}, stats['in_flight'])]),
+        ('pest_admission_queue_depth', 'gauge', 'Requests waiting for an inference slot, by lane.',
+         [({'lane': lane}, depth) for lane, depth in stats['queued'].items()]),
+        ('pest_admission_admitted_total', 'counter', 'Requests given an inference slot, by lane.',
+         [({'lane': lane}, count) for lane, count in stats['admitted'].items()]),
+    ]
+
+def live_metrics():
+    stats = live_feed.stats()
+    return [
+        ('pest_live_subscribers', 'gauge', 'Open /live streams.', [({}, stats['subscribers'])]),
+        ('pest_live_events_total', 'counter', 'Count change events pushed to /live streams.', [({}, stats['events'])]),
+    ]
+
+def cache_metrics():
+    stats = result_cache.stats()
+    return [
+        ('pest_cache_entries', 'gauge', 'Entries in the result cache.', [({}, stats['size'])]),
+        ('pest_cache_lookups_total', 'counter', 'Result cache lookups by outcome.', [
+            ({'result': 'hit'}, stats['hits']),
+            ({'result': 'miss'}, stats['misses']),
+        ]),
+        ('pest_cache_evictions_total', 'counter', 'Result cache evictions.', [({}, stats['evictions'])]),
+    ]
+
+def model_metrics():
+    info = model.info()
+    return [
+        ('pest_model_reloads_total', 'counter', 'Model artifacts hot-swapped in.', [({}, info['reloads'])]),
+        ('pest_model_reload_errors_total', 'counter', 'Model reloads that failed and kept the old model.',
+         [({}, info['reload_errors'])]),
+        ('pest_model_info', 'gauge', 'The active model version.',
+         [({'version': str(info.get('version')), 'type': str(info.get('type'))}, 1)]),
+    ]
+
+metrics.registry.add_collector(scheduler_metrics)
+metrics.registry.add_collector(cache_metrics)
+metrics.registry.add_collector(model_metrics)
+metrics.registry.add_collector(live_metrics)
+metrics.registry.add_collector(admission_metrics)
+
+@main_bp.route('/metrics', methods=['GET'])
+def prometheus_metrics():
+    """Stage latency histograms and counters in the Prometheus text format."""
+    return Response(metrics.registry.render(), mimetype='text/plain; version=0.0.4')
+
+@main_bp.route('/debug/profile', methods=['GET'])
+def sample_profile():
+    """Sample all threads for ?seconds=N and return collapsed stacks (flamegraph input)."""
+    if not metrics.PROFILER_ENABLED:
+        return jsonify({'error': 'Profiler disabled; set PEST_PROFILER=true'}), 404
+    try:
+        seconds = min(float(request.args.get('seconds', '5')), 60.0)
+    except ValueError:
+        return jsonify({'error': 'seconds must be a number'}), 400
+    profiler = metrics.SamplingProfiler().run(seconds)
+    return Response(profiler.collapsed(), mimetype='text/plain')
@@ -0,0 +1,24 @@
+"""Pest classes and workbook layout shared by the web app, video loop and batch jobs."""
+
+# Class names in model output order
+PEST_TYPES = [
+    "Aphid", "Armyworm", "Beetle", "Bollworm", "Grasshopper",
+    "Leafhopper", "Mite", "Mosquito", "Stem Borer", "Thrips"
+]
+
+# Workbook sheets
+DATA_SHEET = 'Pest Detection Data'
+VISUALIZATION_SHEET = 'Visualization'
+
+# Columns of the data sheet, one row per pest
+DATA_COLUMNS = ['Pest Type', 'Count', 'Last Updated', 'Location']
+
+
+def initial_data(pests=PEST_TYPES):
+    """Return the data sheet of a new workbook as {column: values}."""
+    return {
+        'Pest Type': list(pests),
+        'Count': [0] * len(pests),
+        'Last Updated': [''] * len(pests),
+        'Location': [''] * len(pests)
+    }
@@ -0,0 +1,140 @@
+import sqlite3
+import threading
+
+from app.aggregation import format_rows
+
+try:
+    import fcntl
+except ImportError:
+    # No flock (Windows): gunicorn doesn't run there, so there is only ever
+    # one process and it is always the writer
+    fcntl = None
+
+
+class SQLiteStore:
+    """Base for stores kept in a SQLite database shared between processes.
+
+    db_path may also be a SQLite URI such as 'file:name?mode=memory&cache=shared'
+    for a process-local store.
+    """
+
+    def __init__(self, db_path):
+        self.db_path = db_path
+        self._local = threading.local()
+        with self._connect() as conn:
+            self.create_tables(conn)
+
+    def create_tables(self, conn):
+        raise NotImplementedError
+
+    def _connect(self):
+        # One connection per thread; sqlite3 connections aren't shareable
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.db_path, timeout=30, uri=self.db_path.startswith('file:'))
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def _bump_version(self, conn, key):
+        conn.execute("INSERT OR IGNORE INTO meta (key, value) VALUES (?, 0)", (key,))
+        conn.execute("UPDATE meta SET value = value + 1 WHERE key = ?", (key,))
+
+    def _read_version(self, conn, key):
+        row = conn.execute("SELECT value FROM meta WHERE key = ?", (key,)).fetchone()
+        return row[0] if row else 0
+
+
+class SharedDetectionStore(SQLiteStore):
+    """Detection counters shared by every worker process via SQLite in WAL mode.
+
+    Workers accumulate counts in their local DetectionStore and periodically
+    push() the drained deltas here in one transaction; readers see the
+    totals of all workers.
+    """
+
+    def create_tables(self, conn):
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS detections ("
+            "pest TEXT PRIMARY KEY, count INTEGER NOT NULL, "
+            "last_updated REAL NOT NULL, location TEXT)"
+        )
+        conn.execute("CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value INTEGER NOT NULL)")
+
+    def push(self, deltas):
+        """Add {pest: (count, timestamp, location)} deltas in a single transaction."""
+        if not deltas:
+            return
+        conn = self._connect()
+        with conn:
+            conn.execute("BEGIN IMMEDIATE")
+            conn.executemany(
+                "INSERT INTO detections (pest, count, last_updated, location) VALUES (?, ?, ?, ?) "
+                "ON CONFLICT(pest) DO UPDATE SET "
+                "count = count + excluded.count, "
+                "location = CASE WHEN excluded.last_updated >= last_updated "
+                "THEN excluded.location ELSE location END, "
+                "last_updated = MAX(last_updated, excluded.last_updated)",
+                [(pest, count, updated, location) for pest, (count, updated, location) in deltas.items()]
+            )
+            self._bump_version(conn, 'version')
+
+    def version(self):
+        """Return a number that changes whenever any worker pushes counts."""
+        return self._read_version(self._connect(), 'version')
+
+    def snapshot(self):
+        """Return (version, {pest: {'Count', 'Last Updated', 'Location'}}) for all workers."""
+        conn = self._connect()
+        # A read transaction gives the version and rows from the same commit
+        with conn:
+            conn.execute("BEGIN")
+            version = self._read_version(conn, 'version')
+            merged = {
+                pest: (count, updated, location)
+                for pest, count, updated, location in conn.execute(
+                    "SELECT pest, count, last_updated, location FROM detections"
+                )
+            }
+        return version, format_rows(merged)
+
+
+class WriterLease:
+    """Elect a single process to own the Excel export.
+
+    The first process to take an exclusive flock on the lease file becomes
+    the writer and keeps the lock for its lifetime; the OS releases it when
+    the process exits, so another worker takes over on its next try.
+    """
+
+    def __init__(self, lock_path):
+        self.lock_path = lock_path
+        self.file = None
+        self.held = False
+
+    def acquire(self):
+        """Try to become the writer without blocking. Returns True if we are."""
+        if self.held:
+            return True
+        if fcntl is None:
+            self.held = True
+            return True
+
+        file = open(self.lock_path, 'a')
+        try:
+            fcntl.flock(file.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            file.close()
+            return False
+        self.file = file
+        self.held = True
+        return True
+
+    def release(self):
+        """Give up the writer role."""
+        if self.file is not None:
+            fcntl.flock(self.file.fileno(), fcntl.LOCK_UN)
+            self.file.close()
+            self.file = None
+        self.held = False
@@ -0,0 +1,67 @@
+import os
+
+import numpy as np
+
+from app.backends import Detections, nms
+
+# 'true' splits images larger than one tile into overlapping tiles
+TILED = os.environ.get('PEST_TILED', 'false') == 'true'
+
+# Tile side and overlap in image pixels; the overlap should exceed the
+# largest pest so every pest is whole in at least one tile
+TILE_SIZE = int(os.environ.get('PEST_TILE_SIZE', '640'))
+TILE_OVERLAP = int(os.environ.get('PEST_TILE_OVERLAP', '128'))
+
+# Tiles per model call, to bound memory on very large images
+TILE_BATCH = int(os.environ.get('PEST_TILE_BATCH', '16'))
+
+# Boxes from different tiles covering this much of the smaller one are merged
+SEAM_IOS_THRESHOLD = float(os.environ.get('PEST_TILE_SEAM_IOS', '0.6'))
+
+
+def tile_starts(length, tile, overlap):
+    """Start offsets along one axis; the last tile is aligned to the far edge."""
+    if length <= tile:
+        return [0]
+    stride = max(1, tile - overlap)
+    starts = list(range(0, length - tile, stride))
+    starts.append(length - tile)
+    return starts
+
+
+def tile_grid(shape, tile=TILE_SIZE, overlap=TILE_OVERLAP):
+    """Return an (n, 2) array of (x, y) tile offsets covering an image of shape."""
+    height, width = shape[:2]
+    xs = tile_starts(width, tile, overlap)
+    ys = tile_starts(height, tile, overlap)
+    return np.array([(x, y) for y in ys for x in xs], dtype=np.int64)
+
+
+def split_tiles(image, tile=TILE_SIZE, overlap=TILE_OVERLAP):
+    """Return (tiles, offsets); tiles are views into image, not copies."""
+    offsets = tile_grid(image.shape, tile, overlap)
+    tiles = [image[y:y + tile, x:x + tile] for x, y in offsets]
+    return tiles, offsets
+
+
+def merge_tiles(detections, offsets):
+    """Merge per-tile Detections into one for the whole image.
+
+    Boxes are shifted by their tile's offset. Each tile already had NMS, so
+    only boxes from different tiles are merged: a box covered by a
+    higher-scoring box from another tile is dropped whatever its class,
+    since a pest cut at a seam is often given a different class.
+    """
+    counts = [len(d) for d in detections]
+    if not sum(counts):
+        return Detections(np.empty((0, 4), np.float32), np.empty(0, np.float32), np.empty(0, np.intp))
+
+    tile_ids = np.repeat(np.arange(len(detections)), counts)
+    boxes = np.concatenate([d.boxes for d in detections]).astype(np.float32)
+    boxes += np.tile(offsets[tile_ids], 2).astype(np.float32)
+    confidences = np.concatenate([d.confidences for d in detections])
+    classes = np.concatenate([d.classes for d in detections])
+
+    # An IoU above 1 never happens, so only the cross-tile rule applies
+    keep = nms(boxes, confidences, iou_threshold=1.0, groups=tile_ids, ios_threshold=SEAM_IOS_THRESHOLD)
+    return Detections(boxes[keep], confidences[keep], classes[keep])
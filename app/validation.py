@@ -1,11 +1,55 @@
+import os
+
+ALLOWED_EXTENSIONS = {'png', 'jpg', 'jpeg', 'gif'}
+
+# Largest single image accepted, in bytes
+MAX_IMAGE_BYTES = int(float(os.environ.get('PEST_MAX_IMAGE_MB', '25')) * 1024 * 1024)
+
+# Leading bytes of each accepted image format
+IMAGE_SIGNATURES = {
+    b'\xff\xd8\xff': 'jpeg',
+    b'\x89PNG\r\n\x1a\n': 'png',
+    b'GIF87a': 'gif',
+    b'GIF89a': 'gif',
+}
+
+class UploadTooLarge(Exception):
+    """Raised when an upload exceeds its size limit while being read."""
+
+def allowed_filename(filename):
+    """Check that a filename has an allowed image extension."""
+    ext = filename.rsplit('.', 1)[1].lower() if '.' in filename else ''
+    return ext in ALLOWED_EXTENSIONS
+
+def sniff_image_type(header):
+    """Return the image format named by the magic bytes in header, or None."""
+    for signature, image_type in IMAGE_SIGNATURES.items():
+        if header.startswith(signature):
+            return image_type
+    return None
+
 def validate_image(file):
-    """Validate that the uploaded file is an image with an allowed extension."""
-    ALLOWED_EXTENSIONS = {'png', 'jpg', 'jpeg', 'gif'}
-    
+    """Validate that the uploaded file is an image, judged by its content."""
     # Check if the file has a filename
     if file.filename == '':
         return False
     
-    # Check if the file has an allowed extension
-    ext = file.filename.rsplit('.', 1)[1].lower() if '.' in file.filename else ''
-    return ext in ALLOWED_EXTENSIONS
+    # Peek at the magic bytes rather than trusting the extension
+    header = file.stream.read(16)
+    file.stream.seek(0)
+    return sniff_image_type(header) is not None
+
+def read_limited(stream, max_bytes=MAX_IMAGE_BYTES, chunk_size=1024 * 1024):
+    """Read a stream into one bytearray, failing as soon as it passes max_bytes.
+
+    The buffer grows chunk by chunk, so an oversized upload is rejected
+    after reading at most max_bytes + chunk_size bytes.
+    """
+    data = bytearray()
+    while True:
+        chunk = stream.read(chunk_size)
+        if not chunk:
+            return data
+        data += chunk
+        if len(data) > max_bytes:
+            raise UploadTooLarge(f"Image larger than {max_bytes // (1024 * 1024)} MB")
@@ -0,0 +1,96 @@
+"""Tail latency under overload with and without admission control.
+
+Requests arrive as a Poisson stream at a multiple of what the stand-in
+model can serve (--cores requests at a time, --service-ms each) and each
+runs in its own thread, as gunicorn threads would. A fraction of them are
+bulk. Without admission every request is served eventually and the
+queue, and with it the latency, grows for as long as the overload lasts.
+With an AdmissionController in front, the excess is shed at once and the
+admitted requests keep a bounded p99, interactive ones ahead of bulk.
+
+    python benchmarks/bench_admission.py --load 0.8 1.5 3 --seconds 10
+"""
+import argparse
+import os
+import sys
+import threading
+import time
+from collections import OrderedDict
+from contextlib import nullcontext
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app.admission import AdmissionController, RateLimiter, Rejected
+
+
+def run(controller, load, seconds, cores, service, bulk_share, seed=0):
+    """Offer load x capacity for seconds; returns {lane: (latencies, shed)}."""
+    model = threading.Semaphore(cores)
+    results = {'interactive': ([], [0]), 'bulk': ([], [0])}
+    lock = threading.Lock()
+
+    def request(lane):
+        started = time.perf_counter()
+        try:
+            slot = controller.acquire(lane) if controller else nullcontext()
+        except Rejected:
+            with lock:
+                results[lane][1][0] += 1
+            return
+        with slot, model:
+            time.sleep(service)
+        with lock:
+            results[lane][0].append(time.perf_counter() - started)
+
+    rng = np.random.default_rng(seed)
+    rate = load * cores / service
+    threads = []
+    deadline = time.perf_counter() + seconds
+    next_arrival = time.perf_counter()
+    while next_arrival < deadline:
+        time.sleep(max(0.0, next_arrival - time.perf_counter()))
+        lane = 'bulk' if rng.random() < bulk_share else 'interactive'
+        thread = threading.Thread(target=request, args=(lane,), daemon=True)
+        thread.start()
+        threads.append(thread)
+        next_arrival += rng.exponential(1.0 / rate)
+    for thread in threads:
+        thread.join()
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Admission control benchmark")
+    parser.add_argument("--load", type=float, nargs='+', default=[0.8, 1.5, 3.0],
+                        help="Offered load as a multiple of capacity")
+    parser.add_argument("--seconds", type=float, default=10.0)
+    parser.add_argument("--cores", type=int, default=4, help="Requests the stand-in model serves at once")
+    parser.add_argument("--service-ms", type=float, default=50.0)
+    parser.add_argument("--bulk", type=float, default=0.2, help="Share of bulk requests")
+    args = parser.parse_args()
+
+    service = args.service_ms / 1000.0
+    print(f"{args.cores} x {args.service_ms:.0f} ms stand-in model ({args.cores / service:.0f} req/s), "
+          f"{args.bulk:.0%} bulk, {args.seconds:.0f}s per run")
+    print(f"{'load':>5}  {'mode':<10}{'lane':<13}{'served':>8}{'shed':>8}{'p50 ms':>9}{'p99 ms':>9}")
+    for load in args.load:
+        modes = OrderedDict([
+            ('unbounded', None),
+            ('admission', AdmissionController(max_in_flight=args.cores, max_queue=2 * args.cores,
+                                              lanes=OrderedDict([('interactive', 0.25), ('bulk', 1.0)]),
+                                              rate_limiter=RateLimiter(rate=0))),
+        ])
+        for mode, controller in modes.items():
+            results = run(controller, load, args.seconds, args.cores, service, args.bulk)
+            for lane, (latencies, shed) in results.items():
+                latencies = np.array(latencies) * 1000.0
+                total = len(latencies) + shed[0]
+                p50, p99 = np.percentile(latencies, [50, 99]) if len(latencies) else (0.0, 0.0)
+                print(f"{load:>5.1f}  {mode:<10}{lane:<13}{len(latencies):>8}{shed[0] / max(total, 1):>8.0%}"
+                      f"{p50:>9.0f}{p99:>9.0f}")
+
+
+if __name__ == "__main__":
+    main()
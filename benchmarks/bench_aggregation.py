@@ -0,0 +1,101 @@
+"""Contention benchmark for the detection counter store.
+
+Compares DetectionStore against a single dict behind one global lock (the
+smallest correct fix for the old module-level dict) with N writer threads
+hammering add() while one reader takes snapshots, and checks that no
+increments are lost.
+
+    python benchmarks/bench_aggregation.py --writers 1 4 16 32
+"""
+import argparse
+import os
+import sys
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app.aggregation import DetectionStore
+
+PESTS = ["Aphid", "Armyworm", "Beetle", "Bollworm", "Grasshopper",
+         "Leafhopper", "Mite", "Mosquito", "Stem Borer", "Thrips"]
+
+
+class GlobalLockStore:
+    """Baseline: one dict guarded by one lock."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.data = {}
+
+    def add(self, detections, location="Default"):
+        timestamp = time.time()
+        with self.lock:
+            for pest, count in detections.items():
+                entry = self.data.get(pest)
+                if entry is None:
+                    self.data[pest] = {'Count': count, 'Last Updated': timestamp, 'Location': location}
+                else:
+                    entry['Count'] += count
+                    entry['Last Updated'] = timestamp
+
+    def snapshot(self):
+        with self.lock:
+            return 0, {pest: dict(entry) for pest, entry in self.data.items()}
+
+
+def run(store, writers, ops_per_writer):
+    start_barrier = threading.Barrier(writers + 1)
+    done = threading.Event()
+    snapshots = [0]
+
+    def writer(index):
+        detections = {PESTS[index % len(PESTS)]: 1}
+        start_barrier.wait()
+        for _ in range(ops_per_writer):
+            store.add(detections)
+
+    def reader():
+        while not done.is_set():
+            store.snapshot()
+            snapshots[0] += 1
+            time.sleep(0.001)
+
+    threads = [threading.Thread(target=writer, args=(i,)) for i in range(writers)]
+    for thread in threads:
+        thread.start()
+    reader_thread = threading.Thread(target=reader)
+    reader_thread.start()
+
+    start_barrier.wait()
+    started = time.perf_counter()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - started
+    done.set()
+    reader_thread.join()
+
+    total = sum(row['Count'] for row in store.snapshot()[1].values())
+    return {
+        'ops_per_sec': writers * ops_per_writer / elapsed,
+        'lost': writers * ops_per_writer - total,
+        'snapshots': snapshots[0],
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Detection store contention benchmark")
+    parser.add_argument("--writers", type=int, nargs='+', default=[1, 4, 16, 32])
+    parser.add_argument("--ops", type=int, default=20000, help="add() calls per writer")
+    args = parser.parse_args()
+
+    print(f"{'store':<18}{'writers':>8}{'ops/s':>14}{'lost':>8}{'snapshots':>11}")
+    for writers in args.writers:
+        for name, factory in (('global-lock dict', GlobalLockStore), ('DetectionStore', DetectionStore)):
+            result = run(factory(), writers, args.ops)
+            print(f"{name:<18}{writers:>8}{result['ops_per_sec']:>14,.0f}"
+                  f"{result['lost']:>8}{result['snapshots']:>11}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,116 @@
+"""Cost per image of the classifier-first cascade vs. YOLO on every image.
+
+Trains a small classifier on synthetic frames: "clear" frames carry a
+per-class pattern the classifier learns to recognise with high
+probability, "unclear" ones are noise it can only guess at. A mix of both
+is then scored by the classifier alone, by YOLO alone, and by the cascade
+at several confidence thresholds, where only the frames the classifier is
+unsure of reach YOLO.
+
+    python benchmarks/bench_cascade.py --onnx yolov8n.onnx --clear 0.8
+"""
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+import cv2
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import app.model
+from app.backends import OnnxYoloBackend, export_onnx
+from app.model import PestDetectionModel
+from app.model_loader import LoadedModel
+from app.schema import PEST_TYPES
+
+
+def synthetic_frame(rng, cls=None, size=(480, 640)):
+    """A clear frame of class cls (stripes at a class-specific spacing), or noise if cls is None."""
+    if cls is None:
+        small = rng.integers(0, 256, (size[0] // 8, size[1] // 8, 3), dtype=np.uint8)
+        return cv2.resize(small, size[::-1], interpolation=cv2.INTER_CUBIC)
+    frame = np.full(size + (3,), 90, np.uint8)
+    spacing = 12 + 8 * cls
+    frame[:, ::spacing] = 230
+    frame[::spacing] = 230
+    return cv2.add(frame, rng.integers(0, 20, frame.shape, dtype=np.uint8))
+
+
+def train_classifier(directory, per_class=30):
+    import joblib
+    from sklearn.ensemble import RandomForestClassifier
+
+    rng = np.random.default_rng(0)
+    model = PestDetectionModel(tiled=False)
+    frames, labels = [], []
+    for cls in range(len(PEST_TYPES)):
+        frames += [synthetic_frame(rng, cls) for _ in range(per_class)]
+        labels += [cls] * per_class
+    # Noise labelled at random, so the forest learns not to be sure of it
+    frames += [synthetic_frame(rng) for _ in range(per_class * 3)]
+    labels += list(rng.integers(0, len(PEST_TYPES), per_class * 3))
+    features = model.preprocessor.transform(frames).copy()
+    forest = RandomForestClassifier(n_estimators=50, random_state=0).fit(features, labels)
+    path = os.path.join(directory, 'cascade_classifier.pkl')
+    joblib.dump(forest, path)
+    return path
+
+
+def run(model, images, batch_size, repeats):
+    batches = [images[i:i + batch_size] for i in range(0, len(images), batch_size)]
+    model.predict_batch(batches[0])  # warm-up
+    best = None
+    for _ in range(repeats):
+        start = time.perf_counter()
+        predictions = [p for batch in batches for p in model.predict_batch(batch)]
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return predictions, best / len(images) * 1000.0
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Cascade benchmark")
+    parser.add_argument("--onnx", help="YOLO ONNX graph for the second stage")
+    parser.add_argument("--weights", help="YOLO weights to export when --onnx isn't given")
+    parser.add_argument("--frames", type=int, default=64)
+    parser.add_argument("--clear", type=float, default=0.8, help="Fraction of frames the classifier can recognise")
+    parser.add_argument("--thresholds", type=float, nargs='+', default=[0.5, 0.7, 0.9])
+    parser.add_argument("--batch-size", type=int, default=8)
+    parser.add_argument("--repeats", type=int, default=2)
+    args = parser.parse_args()
+    if not args.onnx and not args.weights:
+        parser.error("give --onnx or --weights")
+
+    rng = np.random.default_rng(1)
+    clear = int(args.frames * args.clear)
+    images = ([synthetic_frame(rng, int(cls)) for cls in rng.integers(0, len(PEST_TYPES), clear)] +
+              [synthetic_frame(rng) for _ in range(args.frames - clear)])
+    onnx_path = args.onnx or export_onnx(args.weights)
+    detector = PestDetectionModel(tiled=False, backend='yolo', cascade=False)
+    detector.loaded = LoadedModel(OnnxYoloBackend(onnx_path), 'yolo', 0.0, onnx_path)
+
+    with tempfile.TemporaryDirectory() as directory:
+        classifier_path = train_classifier(directory)
+        print(f"{args.frames} frames of 640x480, {clear} clear, batch {args.batch_size}")
+        print(f"{'mode':<18}{'ms/image':>10}{'to YOLO':>10}")
+
+        classifier = PestDetectionModel(classifier_path, tiled=False, backend='sklearn', cascade=False)
+        _, ms = run(classifier, images, args.batch_size, args.repeats)
+        print(f"{'classifier only':<18}{ms:>10.2f}{'0%':>10}")
+        _, yolo_ms = run(detector, images, args.batch_size, args.repeats)
+        print(f"{'YOLO only':<18}{yolo_ms:>10.2f}{'100%':>10}")
+
+        for threshold in args.thresholds:
+            app.model.CASCADE_THRESHOLD = threshold
+            cascade = PestDetectionModel(classifier_path, tiled=False, backend='sklearn', cascade=True)
+            cascade.detector = detector
+            predictions, ms = run(cascade, images, args.batch_size, args.repeats)
+            escalated = sum(p['stage'] == 'detector' for p in predictions) / len(predictions) * 100.0
+            print(f"{f'cascade @ {threshold}':<18}{ms:>10.2f}{escalated:>9.0f}%  ({yolo_ms / ms:.1f}x vs YOLO)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,92 @@
+"""Fan-out cost of the /live Server-Sent Events feed.
+
+A writer thread adds detections to a DetectionStore at a fixed rate while
+N subscriber threads consume LiveFeed streams, as the Flask threads serving
+/live would. Reports the events published, the delay from the newest
+detection in an event to each subscriber receiving it (at most a tick plus
+the fan-out), and the CPU time used per second of wall time.
+
+    python benchmarks/bench_live.py --subscribers 1 16 64 --rate 200
+"""
+import argparse
+import json
+import os
+import sys
+import threading
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app.aggregation import DetectionStore
+from app.live import LiveFeed
+from app.schema import PEST_TYPES
+
+
+def consume(stream, write_times, delays, stop):
+    for message in stream:
+        if stop.is_set():
+            break
+        received = time.time()
+        for block in message.split(b'\n\n'):
+            if b'event: delta' in block:
+                # The running total identifies the newest write in the event
+                total = json.loads(block.split(b'data: ', 1)[1])['total']
+                delays.append(received - write_times[total - 1])
+
+
+def run(subscribers, rate, seconds, tick):
+    store = DetectionStore()
+    feed = LiveFeed(lambda: store, tick=tick)
+    stop = threading.Event()
+    write_times = []
+    delays = []
+    threads = [threading.Thread(target=consume, args=(feed.subscribe(), write_times, delays, stop), daemon=True)
+               for _ in range(subscribers)]
+    for thread in threads:
+        thread.start()
+
+    rng = np.random.default_rng(0)
+    cpu_start = time.process_time()
+    deadline = time.perf_counter() + seconds
+    while time.perf_counter() < deadline:
+        write_times.append(time.time())
+        store.add({PEST_TYPES[int(rng.integers(0, len(PEST_TYPES)))]: 1})
+        time.sleep(1.0 / rate)
+    time.sleep(tick * 2)
+    cpu = time.process_time() - cpu_start
+    stop.set()
+    feed.stop()
+
+    stats = feed.stats()
+    delays = np.array(delays) * 1000.0
+    return {
+        'writes': len(write_times),
+        'events': stats['events'],
+        'deliveries': len(delays),
+        'delay_p50_ms': float(np.percentile(delays, 50)),
+        'delay_p95_ms': float(np.percentile(delays, 95)),
+        # Includes the writer thread, so compare across subscriber counts
+        'cpu_ms_per_s': cpu / seconds * 1000.0,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Live feed fan-out benchmark")
+    parser.add_argument("--subscribers", type=int, nargs='+', default=[1, 16, 64])
+    parser.add_argument("--rate", type=float, default=200.0, help="Detections written per second")
+    parser.add_argument("--seconds", type=float, default=5.0)
+    parser.add_argument("--tick", type=float, default=0.25)
+    args = parser.parse_args()
+
+    print(f"{args.rate:.0f} detections/s for {args.seconds:.0f}s, tick {args.tick}s")
+    print(f"{'subscribers':>12}{'events':>8}{'deliveries':>12}{'p50 ms':>9}{'p95 ms':>9}{'CPU ms/s':>10}")
+    for subscribers in args.subscribers:
+        r = run(subscribers, args.rate, args.seconds, args.tick)
+        print(f"{subscribers:>12}{r['events']:>8}{r['deliveries']:>12}{r['delay_p50_ms']:>9.1f}"
+              f"{r['delay_p95_ms']:>9.1f}{r['cpu_ms_per_s']:>10.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,105 @@
+"""Skip ratio, recall and cost of the video loop's motion gate.
+
+Renders a synthetic static trap-camera clip (sensor noise and a slow
+brightness flicker) in which an insect crawls across the card during a few
+episodes, then:
+
+- runs MotionGate over every frame and reports how many static frames it
+  skipped, how many frames with a moving insect it let through, and its
+  cost per frame;
+- gates only the frames VideoPipeline would forward at 30 fps to a model
+  of the given cost, and reports the model calls and model time saved.
+
+    python benchmarks/bench_motion_gate.py --frames 600 --inference-ms 80
+"""
+import argparse
+import os
+import sys
+
+import cv2
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from video_pipeline import MotionGate
+
+
+def synthetic_clip(frames, width, height, episodes, seed=0):
+    """Return (frames, moving flags): a static trap with an insect crawling during episodes."""
+    rng = np.random.default_rng(seed)
+    background = np.empty((height, width, 3), np.uint8)
+    background[:] = (40, 210, 235)
+    for _ in range(40):
+        # Insects already stuck to the card
+        x, y = int(rng.integers(20, width - 20)), int(rng.integers(20, height - 20))
+        cv2.ellipse(background, (x, y), (6, 4), float(rng.integers(0, 180)), 0, 360, (20, 25, 30), -1)
+
+    moving = np.zeros(frames, bool)
+    length = frames // (episodes * 4)
+    for start in np.linspace(frames * 0.1, frames * 0.9, episodes, dtype=int):
+        moving[start:start + length] = True
+
+    clip = []
+    x, y = width // 4, height // 2
+    for i in range(frames):
+        frame = background.copy()
+        if moving[i]:
+            x = (x + 2) % width
+            y = int(height / 2 + height / 6 * np.sin(x / 40))
+        cv2.ellipse(frame, (x, y), (7, 4), 0, 0, 360, (20, 25, 30), -1)
+        # Slow flicker plus sensor noise
+        flicker = int(4 * np.sin(i / 25))
+        frame = cv2.add(frame, np.full(frame.shape, 4 + flicker, np.uint8))
+        frame = cv2.add(frame, rng.integers(0, 8, frame.shape, dtype=np.uint8))
+        clip.append(frame)
+    return clip, moving
+
+
+def bench_gate(clip, moving, threshold):
+    gate = MotionGate(region_threshold=threshold)
+    passed = np.array([gate.changed(frame, i / 30.0) for i, frame in enumerate(clip)])
+    # A frame with motion counts as caught if the gate passed it or one of
+    # the two before it (the result is reused for at most a few frames)
+    caught = passed | np.roll(passed, 1) | np.roll(passed, 2)
+    recall = caught[moving].mean() * 100.0 if moving.any() else 100.0
+    static_skipped = (~passed[~moving]).mean() * 100.0
+    return gate.stats()['gate_ms'], static_skipped, recall
+
+
+def bench_cadence(clip, every, inference_ms):
+    """Gate only the frames the pipeline would forward to a model of this cost."""
+    gate = MotionGate()
+    forwarded = range(0, len(clip), every)
+    for i in forwarded:
+        gate.changed(clip[i], i / 30.0)
+    stats = gate.stats()
+    return len(forwarded), stats['checked'] - stats['skipped'], stats['skipped'] * inference_ms / 1000.0
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Motion gate benchmark")
+    parser.add_argument("--frames", type=int, default=600)
+    parser.add_argument("--width", type=int, default=640)
+    parser.add_argument("--height", type=int, default=480)
+    parser.add_argument("--episodes", type=int, default=3, help="Insect crawling episodes in the clip")
+    parser.add_argument("--thresholds", type=float, nargs='+', default=[0.002, 0.005, 0.01, 0.02])
+    parser.add_argument("--inference-ms", type=float, default=80.0, help="Cost of the stand-in model")
+    args = parser.parse_args()
+
+    clip, moving = synthetic_clip(args.frames, args.width, args.height, args.episodes)
+    print(f"{args.frames} frames of {args.width}x{args.height}, {moving.sum()} with a moving insect")
+    print(f"{'threshold':>10}{'gate ms':>10}{'static skipped':>16}{'motion caught':>15}")
+    for threshold in args.thresholds:
+        gate_ms, static_skipped, recall = bench_gate(clip, moving, threshold)
+        print(f"{threshold:>10}{gate_ms:>10.3f}{static_skipped:>15.1f}%{recall:>14.1f}%")
+
+    # The pipeline forwards a frame each time the model is free
+    every = max(1, int(np.ceil(args.inference_ms / (1000.0 / 30))))
+    forwarded, calls, saved = bench_cadence(clip, every, args.inference_ms)
+    print(f"\n{args.inference_ms:.0f} ms model at 30 fps: {forwarded} frames forwarded, "
+          f"{calls} model calls with the gate, {saved:.1f} s of {forwarded * args.inference_ms / 1000.0:.1f} s "
+          f"model time saved")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,347 @@
+"""Benchmark suite for the detection service.
+
+Runs each stage on synthetic JPEGs at several resolutions and reports
+throughput, p50/p95/p99 latency and peak traced memory:
+
+    decode      PestDetectionModel.decode on upload bytes
+    preprocess  PestDetectionModel.preprocess_image
+    detect      PestDetectionModel.detect, and detect_batch in batches
+    excel       update_excel_data calls and flush_excel cost into a temp workbook
+    http        POST /detect load, through the Flask test client or --url
+
+By default a small stand-in RandomForest with the real feature layout is
+trained into a temp directory; pass --model to benchmark a real artifact.
+Results can be saved as JSON and compared against an earlier run:
+
+    python benchmarks/bench_suite.py --output before.json
+    python benchmarks/bench_suite.py --compare before.json
+    python benchmarks/bench_suite.py --only http --url http://127.0.0.1:8000 --requests 2000
+"""
+import argparse
+import json
+import os
+import platform
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+import urllib.error
+import urllib.request
+import uuid
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from bench_preprocess import synthetic_jpeg
+
+BENCHMARKS = ('decode', 'preprocess', 'detect', 'excel', 'http')
+
+# Metrics where a higher value is better; every other one is a cost
+HIGHER_IS_BETTER = ('throughput',)
+
+
+def summarize(latencies, wall=None, items=None):
+    """Throughput and latency percentiles (ms) from per-call seconds."""
+    if not len(latencies):
+        return {'count': 0, 'throughput': 0.0, 'mean_ms': None, 'p50_ms': None, 'p95_ms': None, 'p99_ms': None}
+    latencies = np.array(latencies) * 1000.0
+    items = items if items is not None else len(latencies)
+    wall = wall if wall is not None else latencies.sum() / 1000.0
+    return {
+        'count': int(items),
+        'throughput': round(items / wall, 2) if wall else 0.0,
+        'mean_ms': round(float(latencies.mean()), 3),
+        'p50_ms': round(float(np.percentile(latencies, 50)), 3),
+        'p95_ms': round(float(np.percentile(latencies, 95)), 3),
+        'p99_ms': round(float(np.percentile(latencies, 99)), 3),
+    }
+
+
+def timed(func, inputs):
+    """Call func on each input, returning per-call seconds."""
+    latencies = []
+    for item in inputs:
+        start = time.perf_counter()
+        func(item)
+        latencies.append(time.perf_counter() - start)
+    return latencies
+
+
+def peak_memory(func, inputs):
+    """Peak traced allocation (MB) of one pass over inputs, measured apart from timing."""
+    tracemalloc.start()
+    for item in inputs:
+        func(item)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return round(peak / 1e6, 3)
+
+
+def measure(func, inputs, warmup=2):
+    for item in inputs[:warmup]:
+        func(item)
+    result = summarize(timed(func, inputs))
+    result['peak_mb'] = peak_memory(func, inputs[:8])
+    return result
+
+
+def stub_model(directory, classes=10, features=128 * 128):
+    """Train a small RandomForest with the production feature layout."""
+    import joblib
+    from sklearn.ensemble import RandomForestClassifier
+
+    rng = np.random.default_rng(0)
+    X = rng.random((200, features), dtype=np.float32)
+    y = np.arange(200) % classes
+    forest = RandomForestClassifier(n_estimators=20, max_depth=12, random_state=0).fit(X, y)
+    path = os.path.join(directory, 'stub_model.pkl')
+    joblib.dump(forest, path)
+    return path
+
+
+def bench_model_stages(model, payloads_by_size, batch_size):
+    results = {}
+    for size, payloads in payloads_by_size.items():
+        images = [model.decode(data) for data in payloads]
+        results[f'decode/{size}'] = measure(model.decode, payloads)
+        results[f'preprocess/{size}'] = measure(model.preprocess_image, images)
+        results[f'detect/{size}'] = measure(model.detect, images)
+
+        batches = [images[i:i + batch_size] for i in range(0, len(images), batch_size)]
+        for _ in range(2):
+            model.detect_batch(batches[0])
+        start = time.perf_counter()
+        latencies = timed(model.detect_batch, batches)
+        results[f'detect_batch/{size}'] = summarize(latencies, time.perf_counter() - start, len(images))
+    return results
+
+
+def bench_excel(directory, updates, flushes):
+    """Cost of recording detections and of flushing the changes to a workbook."""
+    from app import excel_integration as excel
+
+    excel.excel_file_path = os.path.join(directory, 'bench.xlsx')
+    excel.create_excel_file()
+    rng = np.random.default_rng(0)
+    pests = excel.PEST_TYPES
+
+    def update(i):
+        excel.update_excel_data({pests[i % len(pests)]: int(rng.integers(1, 4))}, location='bench')
+
+    results = {'excel/update': measure(update, list(range(updates)))}
+
+    # Each flush writes a few changed rows, as the update loop would
+    def flush(i):
+        for pest in pests[:3]:
+            excel.update_excel_data({pest: 1}, location='bench')
+        excel.sync_shared_store()
+        excel.flush_excel()
+
+    result = measure(flush, list(range(flushes)))
+    result['workbook_kb'] = round(os.path.getsize(excel.excel_file_path) / 1024.0, 1)
+    results['excel/flush'] = result
+    return results
+
+
+def multipart(data, field='image', filename='bench.jpg'):
+    """Encode one image as a multipart/form-data body."""
+    boundary = uuid.uuid4().hex
+    head = (
+        f'--{boundary}\r\nContent-Disposition: form-data; name="{field}"; filename="{filename}"\r\n'
+        f'Content-Type: image/jpeg\r\n\r\n'
+    ).encode()
+    return head + data + f'\r\n--{boundary}--\r\n'.encode(), f'multipart/form-data; boundary={boundary}'
+
+
+def bench_http(payloads, total, concurrency, url=None):
+    """Drive POST /detect from concurrent clients; every body is unique so the result cache misses."""
+    if url is None:
+        os.environ['RENDER'] = 'true'
+        from app import create_app
+        app = create_app()
+
+        def client():
+            test_client = app.test_client()
+
+            def post(body, content_type):
+                response = test_client.post('/detect', data=body, content_type=content_type)
+                return response.status_code
+            return post
+    else:
+        def client():
+            def post(body, content_type):
+                request = urllib.request.Request(url.rstrip('/') + '/detect', data=body,
+                                                 headers={'Content-Type': content_type})
+                try:
+                    with urllib.request.urlopen(request) as response:
+                        response.read()
+                        return response.status
+                except urllib.error.HTTPError as e:
+                    return e.code
+            return post
+
+    latencies = []
+    failures = []
+    lock = threading.Lock()
+    counter = iter(range(total))
+
+    def run():
+        post = client()
+        while True:
+            with lock:
+                i = next(counter, None)
+            if i is None:
+                return
+            # Bytes after the JPEG end marker are ignored by decoders but
+            # change the content hash
+            body, content_type = multipart(payloads[i % len(payloads)] + uuid.uuid4().bytes)
+            start = time.perf_counter()
+            status = post(body, content_type)
+            elapsed = time.perf_counter() - start
+            # Only successes count: fast 429/503 rejections would look
+            # like a speed-up
+            with lock:
+                if status == 200:
+                    latencies.append(elapsed)
+                else:
+                    failures.append(status)
+
+    # Warm up the model and the batching thread outside the measurement
+    warmup = client()
+    for data in payloads[:2]:
+        warmup(*multipart(data))
+
+    threads = [threading.Thread(target=run) for _ in range(concurrency)]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    result = summarize(latencies, time.perf_counter() - start)
+    result['concurrency'] = concurrency
+    result['errors'] = {str(status): failures.count(status) for status in sorted(set(failures))}
+    return {'http/detect': result}
+
+
+def compare(results, baseline, threshold):
+    """Print the change of each metric against a baseline run; returns the regressions."""
+    regressions = []
+    print(f"\n{'benchmark':<24}{'metric':<12}{'baseline':>12}{'current':>12}{'change':>10}")
+    for name, metrics in results.items():
+        before = baseline.get('results', {}).get(name)
+        if before is None:
+            continue
+        for metric in ('throughput', 'p50_ms', 'p95_ms', 'p99_ms', 'peak_mb'):
+            if metrics.get(metric) is None or not before.get(metric):
+                continue
+            change = (metrics[metric] - before[metric]) / before[metric] * 100.0
+            worse = -change if metric in HIGHER_IS_BETTER else change
+            flag = ' !' if worse > threshold else ''
+            if flag:
+                regressions.append((name, metric, round(change, 1)))
+            print(f"{name:<24}{metric:<12}{before[metric]:>12}{metrics[metric]:>12}{change:>9.1f}%{flag}")
+    return regressions
+
+
+def print_results(results):
+    print(f"{'benchmark':<24}{'count':>7}{'per s':>10}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'peak MB':>10}")
+    for name, metrics in results.items():
+        print(
+            f"{name:<24}{metrics['count']:>7}{metrics['throughput']:>10}{str(metrics['p50_ms']):>10}"
+            f"{str(metrics['p95_ms']):>10}{str(metrics['p99_ms']):>10}{metrics.get('peak_mb', ''):>10}"
+        )
+    for name, metrics in results.items():
+        if metrics.get('errors'):
+            failed = ', '.join(f"{count} x {status}" for status, count in metrics['errors'].items())
+            print(f"{name}: {sum(metrics['errors'].values())} request(s) failed ({failed}); "
+                  f"only the {metrics['count']} successes are timed")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Detection service benchmark suite")
+    parser.add_argument("--only", nargs='+', choices=BENCHMARKS, help="Benchmarks to run (default: all)")
+    parser.add_argument("--model", type=str,
+                        help="Model artifact to use instead of a stand-in trained on the fly")
+    parser.add_argument("--sizes", nargs='+', default=['640x480', '1920x1080', '4000x3000'],
+                        help="Synthetic image resolutions, WIDTHxHEIGHT")
+    parser.add_argument("--images", type=int, default=32, help="Images per resolution")
+    parser.add_argument("--batch-size", type=int, default=16)
+    parser.add_argument("--updates", type=int, default=5000, help="update_excel_data calls")
+    parser.add_argument("--flushes", type=int, default=20, help="flush_excel calls")
+    parser.add_argument("--requests", type=int, default=500, help="POST /detect requests")
+    parser.add_argument("--concurrency", type=int, default=16, help="Concurrent HTTP clients")
+    parser.add_argument("--http-size", default='1920x1080', help="Resolution of the HTTP payloads")
+    parser.add_argument("--url", type=str, help="Load a running server (e.g. gunicorn) instead of the test client")
+    parser.add_argument("--output", type=str, help="Write results as JSON")
+    parser.add_argument("--compare", type=str, help="Compare against a JSON file from an earlier run")
+    parser.add_argument("--threshold", type=float, default=10.0,
+                        help="Percent change counted as a regression in --compare")
+    args = parser.parse_args()
+
+    selected = args.only or BENCHMARKS
+    directory = tempfile.mkdtemp(prefix='pest_bench_')
+
+    # The app must see the model path (and a scratch model cache) before
+    # app.routes builds its model
+    os.environ.setdefault('PEST_MODEL_CACHE', os.path.join(directory, 'cache'))
+    # Every benchmark client comes from the same address
+    os.environ.setdefault('PEST_RATE_LIMIT', '0')
+    import app.model
+    model_path = args.model or stub_model(directory)
+    app.model.MODEL_PATH = model_path
+
+    sizes = [tuple(int(v) for v in size.split('x')) for size in args.sizes]
+    payloads_by_size = {}
+    for width, height in sizes:
+        payloads_by_size[f'{width}x{height}'] = [
+            synthetic_jpeg(width, height, seed) for seed in range(args.images)
+        ]
+
+    results = {}
+    if any(name in selected for name in ('decode', 'preprocess', 'detect')):
+        model = app.model.PestDetectionModel(model_path)
+        stages = bench_model_stages(model, payloads_by_size, args.batch_size)
+        results.update({name: value for name, value in stages.items() if name.split('/')[0].split('_')[0] in selected})
+    if 'excel' in selected:
+        results.update(bench_excel(directory, args.updates, args.flushes))
+    if 'http' in selected:
+        width, height = (int(v) for v in args.http_size.split('x'))
+        payloads = payloads_by_size.get(args.http_size) or [
+            synthetic_jpeg(width, height, seed) for seed in range(args.images)
+        ]
+        results.update(bench_http(payloads, args.requests, args.concurrency, args.url))
+
+    print_results(results)
+
+    report = {
+        'meta': {
+            'time': time.strftime("%Y-%m-%d %H:%M:%S"),
+            'python': platform.python_version(),
+            'machine': platform.machine(),
+            'cpus': os.cpu_count(),
+            'model': args.model or 'stub',
+            'args': vars(args),
+        },
+        'results': results,
+    }
+    if args.output:
+        with open(args.output, 'w') as file:
+            json.dump(report, file, indent=2)
+        print(f"Results written to {args.output}")
+
+    if args.compare:
+        with open(args.compare) as file:
+            baseline = json.load(file)
+        regressions = compare(results, baseline, args.threshold)
+        if regressions:
+            print(f"{len(regressions)} metric(s) regressed by more than {args.threshold}%")
+            sys.exit(1)
+
+    if any(metrics.get('errors') for metrics in results.values()):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
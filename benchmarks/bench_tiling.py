@@ -0,0 +1,140 @@
+"""Tile size vs. throughput vs. count accuracy for tiled detection.
+
+Draws synthetic sticky-trap photos (yellow card, small dark insects of two
+sizes at known positions) and counts them with PestDetectionModel in
+whole-image mode and tiled mode at several tile sizes. Counting uses a
+stand-in detector that, like YOLO, only sees each input letterboxed to 640
+pixels and finds dark blobs at least 3 pixels across, so the accuracy
+columns show what resolution is lost without tiling. With --onnx the same
+tile sizes are also timed through a real YOLO graph.
+
+    python benchmarks/bench_tiling.py --tiles 0 2560 1280 640
+"""
+import argparse
+import os
+import sys
+import time
+
+import cv2
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app.backends import Detections, OnnxYoloBackend
+from app.model import PestDetectionModel
+from app.model_loader import LoadedModel
+from app.tiling import tile_grid
+
+# Insect sizes in pixels per class of the synthetic traps
+SIZES = {0: (6, 10), 1: (16, 28)}
+
+
+def synthetic_trap(width, height, insects, seed):
+    """Return (image, true counts per class)."""
+    rng = np.random.default_rng(seed)
+    image = np.empty((height, width, 3), np.uint8)
+    image[:] = (40, 210, 235)
+    image = cv2.add(image, rng.integers(0, 12, image.shape, dtype=np.uint8))
+    counts = {cls: 0 for cls in SIZES}
+    occupied = np.zeros((height // 32 + 1, width // 32 + 1), bool)
+    while sum(counts.values()) < insects:
+        cls = int(rng.integers(0, len(SIZES)))
+        low, high = SIZES[cls]
+        size = int(rng.integers(low, high + 1))
+        x, y = int(rng.integers(size, width - size)), int(rng.integers(size, height - size))
+        # Keep insects apart so the true count is unambiguous
+        cell = occupied[y // 32 - 1:y // 32 + 2, x // 32 - 1:x // 32 + 2]
+        if cell.any():
+            continue
+        occupied[y // 32, x // 32] = True
+        cv2.ellipse(image, (x, y), (size // 2, max(1, size // 3)), float(rng.integers(0, 180)), 0, 360,
+                    (20, 25, 30), -1)
+        counts[cls] += 1
+    return image, counts
+
+
+class BlobDetector:
+    """Stand-in YOLO backend: dark connected components in the 640px letterboxed input."""
+
+    name = 'blobs'
+    source = 'synthetic'
+
+    def __init__(self, input_size=640, min_side=3):
+        self.input_size = input_size
+        self.min_side = min_side
+
+    def __call__(self, images):
+        results = []
+        for image in images:
+            height, width = image.shape[:2]
+            scale = min(1.0, self.input_size / max(width, height))
+            small = cv2.resize(image, (max(1, round(width * scale)), max(1, round(height * scale))),
+                               interpolation=cv2.INTER_AREA)
+            mask = (cv2.cvtColor(small, cv2.COLOR_BGR2GRAY) < 100).astype(np.uint8)
+            _, _, stats, _ = cv2.connectedComponentsWithStats(mask)
+            stats = stats[1:]
+            stats = stats[(stats[:, 2] >= self.min_side) & (stats[:, 3] >= self.min_side)]
+            boxes = np.stack([stats[:, 0], stats[:, 1], stats[:, 0] + stats[:, 2], stats[:, 1] + stats[:, 3]],
+                             axis=1).astype(np.float32) / scale
+            # Classify by size in original pixels, like the two synthetic species
+            longest = np.maximum(boxes[:, 2] - boxes[:, 0], boxes[:, 3] - boxes[:, 1])
+            classes = (longest > (SIZES[0][1] + SIZES[1][0]) / 2).astype(np.intp)
+            results.append(Detections(boxes, np.full(len(boxes), 0.9, np.float32), classes))
+        return results
+
+
+def run(detect, images, repeats):
+    detect(images[:1])  # warm-up
+    best = None
+    for _ in range(repeats):
+        start = time.perf_counter()
+        results = detect(images)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return results, len(images) / best
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Tiled detection benchmark")
+    parser.add_argument("--width", type=int, default=5472)
+    parser.add_argument("--height", type=int, default=3648)
+    parser.add_argument("--images", type=int, default=4)
+    parser.add_argument("--insects", type=int, default=300, help="Insects per image")
+    parser.add_argument("--tiles", type=int, nargs='+', default=[0, 2560, 1280, 640],
+                        help="Tile sizes to compare (0 = whole image, no tiling)")
+    parser.add_argument("--overlap", type=int, default=128)
+    parser.add_argument("--repeats", type=int, default=2)
+    parser.add_argument("--onnx", help="Also time a real YOLO ONNX graph at each tile size")
+    args = parser.parse_args()
+
+    traps = [synthetic_trap(args.width, args.height, args.insects, seed) for seed in range(args.images)]
+    images = [image for image, _ in traps]
+    truth = np.array([[counts[cls] for cls in SIZES] for _, counts in traps])
+    class_names = ["Aphid", "Beetle"]
+
+    backends = [('blobs', BlobDetector())]
+    if args.onnx:
+        backends.append(('onnx', OnnxYoloBackend(args.onnx)))
+
+    print(f"{args.images} x {args.width}x{args.height} traps, {args.insects} insects each, overlap {args.overlap}px")
+    print(f"{'backend':<8}{'tile':>7}{'tiles':>7}{'images/s':>10}{'counted':>9}{'true':>7}{'error':>8}")
+    for name, backend in backends:
+        for tile in args.tiles:
+            model = PestDetectionModel(tiled=False)
+            model.loaded = LoadedModel(backend, 'yolo', 0.0, backend.source)
+            model.class_names = class_names
+            if tile:
+                results, throughput = run(lambda batch: model.detect_tiled_batch(batch, tile, args.overlap),
+                                          images, args.repeats)
+                tiles = len(tile_grid(images[0].shape, tile, args.overlap))
+            else:
+                results, throughput = run(model.detect_batch, images, args.repeats)
+                tiles = 1
+            counted = np.array([[result.get(pest, 0) for pest in class_names] for result in results])
+            error = np.abs(counted - truth).sum() / truth.sum() * 100.0
+            label = str(tile) if tile else 'whole'
+            print(f"{name:<8}{label:>7}{tiles:>7}{throughput:>10.2f}{counted.sum():>9}{truth.sum():>7}{error:>7.1f}%")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,92 @@
+"""Peak RSS of handling one large upload, before and after the streaming path.
+
+Each path runs in a fresh subprocess against a 12MP JPEG on disk (the way
+Werkzeug spools large uploads), and the growth of ru_maxrss across the
+request is reported. The streaming path only decodes at reduced
+resolution when PEST_REDUCED_DECODE=true is set.
+
+    PEST_REDUCED_DECODE=true python benchmarks/bench_upload.py
+"""
+import argparse
+import io
+import json
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+
+import cv2
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app.preprocessing import BatchPreprocessor, decode_grayscale
+from app.validation import read_limited
+
+
+def original(file):
+    """The old /detect path: whole bytes, a numpy view, full-size BGR, float64 features."""
+    image_bytes = file.read()
+    nparr = np.frombuffer(image_bytes, np.uint8)
+    image = cv2.imdecode(nparr, cv2.IMREAD_COLOR)
+    gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
+    resized = cv2.resize(gray, (128, 128))
+    return resized.flatten() / 255.0
+
+
+def streaming(file):
+    """The new path: bounded chunked read, grayscale decode, buffers dropped early."""
+    image_bytes = read_limited(file)
+    image = decode_grayscale(image_bytes)
+    del image_bytes
+    return BatchPreprocessor().transform([image])
+
+
+def rss_kb():
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+
+def child(mode, path):
+    func = {'original': original, 'streaming': streaming}[mode]
+    # Run once on a tiny image so lazy imports and allocator warm-up
+    # don't count as request cost
+    tiny = cv2.imencode('.jpg', np.zeros((256, 256, 3), dtype=np.uint8))[1].tobytes()
+    func(io.BytesIO(tiny))
+    before = rss_kb()
+    with open(path, 'rb') as file:
+        func(file)
+    print(json.dumps({'mode': mode, 'peak_growth_mb': (rss_kb() - before) / 1024.0}))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Upload path peak RSS benchmark")
+    parser.add_argument("--width", type=int, default=4000)
+    parser.add_argument("--height", type=int, default=3000)
+    parser.add_argument("--child", nargs=2, metavar=('MODE', 'PATH'), help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        child(*args.child)
+        return
+
+    rng = np.random.default_rng(0)
+    small = rng.integers(0, 256, size=(args.height // 16, args.width // 16, 3), dtype=np.uint8)
+    image = cv2.resize(small, (args.width, args.height), interpolation=cv2.INTER_CUBIC)
+    with tempfile.NamedTemporaryFile(suffix='.jpg', delete=False) as file:
+        file.write(cv2.imencode('.jpg', image, [cv2.IMWRITE_JPEG_QUALITY, 90])[1].tobytes())
+        path = file.name
+
+    try:
+        size_mb = os.path.getsize(path) / 1e6
+        print(f"{args.width}x{args.height} JPEG, {size_mb:.1f} MB")
+        for mode in ('original', 'streaming'):
+            output = subprocess.check_output([sys.executable, __file__, '--child', mode, path])
+            result = json.loads(output.decode().strip().splitlines()[-1])
+            print(f"{mode:<10} peak RSS growth {result['peak_growth_mb']:8.1f} MB")
+    finally:
+        os.remove(path)
+
+
+if __name__ == "__main__":
+    main()
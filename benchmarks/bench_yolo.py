@@ -0,0 +1,110 @@
+"""Throughput of the YOLO fallback backends and of box post-processing on CPU.
+
+Runs the PyTorch and ONNX Runtime backends on the same synthetic frames for
+each intra-op thread count, then compares the old per-box Python loop over
+ultralytics Boxes with the vectorized mask + bincount count.
+
+    python benchmarks/bench_yolo.py --weights yolov8n.pt --threads 1 4 0
+"""
+import argparse
+import os
+import sys
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app.backends import OnnxYoloBackend, TorchYoloBackend, count_classes, export_onnx
+from app.schema import PEST_TYPES as CLASS_NAMES
+
+
+def loop_count(r, class_names):
+    """The original per-box loop from PestDetectionModel.detect."""
+    result = {}
+    for box in r.boxes:
+        cls = int(box.cls[0])
+        conf = float(box.conf[0])
+        if cls < len(class_names) and conf > 0.5:
+            pest_name = class_names[cls]
+            result[pest_name] = result.get(pest_name, 0) + 1
+    return result
+
+
+def bench_backend(backend, frames, batch_size, repeats):
+    batches = [frames[i:i + batch_size] for i in range(0, len(frames), batch_size)]
+    backend(batches[0])  # warm-up
+    best = None
+    for _ in range(repeats):
+        start = time.perf_counter()
+        for batch in batches:
+            backend(batch)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return len(frames) / best
+
+
+def bench_postprocess(boxes_per_image, images):
+    import torch
+    from ultralytics.engine.results import Results
+
+    rng = np.random.default_rng(0)
+    results = []
+    for _ in range(images):
+        xy = rng.random((boxes_per_image, 2)) * 600
+        data = np.concatenate([
+            xy, xy + 20,
+            rng.random((boxes_per_image, 1)),
+            rng.integers(0, 80, (boxes_per_image, 1)),
+        ], axis=1)
+        results.append(Results(np.zeros((640, 640, 3), np.uint8), path='', names={i: str(i) for i in range(80)},
+                               boxes=torch.tensor(data, dtype=torch.float32)))
+
+    start = time.perf_counter()
+    loop = [loop_count(r, CLASS_NAMES) for r in results]
+    loop_time = time.perf_counter() - start
+
+    start = time.perf_counter()
+    vectorized = [
+        count_classes(r.boxes.cls.numpy().astype(np.intp), r.boxes.conf.numpy(), CLASS_NAMES)
+        for r in results
+    ]
+    vectorized_time = time.perf_counter() - start
+
+    assert loop == vectorized, "vectorized counts differ from the loop"
+    return loop_time / images * 1000.0, vectorized_time / images * 1000.0
+
+
+def main():
+    parser = argparse.ArgumentParser(description="YOLO backend benchmark")
+    parser.add_argument("--weights", required=True, help="Local YOLO weights (.pt)")
+    parser.add_argument("--onnx", help="Pre-exported ONNX graph (default: export the weights)")
+    parser.add_argument("--threads", type=int, nargs='+', default=[0],
+                        help="Intra-op thread counts to try (0 = all cores)")
+    parser.add_argument("--frames", type=int, default=32)
+    parser.add_argument("--batch-size", type=int, default=8)
+    parser.add_argument("--repeats", type=int, default=3)
+    parser.add_argument("--boxes", type=int, default=100, help="Boxes per image for the post-processing test")
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(0)
+    frames = [rng.integers(0, 256, (720, 1280, 3), dtype=np.uint8) for _ in range(args.frames)]
+    onnx_path = args.onnx or export_onnx(args.weights)
+
+    print(f"{args.frames} frames of 1280x720, batch {args.batch_size}")
+    print(f"{'backend':<10}{'threads':>8}{'frames/s':>12}")
+    for threads in args.threads:
+        # torch's thread count is process-wide, so 'default' is set explicitly
+        threads = threads or os.cpu_count()
+        for name, make in (('torch', lambda: TorchYoloBackend(args.weights, threads)),
+                           ('onnx', lambda: OnnxYoloBackend(onnx_path, threads))):
+            fps = bench_backend(make(), frames, args.batch_size, args.repeats)
+            print(f"{name:<10}{threads:>8}{fps:>12.2f}")
+
+    loop_ms, vectorized_ms = bench_postprocess(args.boxes, 200)
+    print(f"post-processing {args.boxes} boxes: loop {loop_ms:.3f} ms, "
+          f"vectorized {vectorized_ms:.3f} ms ({loop_ms / vectorized_ms:.0f}x)")
+
+
+if __name__ == "__main__":
+    main()
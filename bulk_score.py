@@ -0,0 +1,256 @@
+"""Offline bulk scoring of image directories and archives.
+
+Images are grouped into fixed-size chunks in a deterministic order. Each
+chunk is read, decoded and run through one batched model call in a pool of
+worker processes, which write its rows straight to a part file in the
+output directory. Part files are written atomically and double as the
+checkpoint: rerunning the same command skips chunks that already have one.
+When every chunk is done, summary.xlsx is written from the parts.
+
+    python bulk_score.py /data/traps /data/2023.tar.gz --out scores --workers 16
+"""
+import json
+import os
+import signal
+import time
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+
+import cv2
+import pandas as pd
+
+from app.archive import chunked, iter_tar_members, iter_zip_members, read_member
+from app.excel_integration import atomic_path
+from app.validation import allowed_filename
+
+MANIFEST = 'manifest.json'
+COLUMNS = ['source', 'image', 'pest', 'count', 'error']
+
+# Set in each worker process by _init_worker
+_model = None
+
+
+def _init_worker(model_path):
+    """Load one model per worker process."""
+    global _model
+    # Ctrl+C is handled by the parent, which shuts the pool down
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    # The pool already uses every core; stop OpenCV adding its own threads
+    cv2.setNumThreads(1)
+    from app.model import PestDetectionModel
+    _model = PestDetectionModel(model_path)
+    _model.load()
+
+
+def iter_images(path):
+    """Yield (source, image name, path or bytes) for every image under path.
+
+    Directories are walked in sorted order and yield file paths, so workers
+    read them; archive members are read here since they come from a stream.
+    """
+    source = os.path.basename(os.path.normpath(path))
+    if os.path.isdir(path):
+        for root, dirs, files in os.walk(path):
+            dirs.sort()
+            for name in sorted(files):
+                if allowed_filename(name):
+                    full = os.path.join(root, name)
+                    yield source, os.path.relpath(full, path), full
+    elif path.lower().endswith('.zip'):
+        with open(path, 'rb') as file:
+            for name, data in iter_zip_members(file):
+                yield source, name, data
+    else:
+        with open(path, 'rb') as file:
+            for name, data in iter_tar_members(file):
+                yield source, name, data
+
+
+def part_path(out_dir, index, fmt):
+    return os.path.join(out_dir, f"part-{index:06d}.{fmt}")
+
+
+def write_frame(df, path, fmt):
+    """Write a DataFrame atomically so a killed run never leaves half a part."""
+    tmp_path = path + '.tmp'
+    if fmt == 'parquet':
+        df.to_parquet(tmp_path, index=False)
+    else:
+        df.to_csv(tmp_path, index=False)
+    os.replace(tmp_path, path)
+
+
+def _score_chunk(index, items, path, fmt):
+    """Score one chunk in a worker and write its part file; returns (index, images, errors)."""
+    rows = []
+    images, decoded = [], []
+    for source, name, data in items:
+        if isinstance(data, str):
+            with open(data, 'rb') as file:
+                data = read_member(file, os.path.getsize(data))
+        if data is None:
+            rows.append((source, name, None, 0, 'too large'))
+            continue
+        image = _model.decode(data)
+        if image is None:
+            rows.append((source, name, None, 0, 'invalid image'))
+            continue
+        images.append(image)
+        decoded.append((source, name))
+
+    for (source, name), detections in zip(decoded, _model.detect_batch(images)):
+        if not detections:
+            rows.append((source, name, None, 0, None))
+        for pest, count in detections.items():
+            rows.append((source, name, pest, count, None))
+
+    write_frame(pd.DataFrame(rows, columns=COLUMNS), path, fmt)
+    return index, len(items), len(items) - len(images)
+
+
+def read_parts(out_dir, fmt):
+    """Load every part file in the output directory as one DataFrame."""
+    paths = sorted(
+        os.path.join(out_dir, name) for name in os.listdir(out_dir)
+        if name.startswith('part-') and name.endswith('.' + fmt)
+    )
+    read = pd.read_parquet if fmt == 'parquet' else pd.read_csv
+    frames = [read(path) for path in paths]
+    if not frames:
+        return pd.DataFrame(columns=COLUMNS)
+    return pd.concat(frames, ignore_index=True)
+
+
+def write_summary(out_dir, fmt):
+    """Write summary.xlsx with totals per pest and per source from the part files."""
+    df = read_parts(out_dir, fmt)
+    found = df[df['pest'].notna()]
+    totals = found.groupby('pest')['count'].sum()
+    summary = pd.DataFrame({
+        'Pest Type': totals.index,
+        'Count': totals.values,
+        'Images': found.groupby('pest')['image'].nunique().reindex(totals.index).values,
+    })
+    by_source = found.pivot_table(index='source', columns='pest', values='count', aggfunc='sum', fill_value=0)
+    overview = pd.DataFrame({
+        'Images': [df[['source', 'image']].drop_duplicates().shape[0]],
+        'With Detections': [found[['source', 'image']].drop_duplicates().shape[0]],
+        'Errors': [int(df['error'].notna().sum())],
+        'Generated': [time.strftime("%Y-%m-%d %H:%M:%S")],
+    })
+
+    path = os.path.join(out_dir, 'summary.xlsx')
+    with atomic_path(path) as tmp_path:
+        with pd.ExcelWriter(tmp_path, engine='openpyxl') as writer:
+            summary.to_excel(writer, sheet_name='Pest Totals', index=False)
+            by_source.to_excel(writer, sheet_name='By Source')
+            overview.to_excel(writer, sheet_name='Run', index=False)
+    return path
+
+
+def check_manifest(out_dir, manifest):
+    """Refuse to resume into an output directory made with different settings."""
+    path = os.path.join(out_dir, MANIFEST)
+    if os.path.exists(path):
+        with open(path) as file:
+            previous = json.load(file)
+        if previous != manifest:
+            raise SystemExit(
+                f"Error: {out_dir} holds a run with different inputs or settings: {previous}"
+            )
+    else:
+        with open(path, 'w') as file:
+            json.dump(manifest, file, indent=2)
+
+
+def score(inputs, out_dir, model_path=None, workers=None, chunk_size=64, fmt='csv', report_interval=10.0):
+    """Score every image under inputs, resuming from existing part files; returns the summary path."""
+    workers = workers or os.cpu_count() or 1
+    os.makedirs(out_dir, exist_ok=True)
+    # Chunk indices depend on the inputs and chunk size, so both must match to resume
+    check_manifest(out_dir, {
+        'inputs': [os.path.abspath(path) for path in inputs],
+        'chunk_size': chunk_size,
+        'format': fmt,
+    })
+    done = {name for name in os.listdir(out_dir) if name.startswith('part-')}
+
+    def chunks():
+        items = (item for path in inputs for item in iter_images(path))
+        return enumerate(chunked(items, chunk_size))
+
+    started = time.perf_counter()
+    last_report = started
+    images = errors = skipped = 0
+    pending = set()
+    with ProcessPoolExecutor(workers, initializer=_init_worker, initargs=(model_path,)) as pool:
+        try:
+            for index, items in chunks():
+                path = part_path(out_dir, index, fmt)
+                if os.path.basename(path) in done:
+                    skipped += len(items)
+                    continue
+                # Keep a couple of chunks queued per worker, and no more, so
+                # archive bytes don't pile up in memory
+                while len(pending) >= workers * 2:
+                    finished, pending = wait(pending, return_when=FIRST_COMPLETED)
+                    for future in finished:
+                        _, count, failed = future.result()
+                        images += count
+                        errors += failed
+                pending.add(pool.submit(_score_chunk, index, items, path, fmt))
+
+                now = time.perf_counter()
+                if report_interval and now - last_report >= report_interval:
+                    last_report = now
+                    print(f"[bulk] {images} images scored ({images / (now - started):.1f}/s), "
+                          f"{skipped} already done, {errors} errors")
+
+            for future in wait(pending).done:
+                _, count, failed = future.result()
+                images += count
+                errors += failed
+        except KeyboardInterrupt:
+            # Parts already written stay as the checkpoint for the next run
+            print("Interrupted; rerun the same command to resume")
+            for future in pending:
+                future.cancel()
+            raise
+
+    elapsed = time.perf_counter() - started
+    print(f"[bulk] {images} images scored in {elapsed:.1f}s ({images / elapsed:.1f}/s), "
+          f"{skipped} skipped from a previous run, {errors} errors")
+    summary = write_summary(out_dir, fmt)
+    print(f"Summary written to {summary}")
+    return summary
+
+
+def parquet_available():
+    try:
+        import pyarrow  # noqa: F401
+        return True
+    except ImportError:
+        return False
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Score image directories and archives in bulk")
+    parser.add_argument("inputs", nargs='+', help="Image directories, ZIP files or tarballs")
+    parser.add_argument("--out", required=True, help="Output directory for part files and summary.xlsx")
+    parser.add_argument("--model", type=str, help="Path to the model artifact")
+    parser.add_argument("--workers", type=int, help="Worker processes (default: all cores)")
+    parser.add_argument("--chunk-size", type=int, default=64, help="Images per batched model call")
+    parser.add_argument("--format", choices=['parquet', 'csv'], default='parquet', help="Part file format")
+    args = parser.parse_args()
+
+    fmt = args.format
+    if fmt == 'parquet' and not parquet_available():
+        print("pyarrow is not installed; writing CSV parts instead")
+        fmt = 'csv'
+
+    try:
+        score(args.inputs, args.out, model_path=args.model, workers=args.workers,
+              chunk_size=args.chunk_size, fmt=fmt)
+    except KeyboardInterrupt:
+        pass
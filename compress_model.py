@@ -0,0 +1,84 @@
+"""Shrink the scikit-learn classifier and check what it costs in accuracy.
+
+The classifier reads 16384 features per image (a flattened 128x128
+grayscale), so its memory per worker and its prediction cost grow with
+that width. This script scores a labelled image directory (one
+subdirectory of images per pest, named as in PEST_TYPES) through the
+upload preprocessing, holds part of it out, and builds:
+
+    original      the artifact as it is
+    float32       its float64 arrays stored as float32
+    pcaN          N PCA components plus a copy of the classifier refit on them
+    pcaN-int8     the same with the projection stored as int8
+
+Each variant is scored on the held-out images for accuracy, latency per
+image (alone and in batches of 32), artifact size and the memory a fresh
+worker holds after loading it through model_loader. The smallest variant
+within --max-drop accuracy of the original is written to --out. It takes
+the same 16384 features, so the app serves it with PEST_MODEL_PATH=<out>.
+
+Accuracy of the original is only comparable if the held-out images weren't
+part of its training data.
+
+    python compress_model.py --data /data/labelled --components 64 256 --report compression.json
+"""
+import argparse
+import json
+import os
+import tempfile
+
+import joblib
+
+from app.compression import build_variants, choose, evaluate, load_dataset, save_artifact, split
+from app.model import MODEL_PATH
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Build and compare compressed classifier variants")
+    parser.add_argument("--model", default=MODEL_PATH, help="Classifier artifact to compress")
+    parser.add_argument("--data", required=True, help="Directory with one subdirectory of images per pest")
+    parser.add_argument("--holdout", type=float, default=0.2, help="Fraction of images held out for scoring")
+    parser.add_argument("--components", type=int, nargs='+', default=[64, 256])
+    parser.add_argument("--max-drop", type=float, default=0.01, help="Accuracy the compact artifact may lose")
+    parser.add_argument("--out", help="Where to write the compact artifact (default: next to --model)")
+    parser.add_argument("--report", help="Also write the comparison as JSON here")
+    args = parser.parse_args()
+
+    model = joblib.load(args.model)
+    X, y = load_dataset(args.data)
+    if getattr(model, 'n_features_in_', X.shape[1]) != X.shape[1]:
+        parser.error(f"{args.model} takes {model.n_features_in_} features, the preprocessing gives {X.shape[1]}")
+    X_train, X_test, y_train, y_test = split(X, y, args.holdout)
+    print(f"{len(X)} images, {len(X_train)} to fit the PCA variants, {len(X_test)} held out")
+
+    variants = build_variants(model, X_train, y_train, args.components)
+    with tempfile.TemporaryDirectory() as directory:
+        results = [evaluate(estimator, X_test, y_test, directory, name) for name, estimator in variants.items()]
+
+        print(f"{'variant':<12}{'size MB':>9}{'RSS MB':>9}{'ms/img':>9}{'ms/img@32':>11}{'accuracy':>10}")
+        for r in results:
+            if 'error' in r:
+                print(f"{r['variant']:<12}  failed: {r['error']}")
+                continue
+            print(f"{r['variant']:<12}{r['size_mb']:>9.2f}{r['rss_mb']:>9.1f}{r['ms_single']:>9.3f}"
+                  f"{r['ms_batch']:>11.3f}{r['accuracy']:>10.3f}")
+
+        best = choose(results, args.max_drop)
+        if best is None:
+            print("The original artifact failed to score the held-out images; nothing written")
+        else:
+            out = args.out or f"{os.path.splitext(args.model)[0]}.compact.joblib"
+            save_artifact(variants[best['variant']], out)
+            print(f"Wrote {best['variant']} to {out}; serve it with PEST_MODEL_PATH={out}")
+
+    if args.report:
+        for r in results:
+            r.pop('path', None)
+        report = {'model': args.model, 'data': args.data, 'train': len(X_train), 'held_out': len(X_test),
+                  'max_drop': args.max_drop, 'chosen': best and best['variant'], 'variants': results}
+        with open(args.report, 'w') as f:
+            json.dump(report, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
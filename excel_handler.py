@@ -4,6 +4,7 @@ import xlwings as xw
 import pandas as pd
 from datetime import datetime
 import time
+from app.schema import DATA_SHEET, VISUALIZATION_SHEET, initial_data
 
 class ExcelRealTimeInterface:
     def __init__(self):
@@ -42,28 +43,19 @@ class ExcelRealTimeInterface:
         """Create a new Excel workbook with required structure."""
         self.wb = self.app.books.add()
         
-        # Create the data sheet
-        pest_types = [
-            "Aphid", "Armyworm", "Beetle", "Bollworm", "Grasshopper", 
-            "Leafhopper", "Mite", "Mosquito", "Stem Borer", "Thrips"
-        ]
-        
-        data = {
-            'Pest Type': pest_types,
-            'Count': [0] * len(pest_types),
-            'Last Updated': [''] * len(pest_types),
-            'Location': [''] * len(pest_types)
-        }
-        
-        df = pd.DataFrame(data)
+        # Same layout as the workbook the web app writes: per-pest totals,
+        # then hourly counts per pest from the detection history
+        from app.excel_integration import visualization_table
+        df = pd.DataFrame(initial_data())
+        header, rows = visualization_table()
         
         # Create data sheet
-        data_sheet = self.wb.sheets.add('Pest Detection Data')
+        data_sheet = self.wb.sheets.add(DATA_SHEET)
         data_sheet.range('A1').options(index=False).value = df
         
         # Create visualization sheet
-        viz_sheet = self.wb.sheets.add('Visualization')
-        viz_sheet.range('A1').options(index=False).value = df[['Pest Type', 'Count']]
+        viz_sheet = self.wb.sheets.add(VISUALIZATION_SHEET)
+        viz_sheet.range('A1').value = [header] + rows
         
         # Save the workbook
         self.wb.save(self.excel_path)
@@ -84,37 +76,33 @@ class ExcelRealTimeInterface:
         dashboard.range('A1').font.size = 16
         dashboard.range('A1').font.bold = True
         
-        # Add a refresh timestamp cell
-        dashboard.range('A3').value = "Last Refresh:"
-        dashboard.range('B3').formula = "=NOW()"
+        # When this sheet was built; a volatile NOW() would recalculate the
+        # whole workbook on every change. Live counts are at /dashboard.
+        dashboard.range('A3').value = "Built:"
+        dashboard.range('B3').value = datetime.now()
         dashboard.range('B3').number_format = "yyyy-mm-dd hh:mm:ss"
         
         # Add table headers
         dashboard.range('A5').value = [['Pest Type', 'Count', 'Last Updated']]
         dashboard.range('A5:C5').font.bold = True
         
-        # Add data from the data sheet with INDIRECT formula for real-time updates
-        # This creates a reference to the data sheet that updates automatically
-        sheet_name = "'Pest Detection Data'"
+        # Plain references to the data sheet: unlike INDIRECT they aren't
+        # volatile, so Excel only recalculates the cells whose source changed
+        sheet_name = f"'{DATA_SHEET}'"
         
         # Get pest types from data sheet
-        data_sheet = self.wb.sheets['Pest Detection Data']
+        data_sheet = self.wb.sheets[DATA_SHEET]
         pest_types = data_sheet.range('A2').expand('down').value
         
         if not isinstance(pest_types, list):
             pest_types = [pest_types]
         
-        # Add dynamic references to each pest type
+        # Add references to each pest type's row
         for i, pest in enumerate(pest_types):
             row = 6 + i
             dashboard.range(f'A{row}').value = pest
-            
-            # Use INDIRECT to create dynamic references to the data sheet
-            count_cell = f'INDIRECT("{sheet_name}!B{i+2}")'
-            updated_cell = f'INDIRECT("{sheet_name}!C{i+2}")'
-            
-            dashboard.range(f'B{row}').formula = f"={count_cell}"
-            dashboard.range(f'C{row}').formula = f"={updated_cell}"
+            dashboard.range(f'B{row}').formula = f"={sheet_name}!B{i+2}"
+            dashboard.range(f'C{row}').formula = f"={sheet_name}!C{i+2}"
         
         # Add a chart
         chart_row = 6 + len(pest_types) + 2
@@ -0,0 +1,21 @@
+import os
+
+# Load the model in the master before workers are forked, so every worker
+# starts warm and shares the model's pages copy-on-write
+preload_model = os.environ.get('PEST_PRELOAD_MODEL', 'true') == 'true'
+
+# Threads per worker (gunicorn uses gthread workers when this is above 1):
+# concurrent /detect calls get batched together, and every /live viewer
+# holds a thread for as long as it watches, up to PEST_LIVE_MAX_SUBSCRIBERS
+threads = int(os.environ.get('PEST_GUNICORN_THREADS', '32'))
+
+def on_starting(server):
+    if preload_model:
+        from app.model_loader import preload
+        preload()
+
+def worker_exit(server, worker):
+    # Push this worker's unsynced counts and history and give up the
+    # export lease, or they're lost when gunicorn recycles the worker
+    from app.excel_integration import cleanup
+    cleanup()
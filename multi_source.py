@@ -0,0 +1,251 @@
+import os
+import signal
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import cv2
+
+from video_pipeline import DropOldestQueue
+from app.validation import allowed_filename
+
+# Set in each inference worker process by _init_worker
+_detector = None
+
+
+def _init_worker(model_path):
+    """Load one model instance per worker process."""
+    global _detector
+    # Ctrl+C is handled by the parent, which shuts the pool down
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    from app.model import PestDetectionModel
+    _detector = PestDetectionModel(model_path)
+    _detector.load()
+
+
+def _detect(image):
+    return _detector.detect(image)
+
+
+# Characters a source name can't contain, so the '=' in a URL's query
+# string (or a Windows drive path) isn't taken for a 'name=' prefix
+NAME_EXCLUDED = set(':/\\?&')
+
+
+def parse_spec(spec):
+    """Split 'name=target' into (name, target); name is None when there's no prefix."""
+    name, sep, target = spec.partition('=')
+    if not sep or not name or NAME_EXCLUDED & set(name):
+        return None, spec
+    return name, target
+
+
+class Source:
+    """One camera, video file/stream, or watched image folder.
+
+    spec is a camera index, a path/URL, or a directory; an optional
+    'name=' prefix (a name without ':', '/', '\\', '?' or '&') sets the
+    name used as the detection Location.
+    """
+
+    def __init__(self, spec, pace=True, poll_interval=1.0):
+        name, target = parse_spec(spec)
+        self.target = int(target) if target.isdigit() else target
+        self.is_folder = isinstance(self.target, str) and os.path.isdir(self.target)
+        if name:
+            self.name = name
+        elif isinstance(self.target, int):
+            self.name = f"camera-{self.target}"
+        else:
+            self.name = os.path.basename(os.path.normpath(self.target))
+
+        self.pace = pace
+        self.poll_interval = poll_interval
+        self.latest = DropOldestQueue(1)
+        self.finished = False
+        self.captured = 0
+        self.processed = 0
+
+    def frames(self, stopping):
+        """Yield frames until the source ends or stopping is set."""
+        if self.is_folder:
+            yield from self._watch_folder(stopping)
+            return
+
+        cap = cv2.VideoCapture(self.target)
+        if not cap.isOpened():
+            print(f"Error: Could not open video source {self.target}")
+            return
+        # Recorded files are replayed at their native rate, like a camera
+        is_file = isinstance(self.target, str) and os.path.isfile(self.target)
+        interval = 1.0 / (cap.get(cv2.CAP_PROP_FPS) or 30.0) if is_file and self.pace else 0.0
+        try:
+            next_frame = time.perf_counter()
+            while not stopping.is_set():
+                ok, frame = cap.read()
+                if not ok:
+                    break
+                yield frame
+                if interval:
+                    next_frame += interval
+                    time.sleep(max(0.0, next_frame - time.perf_counter()))
+        finally:
+            cap.release()
+
+    def _watch_folder(self, stopping):
+        """Yield each new image that appears in the folder, oldest first."""
+        seen = set()
+        while not stopping.is_set():
+            entries = []
+            for entry in os.scandir(self.target):
+                if entry.is_file() and entry.path not in seen and allowed_filename(entry.name):
+                    entries.append((entry.stat().st_mtime, entry.path))
+            for _, path in sorted(entries):
+                seen.add(path)
+                frame = cv2.imread(path)
+                if frame is not None:
+                    yield frame
+            stopping.wait(self.poll_interval)
+
+
+class MultiSourceIngest:
+    """Ingest many video sources into one shared pool of inference processes.
+
+    Each source has a capture thread that keeps only its newest frame, so a
+    slow pool makes sources skip frames rather than queue them. A dispatcher
+    hands frames to the pool round-robin across sources, bounded by
+    max_in_flight, and each result is recorded with the source name as its
+    Location through update_excel_data.
+    """
+
+    def __init__(self, sources, workers=None, model_path=None, max_in_flight=None,
+                 report_interval=10.0, record=None):
+        self.sources = sources
+        self.workers = workers or os.cpu_count() or 1
+        self.model_path = model_path
+        self.max_in_flight = max_in_flight or self.workers * 2
+        self.report_interval = report_interval
+        self.stopping = threading.Event()
+        self.ready = threading.Event()
+        self.in_flight = threading.BoundedSemaphore(self.max_in_flight)
+        self.lock = threading.Lock()
+        self.started = None
+
+        if record is None:
+            from app.excel_integration import update_excel_data
+            record = update_excel_data
+        self.record = record
+
+    def _capture(self, source):
+        try:
+            # Folder images and unpaced files wait for the dispatcher instead
+            # of dropping frames
+            block = source.is_folder or not source.pace
+            for frame in source.frames(self.stopping):
+                source.captured += 1
+                source.latest.put(frame, block=block)
+                self.ready.set()
+        finally:
+            source.finished = True
+            source.latest.close()
+            self.ready.set()
+
+    def _on_result(self, source, future):
+        self.in_flight.release()
+        try:
+            detections = future.result()
+        except Exception as e:
+            print(f"Error detecting pests from {source.name}: {e}")
+            return
+        with self.lock:
+            source.processed += 1
+        if detections:
+            self.record(detections, location=source.name)
+
+    def _dispatch(self, pool):
+        """Submit frames round-robin until every source is finished and drained."""
+        while not self.stopping.is_set():
+            self.ready.clear()
+            submitted = False
+            for source in self.sources:
+                frame = source.latest.get(timeout=0)
+                if frame is None:
+                    continue
+                self.in_flight.acquire()
+                future = pool.submit(_detect, frame)
+                future.add_done_callback(lambda f, source=source: self._on_result(source, f))
+                submitted = True
+
+            if not submitted:
+                if all(source.finished and not len(source.latest) for source in self.sources):
+                    break
+                self.ready.wait(0.1)
+
+    def stats(self):
+        elapsed = time.perf_counter() - self.started if self.started else 0.0
+        per_source = {
+            source.name: {
+                'captured': source.captured,
+                'processed': source.processed,
+                'dropped': source.latest.dropped,
+            } for source in self.sources
+        }
+        processed = sum(source.processed for source in self.sources)
+        return {
+            'elapsed_s': round(elapsed, 2),
+            'workers': self.workers,
+            'processed_fps': round(processed / elapsed, 2) if elapsed else 0.0,
+            'sources': per_source,
+        }
+
+    def _report(self):
+        while not self.stopping.wait(self.report_interval):
+            stats = self.stats()
+            print(f"[ingest] {stats['processed_fps']} fps over {len(self.sources)} sources: " +
+                  ", ".join(f"{name} {s['processed']}/{s['captured']}" for name, s in stats['sources'].items()))
+
+    def run(self):
+        """Run until all sources end or Ctrl+C; returns stats()."""
+        self.started = time.perf_counter()
+        with ProcessPoolExecutor(self.workers, initializer=_init_worker, initargs=(self.model_path,)) as pool:
+            threads = [threading.Thread(target=self._capture, args=(source,), name=f"capture-{source.name}")
+                       for source in self.sources]
+            if self.report_interval:
+                threads.append(threading.Thread(target=self._report, name="ingest-report"))
+            for thread in threads:
+                thread.daemon = True
+                thread.start()
+            try:
+                self._dispatch(pool)
+            except KeyboardInterrupt:
+                pass
+            finally:
+                self.stopping.set()
+                for source in self.sources:
+                    source.latest.close()
+        # Leaving the with-block waits for in-flight frames
+        stats = self.stats()
+        print(f"[ingest] done: {stats}")
+        return stats
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Multi-source real-time pest detection")
+    parser.add_argument("--source", action="append", required=True,
+                        help="[name=]camera index, video file/URL or image folder; repeatable")
+    parser.add_argument("--workers", type=int, help="Inference processes (default: all cores)")
+    parser.add_argument("--model", type=str, help="Path to the model artifact")
+    parser.add_argument("--no-pace", action="store_true",
+                        help="Process every frame of recorded files as fast as possible")
+    args = parser.parse_args()
+
+    from app.excel_integration import init_excel_connector, cleanup
+
+    init_excel_connector()
+    try:
+        sources = [Source(spec, pace=not args.no_pace) for spec in args.source]
+        MultiSourceIngest(sources, workers=args.workers, model_path=args.model).run()
+    finally:
+        cleanup()
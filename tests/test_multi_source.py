@@ -0,0 +1,24 @@
+"""Source specs given on the multi_source command line."""
+from multi_source import Source, parse_spec
+
+
+def test_name_prefix():
+    assert parse_spec('barn=2') == ('barn', '2')
+    source = Source('barn=rtsp://cam.local/stream')
+    assert (source.name, source.target) == ('barn', 'rtsp://cam.local/stream')
+
+
+def test_url_query_string_is_not_a_name():
+    source = Source('rtsp://cam.local/stream?channel=1')
+    assert source.target == 'rtsp://cam.local/stream?channel=1'
+    assert source.name == 'stream?channel=1'
+
+
+def test_named_url_with_query_string():
+    source = Source('gate=http://h/video.mjpg?user=a&pw=b')
+    assert (source.name, source.target) == ('gate', 'http://h/video.mjpg?user=a&pw=b')
+
+
+def test_camera_index():
+    source = Source('0')
+    assert (source.name, source.target) == ('camera-0', 0)
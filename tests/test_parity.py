@@ -0,0 +1,98 @@
+"""The web app and video loop give the answers the original pipeline gave.
+
+The expectations come from the pipeline the classifier was trained with
+and both entry points used before they shared an engine: color decode,
+cvtColor, resize to 128x128, flatten, / 255 and predict.
+"""
+import cv2
+import joblib
+import numpy as np
+import pytest
+
+import app.model_loader
+from app.model import PestDetectionModel
+from app.schema import PEST_TYPES
+from new_ml_2 import PestDetector
+
+
+def synthetic_image(rng, cls):
+    """A 640x480 frame with stripes at a class-specific spacing, plus noise."""
+    image = np.full((480, 640, 3), 90, np.uint8)
+    spacing = 12 + 8 * cls
+    image[:, ::spacing] = 230
+    image[::spacing] = 230
+    return cv2.add(image, rng.integers(0, 60, image.shape, dtype=np.uint8))
+
+
+def encode(image):
+    return cv2.imencode('.jpg', image)[1].tobytes()
+
+
+def baseline_features(image_bytes):
+    """The original preprocessing of one upload."""
+    image = cv2.imdecode(np.frombuffer(image_bytes, np.uint8), cv2.IMREAD_COLOR)
+    gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
+    resized = cv2.resize(gray, (128, 128))
+    return resized.flatten() / 255.0
+
+
+def baseline_predictions(model_path, payloads):
+    """(detections, confidence) per payload as the original pipeline scored them."""
+    forest = joblib.load(model_path)
+    probabilities = forest.predict_proba([baseline_features(data) for data in payloads])
+    results = []
+    for cls, row in zip(forest.predict([baseline_features(data) for data in payloads]), probabilities):
+        results.append(({PEST_TYPES[cls]: 1}, row.max()))
+    return results
+
+
+@pytest.fixture(scope='module')
+def payloads():
+    rng = np.random.default_rng(1)
+    images = [synthetic_image(rng, i % len(PEST_TYPES)) for i in range(24)]
+    # Some pure noise, which the classifier is unsure of
+    images += [rng.integers(0, 256, (480, 640, 3), dtype=np.uint8) for _ in range(6)]
+    return [encode(image) for image in images]
+
+
+@pytest.fixture(scope='module')
+def model_path(tmp_path_factory):
+    from sklearn.ensemble import RandomForestClassifier
+
+    rng = np.random.default_rng(0)
+    labels = [cls for cls in range(len(PEST_TYPES)) for _ in range(8)]
+    features = [baseline_features(encode(synthetic_image(rng, cls))) for cls in labels]
+    forest = RandomForestClassifier(n_estimators=20, random_state=0).fit(features, labels)
+    path = tmp_path_factory.mktemp('model') / 'model.pkl'
+    joblib.dump(forest, path)
+    return str(path)
+
+
+@pytest.fixture(autouse=True)
+def cache_dir(monkeypatch, tmp_path):
+    # The loader's memory-mapped copies go to the test's own directory
+    monkeypatch.setattr(app.model_loader, 'CACHE_DIR', str(tmp_path / 'cache'))
+
+
+def test_uploads_match_the_original_pipeline(model_path, payloads):
+    web = PestDetectionModel(model_path, tiled=False, backend='sklearn', cascade=False)
+    predictions = web.predict_batch([web.decode(data) for data in payloads])
+
+    for prediction, (detections, confidence) in zip(predictions, baseline_predictions(model_path, payloads)):
+        assert prediction['detections'] == detections
+        [pest] = detections
+        assert prediction['confidence'][pest] == pytest.approx(confidence)
+
+
+def test_video_frames_match_the_original_pipeline(model_path, payloads):
+    video = PestDetector(model_path, tiled=False, backend='sklearn', cascade=False)
+    frames = [cv2.imdecode(np.frombuffer(data, np.uint8), cv2.IMREAD_COLOR) for data in payloads]
+
+    expected = [detections for detections, _ in baseline_predictions(model_path, payloads)]
+    assert [video.detect(frame) for frame in frames] == expected
+
+
+def test_single_and_batched_calls_agree(model_path, payloads):
+    web = PestDetectionModel(model_path, tiled=False, backend='sklearn', cascade=False)
+    images = [web.decode(data) for data in payloads]
+    assert [web.detect(image) for image in images] == web.detect_batch(images)
@@ -0,0 +1,410 @@
+import os
+import threading
+import time
+from collections import deque
+
+import cv2
+import numpy as np
+
+
+class DropOldestQueue:
+    """Bounded queue that discards its oldest item instead of blocking the producer.
+
+    A maxsize of None never drops anything.
+    """
+
+    def __init__(self, maxsize):
+        self.items = deque()
+        self.maxsize = maxsize
+        self.condition = threading.Condition()
+        self.dropped = 0
+        self.closed = False
+
+    def put(self, item, block=False):
+        """Add an item, dropping the oldest when full (or waiting for room if block)."""
+        with self.condition:
+            full = self.maxsize is not None
+            while block and full and len(self.items) >= self.maxsize and not self.closed:
+                self.condition.wait()
+            if full and len(self.items) >= self.maxsize:
+                self.items.popleft()
+                self.dropped += 1
+            self.items.append(item)
+            self.condition.notify_all()
+
+    def get(self, timeout=None):
+        """Return the next item, or None once the queue is closed and empty."""
+        with self.condition:
+            deadline = None if timeout is None else time.monotonic() + timeout
+            while not self.items and not self.closed:
+                remaining = None if deadline is None else deadline - time.monotonic()
+                if remaining is not None and remaining <= 0:
+                    return None
+                self.condition.wait(remaining)
+            if not self.items:
+                return None
+            item = self.items.popleft()
+            self.condition.notify_all()
+            return item
+
+    def close(self):
+        with self.condition:
+            self.closed = True
+            self.condition.notify_all()
+
+    def __len__(self):
+        return len(self.items)
+
+
+class MotionGate:
+    """Cheap change detector deciding which frames are worth running the model on.
+
+    Each frame is shrunk by scale to a blurred grayscale image and compared
+    with the last frame let through. The image is split into square
+    regions of cell pixels and the frame passes when, in any region, more than
+    region_threshold of the pixels changed by more than pixel_threshold
+    grey levels; per-region fractions keep one small insect in a corner
+    from being averaged away. A frame also passes when the last one let
+    through is older than max_age seconds, so slow lighting drift can't
+    hold an old result forever.
+    """
+
+    def __init__(self, scale=0.25, pixel_threshold=25, region_threshold=0.005, cell=32, max_age=30.0):
+        # A relative scale and fixed-size regions, so an insect is the same
+        # share of a region whatever the camera's resolution
+        self.scale = scale
+        self.pixel_threshold = pixel_threshold
+        self.region_threshold = region_threshold
+        self.cell = cell
+        self.max_age = max_age
+        self.reference = None
+        self.reference_time = None
+        self.checked = 0
+        self.skipped = 0
+        self.seconds = 0.0
+
+    def _small(self, image):
+        height, width = image.shape[:2]
+        # Both sides a multiple of the cell so regions reshape evenly
+        small_width = max(self.cell, round(width * self.scale / self.cell) * self.cell)
+        small_height = max(self.cell, round(height * self.scale / self.cell) * self.cell)
+        # Bilinear sampling costs the same at any input size (INTER_AREA reads
+        # every pixel); the blur below evens out the aliased sensor noise
+        small = cv2.resize(image, (small_width, small_height), interpolation=cv2.INTER_LINEAR)
+        if small.ndim == 3:
+            small = cv2.cvtColor(small, cv2.COLOR_BGR2GRAY)
+        return cv2.GaussianBlur(small, (5, 5), 0)
+
+    def changed(self, image, now):
+        """Return True if image differs enough from the last frame let through."""
+        start = time.perf_counter()
+        small = self._small(image)
+        if self.reference is None or now - self.reference_time >= self.max_age:
+            changed = True
+        else:
+            moved = cv2.absdiff(small, self.reference) > self.pixel_threshold
+            height, width = moved.shape
+            regions = moved.reshape(height // self.cell, self.cell, width // self.cell, self.cell).mean(axis=(1, 3))
+            changed = regions.max() > self.region_threshold
+        if changed:
+            self.reference = small
+            self.reference_time = now
+        else:
+            self.skipped += 1
+        self.checked += 1
+        self.seconds += time.perf_counter() - start
+        return changed
+
+    def stats(self):
+        return {
+            'checked': self.checked,
+            'skipped': self.skipped,
+            'skip_ratio': round(self.skipped / self.checked, 4) if self.checked else 0.0,
+            'gate_ms': round(self.seconds / self.checked * 1000.0, 3) if self.checked else 0.0,
+        }
+
+
+class Frame:
+    """A captured frame on its way through the pipeline."""
+
+    __slots__ = ('index', 'image', 'captured', 'detections', 'inferred', 'reused')
+
+    def __init__(self, index, image, captured):
+        self.index = index
+        self.image = image
+        self.captured = captured
+        self.detections = None
+        self.inferred = None
+        self.reused = False
+
+
+class VideoPipeline:
+    """Capture -> inference -> sink pipeline for one video source.
+
+    The capture thread grabs every frame and forwards them to inference
+    spaced by the measured inference latency, so spare compute is used and
+    nothing piles up; in headless mode skipped frames are never decoded.
+    Forwarded frames go through a bounded drop-oldest queue to the inference
+    workers; their results go to the sink through an unbounded queue, so a
+    computed detection is never lost while the sink is busy coalescing
+    detections into periodic Excel updates. Video files are read at
+    their own frame rate, like a camera, unless pace is False. With headless=False the latest frame is shown from the
+    calling thread with the latest detections drawn on it.
+
+    With a MotionGate, a forwarded frame that hasn't changed since the last
+    one inferred on skips the model and goes straight to the sink with the
+    latest result, so a static scene is still counted at the same rate.
+    """
+
+    def __init__(self, detector, source=0, excel_path=None, headless=False,
+                 workers=1, queue_size=4, excel_interval=2.0, report_interval=10.0, gate=None, pace=True):
+        self.detector = detector
+        self.gate = gate
+        self.source = source
+        self.pace = pace
+        self.excel_path = excel_path
+        self.headless = headless
+        self.workers = max(1, workers)
+        self.excel_interval = excel_interval
+        self.report_interval = report_interval
+
+        # Only input frames are dropped; the sink coalesces counts, so the
+        # results it hasn't got to yet stay small
+        self.frames = DropOldestQueue(queue_size)
+        self.results = DropOldestQueue(None)
+        self.display = DropOldestQueue(1)
+        self.stopping = threading.Event()
+        self.threads = []
+
+        # Measured inference time, smoothed; drives frame skipping
+        self.inference_ewma = None
+        self.stats_lock = threading.Lock()
+        self.captured = 0
+        self.forwarded = 0
+        self.processed = 0
+        self.latencies = deque(maxlen=1000)
+        self.started = None
+
+        # Detections not yet written to Excel, the latest ones for display,
+        # and the latest model result, reused for frames the gate skips
+        self.pending = {}
+        self.last_detections = {}
+        self.last_result = None
+        self.last_excel = 0.0
+
+    def _record_inference(self, seconds):
+        with self.stats_lock:
+            if self.inference_ewma is None:
+                self.inference_ewma = seconds
+            else:
+                self.inference_ewma = 0.8 * self.inference_ewma + 0.2 * seconds
+
+    def _forward_interval(self):
+        """Seconds between forwarded frames that the inference workers can sustain."""
+        if self.inference_ewma is None:
+            return 0.0
+        return self.inference_ewma / self.workers
+
+    def _frame_interval(self, cap):
+        """Seconds between frames when replaying a video file at its native rate, else 0."""
+        is_file = isinstance(self.source, str) and os.path.isfile(self.source)
+        if not is_file or not self.pace:
+            return 0.0
+        return 1.0 / (cap.get(cv2.CAP_PROP_FPS) or 30.0)
+
+    def _capture(self, cap):
+        last_forward = 0.0
+        index = 0
+        interval = self._frame_interval(cap)
+        next_frame = time.perf_counter()
+        try:
+            while not self.stopping.is_set():
+                if interval:
+                    time.sleep(max(0.0, next_frame - time.perf_counter()))
+                    next_frame += interval
+                # grab() reads the frame without decoding it
+                if not cap.grab():
+                    break
+                now = time.perf_counter()
+                self.captured += 1
+
+                forward = now - last_forward >= self._forward_interval()
+                # Frames are only decoded when inferred on or displayed
+                if forward or not self.headless:
+                    ok, image = cap.retrieve()
+                    if ok:
+                        frame = Frame(index, image, now)
+                        if forward:
+                            last_forward = now
+                            self.forwarded += 1
+                            self._forward(frame, now)
+                        if not self.headless:
+                            self.display.put(frame)
+                index += 1
+        finally:
+            self.frames.close()
+
+    def _forward(self, frame, now):
+        """Queue a frame for inference, or reuse the latest result if the gate says nothing changed."""
+        if self.gate is None or self.last_result is None or self.gate.changed(frame.image, now):
+            self.frames.put(frame)
+            return
+        frame.detections = self.last_result
+        frame.inferred = time.perf_counter()
+        frame.reused = True
+        self.results.put(frame)
+
+    def _infer(self):
+        while True:
+            frame = self.frames.get()
+            if frame is None:
+                break
+            start = time.perf_counter()
+            try:
+                frame.detections = self.detector.detect(frame.image)
+            except Exception as e:
+                print(f"Error detecting pests: {e}")
+                frame.detections = {}
+            else:
+                self.last_result = frame.detections
+            frame.inferred = time.perf_counter()
+            self._record_inference(frame.inferred - start)
+            self.results.put(frame)
+
+    def _sink(self):
+        while True:
+            frame = self.results.get(timeout=0.5)
+            if frame is not None:
+                done = time.perf_counter()
+                with self.stats_lock:
+                    self.processed += 1
+                    self.latencies.append(done - frame.captured)
+                for pest, count in frame.detections.items():
+                    self.pending[pest] = self.pending.get(pest, 0) + count
+                self.last_detections = frame.detections
+            elif self.results.closed:
+                break
+
+            self._flush_excel()
+        self._flush_excel(force=True)
+
+    def _flush_excel(self, force=False):
+        """Write coalesced detections at most once per excel_interval."""
+        now = time.monotonic()
+        if not self.pending or not self.excel_path:
+            return
+        if not force and now - self.last_excel < self.excel_interval:
+            return
+        pending, self.pending = self.pending, {}
+        self.last_excel = now
+        self.write_excel(pending)
+
+    def write_excel(self, detections):
+        """Persist coalesced detections; overridden by callers with other sinks."""
+        self.detector.update_excel(detections, self.excel_path)
+
+    def stats(self):
+        """Sustained throughput and end-to-end latency so far."""
+        elapsed = time.perf_counter() - self.started if self.started else 0.0
+        with self.stats_lock:
+            latencies = np.array(self.latencies) * 1000.0
+            processed = self.processed
+            inference = self.inference_ewma
+        return {
+            'elapsed_s': round(elapsed, 2),
+            'capture_fps': round(self.captured / elapsed, 2) if elapsed else 0.0,
+            'processed_fps': round(processed / elapsed, 2) if elapsed else 0.0,
+            'captured': self.captured,
+            'forwarded': self.forwarded,
+            'processed': processed,
+            'dropped': self.frames.dropped + self.results.dropped,
+            'inference_ms': round(inference * 1000.0, 2) if inference else None,
+            'latency_p50_ms': round(float(np.percentile(latencies, 50)), 2) if len(latencies) else None,
+            'latency_p95_ms': round(float(np.percentile(latencies, 95)), 2) if len(latencies) else None,
+            'gate': self._gate_stats(inference),
+        }
+
+    def _gate_stats(self, inference):
+        """The gate's skip ratio and cost, and the inference time it saved (estimated from the average)."""
+        if self.gate is None:
+            return None
+        stats = self.gate.stats()
+        stats['saved_s'] = round(stats['skipped'] * (inference or 0.0), 2)
+        return stats
+
+    def _print_stats(self):
+        stats = self.stats()
+        print(
+            f"[pipeline] capture {stats['capture_fps']} fps, processed {stats['processed_fps']} fps, "
+            f"inference {stats['inference_ms']} ms, latency p50 {stats['latency_p50_ms']} ms "
+            f"p95 {stats['latency_p95_ms']} ms, dropped {stats['dropped']}"
+        )
+        gate = stats['gate']
+        if gate:
+            print(
+                f"[gate] skipped {gate['skipped']}/{gate['checked']} frames ({gate['skip_ratio']:.0%}), "
+                f"{gate['gate_ms']} ms/frame, ~{gate['saved_s']} s of inference saved"
+            )
+
+    def _start_thread(self, target, *args, name=None):
+        thread = threading.Thread(target=target, args=args, name=name)
+        thread.daemon = True
+        thread.start()
+        self.threads.append(thread)
+        return thread
+
+    def run(self):
+        """Run until the source ends, 'q' is pressed or stop() is called; returns stats()."""
+        cap = cv2.VideoCapture(self.source)
+        if not cap.isOpened():
+            print(f"Error: Could not open video source {self.source}")
+            return None
+
+        self.started = time.perf_counter()
+        capture = self._start_thread(self._capture, cap, name='pipeline-capture')
+        workers = [self._start_thread(self._infer, name=f'pipeline-infer-{i}') for i in range(self.workers)]
+        sink = self._start_thread(self._sink, name='pipeline-sink')
+
+        last_report = time.monotonic()
+        try:
+            while capture.is_alive() or any(worker.is_alive() for worker in workers):
+                if not self.headless:
+                    frame = self.display.get(timeout=0.05)
+                    if frame is not None:
+                        self._show(frame)
+                    if cv2.waitKey(1) & 0xFF == ord('q'):
+                        break
+                else:
+                    time.sleep(0.05)
+
+                if self.report_interval and time.monotonic() - last_report >= self.report_interval:
+                    last_report = time.monotonic()
+                    self._print_stats()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            self.stop()
+            capture.join()
+            for worker in workers:
+                worker.join()
+            self.results.close()
+            sink.join()
+            cap.release()
+            if not self.headless:
+                cv2.destroyAllWindows()
+
+        self._print_stats()
+        return self.stats()
+
+    def stop(self):
+        self.stopping.set()
+
+    def _show(self, frame):
+        # Draw on a copy; the same frame may still be in inference
+        image = frame.image.copy()
+        for i, (pest, count) in enumerate(self.last_detections.items()):
+            cv2.putText(
+                image, f"{pest}: {count}", (10, 30 + 35 * i),
+                cv2.FONT_HERSHEY_SIMPLEX, 1, (0, 255, 0), 2
+            )
+        cv2.imshow("Pest Detection", image)